@@ -1,74 +1,96 @@
 import json
-import requests
-from typing import Dict, Any
-import streamlit as st
+import httpx
+from typing import Any, Callable, Dict, Optional
+from common.aio import run_sync
+from common.singleflight import coalesce
+from common.http_client import post, post_stream
+from common.completion_cache import completion_cache_key, get_completion_cache
+from common.config import Config, get_config
+from common.metrics import record_cache
+from common.prompts import build_prompt, compact_answer, compact_context, compact_json, count_tokens
+from common.output_budget import finish_truncated, output_token_budget, record_output_lengths
 
-def format_with_azure_openai(place_name: str, google_places_data: Dict[str, Any], perplexity_data: str) -> Dict[str, Any]:
+AZURE_MAX_TOKENS = 2000
+STREAM_USAGE_MIN_API_VERSION = "2024-06-01"
+
+# Researched fields that must be present for a directly structured completion to skip Azure formatting
+CONTENT_FIELDS = ["Hotel Brand", "Why we love it", "Everything you need to know", "Product Details"]
+# Every output field, in the order the Azure prompt asks for them
+REQUIRED_FIELDS = [
+    "Name of Stay", "Hotel Brand", "Price: In INR", "Crew Exclusive Price",
+    "Why we love it", "Everything you need to know", "Product Details"
+]
+
+AZURE_PROMPT_TEMPLATE = """
+You are a travel accommodation data formatting expert. Format the data below into a specific JSON structure for a travel crew's accommodation listings.
+
+Place Name (user input): {place_name}
+Google Places data: {google_places_data}
+Perplexity recommendation data: {perplexity_data}
+
+Return ONLY a JSON object with exactly these fields, no additional text:
+{{
+    "Name of Stay": "Exactly the user input",
+    "Hotel Brand": "Hotel brand/chain if it is a known chain (Marriott, Hilton, Taj, etc.), otherwise 'To be filled'",
+    "Price: In INR": "To be filled",
+    "Crew Exclusive Price": "To be filled",
+    "Why we love it": "Compelling, personal 1-2 sentence recommendation based on the Perplexity data and Google description: what makes this place special and why someone should choose it",
+    "Everything you need to know": "Comprehensive list of amenities, features and inclusions combined from the Google and Perplexity data: pool, views, pet policy, family facilities, romantic features, etc.",
+    "Product Details": "Accommodation type and category, room types, area/location details and other specific property details"
+}}
+
+Use "To be filled" for any field the data does not cover.
+"""
+
+
+@coalesce
+async def format_with_azure_openai_async(place_name: str, google_places_data: Dict[str, Any], perplexity_data: str, use_cache: bool = True, refresh: bool = False, on_token: Optional[Callable[[str], None]] = None, config: Optional[Config] = None) -> Dict[str, Any]:
     """
     Format the combined data using Azure OpenAI to create the final structured output
     
     Args:
         place_name: Original place name from user input
         google_places_data: Output from Google Places API
-        perplexity_data: Raw response string from Perplexity
+        perplexity_data: Perplexity result dictionary or its raw response string
+        use_cache: Read from and write to the on-disk completion cache
+        refresh: Skip the cached completion and overwrite it with a fresh one
+        on_token: Stream the answer, calling this with each piece of text as it arrives
+        config: Settings to use instead of the process-wide config
         
     Returns:
         Formatted dictionary with the new field structure or error
     """
     
     # Azure OpenAI configuration
-    azure_endpoint = st.secrets["azure_openai"]["endpoint"]
-    api_key = st.secrets["api_keys"]["azure_openai"]
-    deployment_name = st.secrets["azure_openai"]["deployment_name"]
-    api_version = st.secrets["azure_openai"]["api_version"]
+    config = config or get_config()
+    azure_endpoint = config.base_url("azure_openai")
+    api_key = config.api_key("azure_openai")
+    deployment_name = config["azure_openai"]["deployment_name"]
+    api_version = config["azure_openai"]["api_version"]
     
-    # Construct the formatting prompt
-    prompt = f"""
-You are a travel accommodation data formatting expert. Format the following data into a specific JSON structure for a travel crew's accommodation listings.
-
-USER INPUT:
-Place Name: {place_name}
-
-GOOGLE PLACES DATA:
-{json.dumps(google_places_data, indent=2)}
-
-PERPLEXITY RECOMMENDATION DATA:
-{perplexity_data if perplexity_data else 'No data available'}
-
-FORMATTING INSTRUCTIONS:
-Create a JSON object with exactly these fields in the new format:
-
-1. Name of Stay: Use the original place name from user input
-2. Hotel Brand: Extract hotel brand/chain name if available from the data, otherwise "To be filled"
-3. Price: In INR: Always set to "To be filled" (pricing not available in source data)
-4. Crew Exclusive Price: Always set to "To be filled"
-5. Why we love it: Create a compelling recommendation based on Perplexity data and Google description - focus on what makes this place special and why someone should choose it
-6. Everything you need to know: Combine all amenities, features, and inclusions from both Google and Perplexity data. Include information about pool, views, pet policy, family facilities, romantic features, etc. Format as a comprehensive list.
-7. Product Details: Include room types, accommodation category, area/location details, and any specific property details. Use Category from Perplexity data and area information.
-
-IMPORTANT RULES:
-- "Name of Stay" should be the exact user input
-- "Hotel Brand" should be extracted if it's a known chain (Marriott, Hilton, Taj, etc.), otherwise "To be filled"
-- "Price: In INR" and "Crew Exclusive Price" are always "To be filled"
-- "Why we love it" should be a compelling, personal recommendation (1-2 sentences)
-- "Everything you need to know" should be comprehensive amenities/features list
-- "Product Details" should include accommodation type, room details, location specifics
-- If any field is missing or unclear, use appropriate defaults:
-  - Text fields: "To be filled" or "Not available"
-
-Return ONLY the JSON object, no additional text.
-
-Expected JSON structure:
-{{
-    "Name of Stay": "string",
-    "Hotel Brand": "string", 
-    "Price: In INR": "To be filled",
-    "Crew Exclusive Price": "To be filled",
-    "Why we love it": "string",
-    "Everything you need to know": "string",
-    "Product Details": "string",
-}}
-"""
+    # Construct the formatting prompt from compact context; long research text is trimmed to the input-token budget
+    prompt, prompt_tokens = build_prompt(
+        "azure_openai",
+        AZURE_PROMPT_TEMPLATE,
+        {
+            "place_name": place_name,
+            "google_places_data": compact_json(compact_context(google_places_data)),
+        },
+        trimmable={"perplexity_data": compact_answer(perplexity_data) or "No data available"},
+        config=config,
+    )
+
+    # Identical prompts at temperature 0 give the same answer, so reuse a cached completion
+    completion_cache = get_completion_cache(config) if use_cache else None
+    cache_key = completion_cache_key("azure_openai", deployment_name, AZURE_PROMPT_TEMPLATE, prompt, AZURE_MAX_TOKENS)
+    if completion_cache is not None and not refresh:
+        cached_content = completion_cache.get(cache_key)
+        record_cache("azure_openai", cached_content is not None)
+        if cached_content is not None:
+            print(f"Azure OpenAI cache hit for '{place_name}'")
+            if on_token is not None:
+                on_token(cached_content)
+            return parse_formatted_output(cached_content, place_name)
 
     # Azure OpenAI API call
     url = f"{azure_endpoint}/openai/deployments/{deployment_name}/chat/completions?api-version={api_version}"
@@ -78,65 +100,71 @@ Expected JSON structure:
         "api-key": api_key
     }
     
-    payload = {
-        "messages": [
-            {
-                "role": "user",
-                "content": prompt
-            }
-        ],
-        "temperature": 0,
-        "max_tokens": 2000
-    }
+    # The output budget earlier answers to this prompt needed
+    max_tokens = output_token_budget("azure_openai", AZURE_PROMPT_TEMPLATE, AZURE_MAX_TOKENS, config)
+    messages = [
+        {
+            "role": "user",
+            "content": prompt
+        }
+    ]
+
+    async def complete(messages, max_tokens):
+        payload = {
+            "messages": messages,
+            "temperature": 0,
+            "max_tokens": max_tokens
+        }
+        estimated_tokens = prompt_tokens + sum(count_tokens(message["content"]) for message in messages[1:]) + max_tokens
+        if on_token is not None:
+            stream_payload = {**payload, "stream": True}
+            # Streamed answers only report token usage when asked to (API version 2024-06-01 and later)
+            if api_version >= STREAM_USAGE_MIN_API_VERSION:
+                stream_payload["stream_options"] = {"include_usage": True}
+            return await post_stream(
+                "azure_openai",
+                url,
+                on_token,
+                estimated_tokens=estimated_tokens,
+                headers=headers,
+                json=stream_payload,
+                config=config,
+            )
+        response = await post(
+            "azure_openai",
+            url,
+            estimated_tokens=estimated_tokens,
+            headers=headers,
+            json=payload,
+            config=config,
+        )
+        response.raise_for_status()
+        return response.json()
     
     try:
         # Make the API request
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        
-        # Parse response
-        response_data = response.json()
+        response_data = await complete(messages, max_tokens)
         
         # Extract the content from the response
         if 'choices' in response_data and len(response_data['choices']) > 0:
             content = response_data['choices'][0]['message']['content']
+            complete_answer = True
+            if response_data['choices'][0].get('finish_reason') == 'length':
+                # Continue or repair a cut-off answer instead of failing the run
+                content, complete_answer = await finish_truncated("azure_openai", complete, prompt, content, max_tokens, AZURE_MAX_TOKENS)
             
-            # Clean and parse the JSON response
-            try:
-                content = content.strip()
-                if content.startswith('```json'):
-                    content = content[7:]
-                if content.endswith('```'):
-                    content = content[:-3]
-                content = content.strip()
-                
-                formatted_data = json.loads(content)
-                
-                # Validate and ensure all required fields are present
-                required_fields = [
-                    "Name of Stay", "Hotel Brand", "Price: In INR", "Crew Exclusive Price",
-                    "Why we love it", "Everything you need to know", "Product Details"
-                ]
-                
-                # Ensure all required fields are present with defaults
-                for field in required_fields:
-                    if field not in formatted_data:
-                        if field in ["Price: In INR", "Crew Exclusive Price"]:
-                            formatted_data[field] = "To be filled"
-                        elif field == "Name of Stay":
-                            formatted_data[field] = place_name
-                        else:
-                            formatted_data[field] = "To be filled"
-                
-                return formatted_data
-                
-            except json.JSONDecodeError as e:
-                return {"error": f"Failed to parse Azure OpenAI response as JSON: {str(e)}"}
+            formatted_data = parse_formatted_output(content, place_name)
+            # Repaired answers are incomplete, so they are neither cached nor used as length samples
+            if "error" not in formatted_data and complete_answer:
+                record_output_lengths("azure_openai", AZURE_PROMPT_TEMPLATE, content, config)
+                if completion_cache is not None:
+                    completion_cache.set(cache_key, content)
+            return formatted_data
                 
         else:
             return {"error": "No valid response received from Azure OpenAI"}
             
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         error_msg = f"Azure OpenAI API request failed: {str(e)}"
         if hasattr(e, 'response') and e.response is not None:
             try:
@@ -148,3 +176,84 @@ Expected JSON structure:
     except Exception as e:
         return {"error": f"Unexpected error in Azure OpenAI formatting: {str(e)}"}
 
+
+def format_with_azure_openai(place_name: str, google_places_data: Dict[str, Any], perplexity_data: str, use_cache: bool = True, refresh: bool = False, on_token: Optional[Callable[[str], None]] = None, config: Optional[Config] = None) -> Dict[str, Any]:
+    """Blocking wrapper around format_with_azure_openai_async"""
+    return run_sync(format_with_azure_openai_async(place_name, google_places_data, perplexity_data, use_cache=use_cache, refresh=refresh, on_token=on_token, config=config))
+
+
+def _load_json_content(content: str) -> Any:
+    """Strip an optional ```json fence from a completion and parse it"""
+    content = content.strip()
+    if content.startswith('```json'):
+        content = content[7:]
+    if content.endswith('```'):
+        content = content[:-3]
+    content = content.strip()
+    return json.loads(content)
+
+
+def _apply_field_defaults(formatted_data: Dict[str, Any], place_name: str) -> Dict[str, Any]:
+    """Fill any missing output field with its default value"""
+    # Ensure all required fields are present with defaults
+    for field in REQUIRED_FIELDS:
+        if field not in formatted_data:
+            if field in ["Price: In INR", "Crew Exclusive Price"]:
+                formatted_data[field] = "To be filled"
+            elif field == "Name of Stay":
+                formatted_data[field] = place_name
+            else:
+                formatted_data[field] = "To be filled"
+    
+    return formatted_data
+
+
+def parse_formatted_output(content: str, place_name: str) -> Dict[str, Any]:
+    """
+    Parse a formatting completion into the final field structure, filling defaults for missing fields
+    
+    Args:
+        content: Raw completion text, optionally wrapped in a ```json fence
+        place_name: Original place name from user input
+        
+    Returns:
+        Formatted dictionary or error
+    """
+    try:
+        return _apply_field_defaults(_load_json_content(content), place_name)
+    except json.JSONDecodeError as e:
+        return {"error": f"Failed to parse Azure OpenAI response as JSON: {str(e)}"}
+
+
+def validate_structured_output(content: str, place_name: str) -> Dict[str, Any]:
+    """
+    Locally validate a completion that was asked for the final field schema directly
+    
+    The fixed fields are set the way format_with_azure_openai is instructed to set them, and
+    missing optional fields get the same defaults. Missing or empty researched fields fail
+    validation so the caller can fall back to the Azure formatting call.
+    
+    Args:
+        content: Raw completion text, optionally wrapped in a ```json fence
+        place_name: Original place name from user input
+        
+    Returns:
+        Formatted dictionary or error
+    """
+    try:
+        formatted_data = _load_json_content(content)
+    except json.JSONDecodeError as e:
+        return {"error": f"Structured output is not valid JSON: {str(e)}"}
+    if not isinstance(formatted_data, dict):
+        return {"error": "Structured output is not a JSON object"}
+
+    missing_fields = [field for field in CONTENT_FIELDS if not str(formatted_data.get(field, "")).strip()]
+    if missing_fields:
+        return {"error": f"Structured output is missing fields: {', '.join(missing_fields)}"}
+
+    formatted_data["Name of Stay"] = place_name
+    for field in ["Price: In INR", "Crew Exclusive Price"]:
+        formatted_data[field] = "To be filled"
+    formatted_data = _apply_field_defaults(formatted_data, place_name)
+    # Anything else the model added (e.g. another category's fields) is dropped
+    return {field: formatted_data[field] for field in REQUIRED_FIELDS}
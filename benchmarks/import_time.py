@@ -0,0 +1,112 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Module sets a fresh Streamlit server process imports before it can render the first page
+IMPORT_SCENARIOS = {
+    # What main.py imported at the top of every run before category pipelines were loaded lazily
+    "eager (both categories + photos)": [
+        "streamlit",
+        "common.aio",
+        "common.config",
+        "common.http_client",
+        "common.photos",
+        "accommodation.accommodation_populator",
+        "dining.dining_populator",
+    ],
+    "lazy first render": [
+        "streamlit",
+        "common.aio",
+        "common.config",
+        "common.http_client",
+    ],
+    "lazy after one lookup": [
+        "streamlit",
+        "common.aio",
+        "common.config",
+        "common.http_client",
+        "common.photos",
+        "accommodation.accommodation_populator",
+    ],
+}
+
+IMPORT_SNIPPET = """
+import importlib, json, sys, time
+started = time.perf_counter()
+for module in sys.argv[1:]:
+    importlib.import_module(module)
+print(json.dumps(time.perf_counter() - started))
+"""
+
+# Renders main.py with Streamlit's test harness: cold first render, a rerun, and a page switch
+APP_SNIPPET = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file(sys.argv[1], default_timeout=60)
+timings = {}
+started = time.perf_counter()
+app.run()
+timings["first render"] = time.perf_counter() - started
+started = time.perf_counter()
+app.run()
+timings["rerun"] = time.perf_counter() - started
+started = time.perf_counter()
+app.sidebar.selectbox[0].select("Dining").run()
+timings["page switch"] = time.perf_counter() - started
+loaded = sorted(name for name in ("accommodation.accommodation_populator", "dining.dining_populator", "common.photos", "PIL.Image") if name in sys.modules)
+print(json.dumps({"timings": timings, "loaded": loaded}))
+"""
+
+
+def _run_python(code: str, args: List[str]) -> str:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get("PYTHONPATH")])))
+    result = subprocess.run([sys.executable, "-c", code, *args], capture_output=True, text=True, env=env, check=True)
+    return result.stdout.strip().splitlines()[-1]
+
+
+def measure_imports(modules: List[str], repeats: int) -> List[float]:
+    """
+    Time importing a set of modules in fresh interpreters
+
+    Args:
+        modules: Module names, imported in order
+        repeats: Number of fresh interpreters to measure
+
+    Returns:
+        Import time of each run in seconds
+    """
+    return [json.loads(_run_python(IMPORT_SNIPPET, modules)) for _ in range(repeats)]
+
+
+def measure_app(repeats: int) -> List[Dict]:
+    """Time main.py under Streamlit's AppTest in fresh interpreters and record which pipeline modules it loaded"""
+    return [json.loads(_run_python(APP_SNIPPET, [os.path.join(REPO_DIR, "main.py")])) for _ in range(repeats)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare cold import time of eagerly and lazily loaded category pipelines")
+    parser.add_argument("--repeats", type=int, default=5, help="Fresh interpreters per scenario")
+    parser.add_argument("--skip-app", action="store_true", help="Only time module imports, not main.py itself")
+    args = parser.parse_args()
+
+    print(f"Cold import time, median of {args.repeats} fresh interpreters:")
+    for scenario, modules in IMPORT_SCENARIOS.items():
+        timings = measure_imports(modules, args.repeats)
+        print(f"  {scenario:<34} {statistics.median(timings) * 1000:8.1f} ms")
+
+    if not args.skip_app:
+        runs = measure_app(args.repeats)
+        print(f"main.py under AppTest, median of {args.repeats} fresh interpreters:")
+        for step in runs[0]["timings"]:
+            print(f"  {step:<34} {statistics.median(run['timings'][step] for run in runs) * 1000:8.1f} ms")
+        print(f"  pipeline modules loaded without a lookup: {', '.join(runs[0]['loaded']) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+import argparse
+import asyncio
+import importlib
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stand_ins import StandInProfile, serve_stand_ins
+from common.config import Config, set_config
+
+PROVIDERS = ("google_places", "perplexity", "azure_openai")
+POPULATOR_MODULES = {
+    "accommodation": "accommodation.accommodation_populator",
+    "dining": "dining.dining_populator",
+}
+# Rate limits used unless --production-limits is given, high enough that only the stand-ins set the pace
+UNTHROTTLED_LIMITS = {"requests_per_minute": 1_000_000, "tokens_per_minute": None}
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Linearly interpolated percentile, q between 0 and 100"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    return {
+        "p50_s": round(percentile(latencies, 50), 4),
+        "p95_s": round(percentile(latencies, 95), 4),
+        "p99_s": round(percentile(latencies, 99), 4),
+        "max_s": round(max(latencies), 4) if latencies else float("nan"),
+    }
+
+
+def build_config(urls: Dict[str, str], work_dir: str, args: argparse.Namespace) -> Config:
+    """Settings pointing every provider at its stand-in, with metrics written inside the work directory"""
+    settings: Dict[str, Any] = {
+        # The Perplexity client checks the key's prefix before sending anything
+        "api_keys": {"google_places": "stand-in-key", "perplexity": "pplx-stand-in-key", "azure_openai": "stand-in-key"},
+        "base_urls": {"google_places": urls["google_places"], "perplexity": urls["perplexity"]},
+        "azure_openai": {"endpoint": urls["azure_openai"], "deployment_name": "stand-in", "api_version": "2024-06-01"},
+        "metrics": {
+            "runs_path": os.path.join(work_dir, "runs.jsonl"),
+            # stage_breakdown reads every run of the benchmark from this one file
+            "runs_max_bytes": 0,
+            "prometheus_path": os.path.join(work_dir, "metrics.prom"),
+        },
+    }
+    if not args.production_limits:
+        settings["rate_limits"] = {provider: dict(UNTHROTTLED_LIMITS) for provider in PROVIDERS}
+    return Config(settings)
+
+
+async def _timed_populate(populate: Any, name: str, city: str, populate_options: Dict[str, Any]) -> Dict[str, Any]:
+    started = time.perf_counter()
+    try:
+        result = await populate(name, city, **populate_options)
+    except Exception as e:
+        result = {"error": f"Unexpected error: {str(e)}"}
+    return {"latency_s": time.perf_counter() - started, "error": result.get("error") if result else "No data returned"}
+
+
+async def run_single_shot(populate: Any, runs: int, populate_options: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Populate distinct places one after another"""
+    return [await _timed_populate(populate, f"Single Place {i}", "Benchmark City", populate_options) for i in range(runs)]
+
+
+async def run_bulk(populate: Any, rows: int, concurrency: int, populate_options: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Populate distinct places with up to concurrency calls in flight, like bulk_populate"""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def populate_with_limit(i: int) -> Dict[str, Any]:
+        async with semaphore:
+            return await _timed_populate(populate, f"Bulk Place {i}", "Benchmark City", populate_options)
+
+    return await asyncio.gather(*(populate_with_limit(i) for i in range(rows)))
+
+
+def measure_phase(name: str, coro: Any) -> Dict[str, Any]:
+    """Run one benchmark phase on the pipeline loop and summarize throughput, latency and peak memory"""
+    from common.aio import run_sync
+
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    results = run_sync(coro)
+    elapsed = time.perf_counter() - started
+    _, peak_bytes = tracemalloc.get_traced_memory()
+
+    latencies = [result["latency_s"] for result in results]
+    errors = [result["error"] for result in results if result["error"]]
+    return {
+        "phase": name,
+        "calls": len(results),
+        "errors": len(errors),
+        "error_examples": sorted(set(errors))[:3],
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(len(results) / elapsed, 3) if elapsed else float("nan"),
+        **latency_summary(latencies),
+        "peak_traced_mb": round(peak_bytes / 1_000_000, 2),
+    }
+
+
+def stage_breakdown(runs_path: str) -> Dict[str, Dict[str, float]]:
+    """Per-stage latency percentiles from the run summaries common.metrics wrote during the benchmark"""
+    durations: Dict[str, List[float]] = {}
+    if os.path.exists(runs_path):
+        with open(runs_path, encoding="utf-8") as f:
+            for line in f:
+                for span in json.loads(line)["stages"]:
+                    durations.setdefault(span["stage"], []).append(span["duration_s"])
+    return {stage: latency_summary(values) for stage, values in durations.items()}
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\nPipeline benchmark: {report['category']}, stand-in profiles {json.dumps(report['profiles'])}")
+    for phase in report["phases"]:
+        print(
+            f"  {phase['phase']:<12} {phase['calls']:>5} calls  {phase['errors']:>4} errors  "
+            f"{phase['throughput_per_s']:>8.2f}/s  p50 {phase['p50_s']:.3f}s  p95 {phase['p95_s']:.3f}s  "
+            f"p99 {phase['p99_s']:.3f}s  peak {phase['peak_traced_mb']:.1f} MB"
+        )
+        for example in phase["error_examples"]:
+            print(f"      e.g. {example}")
+    print("  Stage latency across all calls:")
+    for stage, summary in report["stages"].items():
+        print(f"    {stage:<12} p50 {summary['p50_s']:.3f}s  p95 {summary['p95_s']:.3f}s  p99 {summary['p99_s']:.3f}s")
+    print("  Stand-in requests:")
+    for provider, counts in report["stand_ins"].items():
+        print(f"    {provider:<14} {counts['requests']:>6} requests, {counts['injected'][429]} throttled, {counts['injected'][500]} failed")
+    print(f"  Max RSS: {report['max_rss_mb']:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the populate pipeline against local stand-ins for Places, Perplexity and Azure OpenAI")
+    parser.add_argument("--category", choices=sorted(POPULATOR_MODULES), default="dining")
+    parser.add_argument("--single-runs", type=int, default=10, help="Sequential populate calls (0 to skip)")
+    parser.add_argument("--bulk-rows", type=int, default=100, help="Rows in the concurrent bulk phase (0 to skip)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Populate calls in flight during the bulk phase")
+    for provider, default_latency in (("places", "lognormal:-2.3,0.4"), ("perplexity", "lognormal:0.7,0.35"), ("azure", "lognormal:0.0,0.3")):
+        parser.add_argument(f"--{provider}-latency", default=default_latency, help="fixed:S, uniform:A,B, normal:MEAN,SD or lognormal:MU,SIGMA (seconds)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of stand-in responses that are 500 errors")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of stand-in responses that are 429s")
+    parser.add_argument("--retry-after-ms", type=int, default=200, help="retry-after-ms sent with injected 429s")
+    parser.add_argument("--stream", action="store_true", help="Stream the LLM answers, as the Streamlit app does")
+    parser.add_argument("--speculative", action="store_true", help="Start Perplexity in parallel with the Places lookup")
+    parser.add_argument("--fast-path", action="store_true", help="Skip Azure when Perplexity's answer validates")
+    parser.add_argument("--production-limits", action="store_true", help="Keep the configured provider rate limits instead of lifting them")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the stand-ins' latency and fault injection")
+    parser.add_argument("--output", help="Also write the report as JSON to this file")
+    args = parser.parse_args()
+    if args.speculative and args.fast_path:
+        parser.error("--fast-path cannot be combined with --speculative: speculative answers lack the Places context only Azure adds")
+
+    profiles = {
+        "google_places": StandInProfile(args.places_latency, args.error_rate, args.throttle_rate, args.retry_after_ms),
+        "perplexity": StandInProfile(args.perplexity_latency, args.error_rate, args.throttle_rate, args.retry_after_ms),
+        "azure_openai": StandInProfile(args.azure_latency, args.error_rate, args.throttle_rate, args.retry_after_ms),
+    }
+    parent_conn, child_conn = multiprocessing.Pipe()
+    stand_ins = multiprocessing.Process(target=serve_stand_ins, args=(profiles, child_conn, args.seed), daemon=True)
+    stand_ins.start()
+    urls = parent_conn.recv()
+
+    output_path = os.path.abspath(args.output) if args.output else None
+    with tempfile.TemporaryDirectory(prefix="pipeline-benchmark-") as work_dir:
+        # The provider caches live under .cache in the working directory; keep them out of the real one
+        os.chdir(work_dir)
+        set_config(build_config(urls, work_dir, args))
+        tracemalloc.start()
+        populate = getattr(importlib.import_module(POPULATOR_MODULES[args.category]), f"populate_{args.category}_async")
+        populate_options: Dict[str, Any] = {"use_cache": False, "speculative": args.speculative, "fast_path": args.fast_path}
+        if args.stream:
+            populate_options["on_event"] = lambda stage, payload: None
+
+        phases = []
+        if args.single_runs:
+            phases.append(measure_phase("single-shot", run_single_shot(populate, args.single_runs, populate_options)))
+        if args.bulk_rows:
+            phases.append(measure_phase("bulk", run_bulk(populate, args.bulk_rows, args.concurrency, populate_options)))
+        tracemalloc.stop()
+        stages = stage_breakdown(os.path.join(work_dir, "runs.jsonl"))
+
+    parent_conn.send("stop")
+    stand_in_counts = parent_conn.recv()
+    stand_ins.join(timeout=5)
+
+    import resource
+
+    report = {
+        "category": args.category,
+        "profiles": {provider: profile.latency.spec for provider, profile in profiles.items()},
+        "error_rate": args.error_rate,
+        "throttle_rate": args.throttle_rate,
+        "phases": phases,
+        "stages": stages,
+        "stand_ins": stand_in_counts,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    print_report(report)
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
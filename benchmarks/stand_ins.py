@@ -0,0 +1,238 @@
+import hashlib
+import io
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+# Output fields of both categories, so the same completion validates for accommodation and dining
+COMPLETION_FIELDS = {
+    "Name of Stay": "Stand-in Stay",
+    "Hotel Brand": "Stand-in Hotels",
+    "Restaurant Name": "Stand-in Kitchen",
+    "Cuisines": "Indian, Continental",
+    "Price": "INR 2,000 for two",
+    "Price: In INR": "INR 12,000 per night",
+    "Crew Exclusive Price": "N/A",
+    "Why we love it": "A stand-in answer long enough to look like a real paragraph of research. " * 4,
+    "Everything you need to know": "Pool, spa, breakfast included, pet friendly, live music on weekends. " * 4,
+    "Product Details": "Rooms, suites and villas. " * 4,
+}
+STREAM_CHUNK_CHARS = 40
+
+
+class LatencyModel:
+    """
+    Response delay distribution parsed from a spec string
+
+    Specs: "fixed:0.2", "uniform:0.1,0.5", "normal:0.8,0.2" (mean, stddev) or
+    "lognormal:-0.5,0.6" (mu and sigma of the underlying normal); values in seconds.
+    """
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(value) for value in params.split(",") if value]
+        if kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return rng.uniform(self.params[0], self.params[1])
+        if self.kind == "normal":
+            return max(0.0, rng.gauss(self.params[0], self.params[1]))
+        return rng.lognormvariate(self.params[0], self.params[1])
+
+
+class StandInProfile:
+    """How a stand-in behaves: latency, share of 500 errors and share of 429 throttles"""
+
+    def __init__(self, latency: str = "fixed:0.05", error_rate: float = 0.0, throttle_rate: float = 0.0, retry_after_ms: int = 200):
+        self.latency = LatencyModel(latency)
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after_ms = retry_after_ms
+
+
+def _stand_in_jpeg() -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (800, 600), (90, 140, 200)).save(buffer, format="JPEG", quality=80)
+    return buffer.getvalue()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "StandInServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json", headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, payload: Dict[str, Any], status: int = 200) -> None:
+        self._send(status, json.dumps(payload).encode("utf-8"))
+
+    def _simulate(self) -> bool:
+        """Sleep for a sampled latency, then answer with an injected 429 or 500; False if one was sent"""
+        outcome = self.server.next_outcome()
+        time.sleep(outcome["delay"])
+        if outcome["status"] == 429:
+            body = json.dumps({"error": {"code": 429, "message": "stand-in throttle"}}).encode("utf-8")
+            self._send(429, body, headers={"retry-after-ms": str(self.server.profile.retry_after_ms)})
+            return False
+        if outcome["status"] == 500:
+            self._send_json({"error": {"code": 500, "message": "stand-in failure"}}, status=500)
+            return False
+        return True
+
+    def do_GET(self) -> None:
+        path = self.path.split("?", 1)[0]
+        if path.startswith("/img/"):
+            return self._send(200, self.server.jpeg, content_type="image/jpeg")
+        if not self._simulate():
+            return
+        media = re.fullmatch(r"/v1/(places/[^/]+/photos/[^/]+)/media", path)
+        if media:
+            return self._send_json({"name": media.group(1), "photoUri": f"{self.server.url}/img/{media.group(1).replace('/', '_')}.jpg"})
+        details = re.fullmatch(r"/v1/places/([^/]+)", path)
+        if details:
+            return self._send_json(self.server.place(details.group(1)))
+        self._send_json({"error": {"message": f"unknown path {path}"}}, status=404)
+
+    def do_POST(self) -> None:
+        body = self._read_json()
+        if not self._simulate():
+            return
+        if self.path.startswith("/v1/places:searchText"):
+            place_id = "standin_" + hashlib.sha1(body.get("textQuery", "").encode("utf-8")).hexdigest()[:16]
+            return self._send_json({"places": [self.server.place(place_id)]})
+        if "/chat/completions" in self.path:
+            return self._chat_completion(body)
+        self._send_json({"error": {"message": f"unknown path {self.path}"}}, status=404)
+
+    def _chat_completion(self, body: Dict[str, Any]) -> None:
+        messages = body.get("messages", [])
+        content = json.dumps(COMPLETION_FIELDS)
+        # A continuation request carries the cut-off answer; only the rest of it is generated
+        answered = "".join(message.get("content", "") for message in messages if message.get("role") == "assistant")
+        if answered and content.startswith(answered):
+            content = content[len(answered):]
+        # Answers longer than max_tokens (about 4 characters each) are cut off like a real model's
+        finish_reason = "stop"
+        max_chars = body.get("max_tokens", 0) * 4
+        if max_chars and len(content) > max_chars:
+            content = content[:max_chars]
+            finish_reason = "length"
+        prompt_chars = sum(len(message.get("content", "")) for message in messages)
+        usage = {"prompt_tokens": prompt_chars // 4, "completion_tokens": len(content) // 4}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        if not body.get("stream"):
+            return self._send_json({"choices": [{"message": {"role": "assistant", "content": content}, "finish_reason": finish_reason}], "usage": usage})
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for start in range(0, len(content), STREAM_CHUNK_CHARS):
+            chunk = {"choices": [{"delta": {"content": content[start:start + STREAM_CHUNK_CHARS]}, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        final_chunk = {"choices": [{"delta": {}, "finish_reason": finish_reason}], "usage": usage}
+        self.wfile.write(f"data: {json.dumps(final_chunk)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        self.wfile.flush()
+        self.close_connection = True
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Local HTTP server answering like Places (New), Perplexity or Azure OpenAI chat completions
+
+    Every route is served, so one server can stand in for any provider; start one per
+    provider to give each its own profile and connection pool.
+    """
+
+    daemon_threads = True
+    # Bulk runs open many connections at once
+    request_queue_size = 256
+
+    def __init__(self, profile: StandInProfile, seed: int = 0):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.profile = profile
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+        self.jpeg = _stand_in_jpeg()
+        self.requests = 0
+        self.injected = {429: 0, 500: 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def next_outcome(self) -> Dict[str, Any]:
+        with self._lock:
+            self.requests += 1
+            delay = self.profile.latency.sample(self._rng)
+            roll = self._rng.random()
+            status = 200
+            if roll < self.profile.throttle_rate:
+                status = 429
+            elif roll < self.profile.throttle_rate + self.profile.error_rate:
+                status = 500
+            if status != 200:
+                self.injected[status] += 1
+        return {"delay": delay, "status": status}
+
+    def place(self, place_id: str) -> Dict[str, Any]:
+        return {
+            "id": place_id,
+            "displayName": {"text": "Stand-in Place"},
+            "formattedAddress": "1 Stand-in Road, Test City",
+            "types": ["restaurant", "lodging"],
+            "editorialSummary": {"text": "A place that only exists for benchmarks."},
+            "rating": 4.4,
+            "googleMapsUri": f"https://maps.google.com/?cid={place_id}",
+            "regularOpeningHours": {"weekdayDescriptions": [f"{day}: 9:00 AM – 11:00 PM" for day in ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")]},
+            "photos": [{"name": f"places/{place_id}/photos/photo{i}"} for i in range(10)],
+            "reviews": [{"text": {"text": f"Stand-in review {i}: great food and friendly staff."}, "publishTime": "2025-01-01T00:00:00Z"} for i in range(5)],
+        }
+
+    def start(self) -> "StandInServer":
+        self._thread = threading.Thread(target=self.serve_forever, name=f"stand-in-{self.server_address[1]}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def serve_stand_ins(profiles: Dict[str, StandInProfile], conn: Any, seed: int = 0) -> None:
+    """
+    Run one stand-in per provider until told to stop; meant as a multiprocessing target
+
+    Sends {provider: base URL} over conn once listening, waits for any message, then
+    sends {provider: {"requests": ..., "injected": {...}}} and shuts down. Running the
+    stand-ins in their own process keeps them out of the benchmarked process's GIL and memory.
+    """
+    servers = {provider: StandInServer(profile, seed=seed + i).start() for i, (provider, profile) in enumerate(profiles.items())}
+    conn.send({provider: server.url for provider, server in servers.items()})
+    conn.recv()
+    conn.send({provider: {"requests": server.requests, "injected": dict(server.injected)} for provider, server in servers.items()})
+    for server in servers.values():
+        server.stop()
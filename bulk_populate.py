@@ -0,0 +1,198 @@
+import argparse
+import asyncio
+import contextlib
+import csv
+import json
+import sys
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, List, TextIO
+
+from accommodation.accommodation_populator import populate_accommodation_async, refresh_accommodation_async
+from dining.dining_populator import populate_dining_async, refresh_dining_async
+from common.aio import run_sync
+from common.photos import resolve_photo_uris_async
+
+POPULATORS = {
+    "accommodation": populate_accommodation_async,
+    "dining": populate_dining_async,
+}
+
+REFRESHERS = {
+    "accommodation": refresh_accommodation_async,
+    "dining": refresh_dining_async,
+}
+
+# Exported records list this many photo URLs, padded with N/A
+EXPORT_PHOTO_URLS = 10
+
+
+def read_rows(path: str, keep_records: bool = False) -> List[Dict[str, Any]]:
+    """
+    Read (name, city) rows from a CSV or JSONL file
+
+    Args:
+        path: Path to a .csv file with "name" and "city" columns, or a .jsonl file
+              with one {"name": ..., "city": ...} object per line
+        keep_records: Keep the stored "result" of rows from an earlier bulk_populate output
+                      as "record", so they can be refreshed instead of populated from scratch
+
+    Returns:
+        List of row dictionaries with "name" and "city" keys, and "record" where kept
+    """
+    rows = []
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                line = line.strip()
+                if line:
+                    rows.append(json.loads(line))
+        else:
+            rows.extend(csv.DictReader(f))
+
+    cleaned_rows = []
+    for row in rows:
+        name = (row.get("name") or "").strip()
+        city = (row.get("city") or "").strip()
+        if name and city:
+            cleaned_row = {"name": name, "city": city}
+            if keep_records and isinstance(row.get("result"), dict):
+                # Exported photo URLs have expired by now; they are resolved again on export
+                cleaned_row["record"] = {key: value for key, value in row["result"].items() if key != "photo_urls"}
+            cleaned_rows.append(cleaned_row)
+        else:
+            print(f"[BULK] Skipping row without name and city: {row}", file=sys.stderr)
+    return cleaned_rows
+
+
+async def with_photo_urls(result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Add photo_urls to an exported record, resolved from its photo_names
+
+    Records only keep photo names, because media URIs expire. Exports resolve them once, as
+    media URIs that can be fetched without an API key (each uncached one is a billed Photo call).
+    """
+    photo_urls = [photo_uri or "N/A" for photo_uri in await resolve_photo_uris_async(result.get("photo_names", [])[:EXPORT_PHOTO_URLS])]
+    photo_urls += ["N/A"] * (EXPORT_PHOTO_URLS - len(photo_urls))
+    return {**result, "photo_urls": photo_urls}
+
+
+async def _populate_row(category: str, index: int, row: Dict[str, Any], populate_options: Dict[str, Any], photo_urls: bool = False) -> Dict[str, Any]:
+    started = time.perf_counter()
+    try:
+        if "record" in row:
+            refresh_options = {key: value for key, value in populate_options.items() if key != "refresh"}
+            result = await REFRESHERS[category](row["name"], row["city"], row["record"], **refresh_options)
+        else:
+            result = await POPULATORS[category](row["name"], row["city"], **populate_options)
+        if photo_urls and result and "error" not in result:
+            result = await with_photo_urls(result)
+    except Exception as e:
+        result = {"error": f"Unexpected error: {str(e)}"}
+
+    output = {
+        "row": index,
+        "category": category,
+        "name": row["name"],
+        "city": row["city"],
+        "elapsed_s": round(time.perf_counter() - started, 3),
+    }
+    if not result or "error" in result:
+        output["error"] = result.get("error", "No data returned") if result else "No data returned"
+    else:
+        output["result"] = result
+    return output
+
+
+async def bulk_populate(
+    rows: Iterable[Dict[str, Any]],
+    category: str,
+    concurrency: int = 4,
+    photo_urls: bool = False,
+    **populate_options: Any,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Run the populate pipeline for many rows concurrently on the running event loop
+
+    Args:
+        rows: Iterable of {"name": ..., "city": ...} dictionaries; rows with a stored "record"
+              are refreshed by place ID instead
+        category: "accommodation" or "dining"
+        concurrency: Maximum number of rows in flight at once
+        photo_urls: Add resolved photo_urls to each result, see with_photo_urls
+        populate_options: Keyword arguments passed to the populator, e.g. use_cache, refresh or speculative
+
+    Yields:
+        One result dictionary per row, in completion order
+    """
+    if category not in POPULATORS:
+        raise ValueError(f"Unknown category: {category}")
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def populate_with_limit(index: int, row: Dict[str, Any]) -> Dict[str, Any]:
+        async with semaphore:
+            return await _populate_row(category, index, row, populate_options, photo_urls)
+
+    tasks = [asyncio.create_task(populate_with_limit(index, row)) for index, row in enumerate(rows)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _write_results(rows: List[Dict[str, Any]], args: argparse.Namespace, out: TextIO) -> int:
+    populate_options = {
+        "use_cache": not args.no_cache,
+        "refresh": args.refresh,
+        "speculative": args.speculative,
+        "hedge": args.hedge,
+        "fast_path": args.fast_path,
+        "deadline_seconds": args.deadline,
+    }
+    succeeded = 0
+    async for output in bulk_populate(rows, args.category, args.concurrency, photo_urls=not args.no_photo_urls, **populate_options):
+        if "error" not in output:
+            succeeded += 1
+        out.write(json.dumps(output, default=str) + "\n")
+        out.flush()
+    return succeeded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Populate metadata for many places from a CSV or JSONL file")
+    parser.add_argument("input", help="CSV (name,city columns) or JSONL file of places")
+    parser.add_argument("--category", choices=sorted(POPULATORS), required=True)
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of places processed in parallel")
+    parser.add_argument("--output", help="JSONL file to write results to (defaults to stdout)")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the on-disk provider caches")
+    parser.add_argument("--refresh", action="store_true", help="Ignore cached entries and overwrite them")
+    parser.add_argument("--speculative", action="store_true", help="Start Perplexity in parallel with the Places lookup")
+    parser.add_argument("--hedge", action="store_true", help="Hedge slow Perplexity requests with a duplicate")
+    parser.add_argument("--fast-path", action="store_true", help="Ask Perplexity for the final fields and skip Azure when they validate")
+    parser.add_argument("--deadline", type=float, help="End-to-end time limit per place in seconds")
+    parser.add_argument("--no-photo-urls", action="store_true", help="Export photo names only, without resolving their media URLs")
+    parser.add_argument("--incremental", action="store_true", help="Input is earlier JSONL output; refresh its records by place_id, re-running the LLM stages only where the Places context changed")
+    args = parser.parse_args()
+    if args.speculative and args.fast_path:
+        parser.error("--fast-path cannot be combined with --speculative: speculative answers lack the Places context only Azure adds")
+
+    rows = read_rows(args.input, keep_records=args.incremental)
+    out = open(args.output, "a", encoding="utf-8") if args.output else sys.stdout
+
+    started = time.perf_counter()
+    try:
+        # The stages print their progress to stdout, which would mix it into the JSONL results
+        with contextlib.redirect_stdout(sys.stderr):
+            succeeded = run_sync(_write_results(rows, args, out))
+    finally:
+        if args.output:
+            out.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"[BULK] {succeeded}/{len(rows)} rows succeeded in {elapsed:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Coroutine, Optional
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_thread: Optional[threading.Thread] = None
+_loop_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Return the process-wide event loop that runs the async pipeline for blocking callers
+
+    The loop runs forever on a daemon thread, so HTTP connection pools and other
+    loop-bound state survive between calls from Streamlit reruns or worker threads.
+    """
+    global _loop, _loop_thread
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                _loop_thread = threading.Thread(target=loop.run_forever, name="pipeline-event-loop", daemon=True)
+                _loop_thread.start()
+                _loop = loop
+    return _loop
+
+
+def submit(coro: Coroutine[Any, Any, Any]) -> Future:
+    """Schedule a coroutine on the shared event loop and return a concurrent.futures.Future for it"""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def run_sync(coro: Coroutine[Any, Any, Any]) -> Any:
+    """
+    Run a coroutine on the shared event loop and block until it finishes
+
+    Args:
+        coro: Coroutine to run
+
+    Returns:
+        The coroutine's result
+    """
+    if threading.current_thread() is _loop_thread:
+        coro.close()
+        raise RuntimeError("run_sync() cannot be called from the pipeline event loop; await the coroutine instead")
+    return submit(coro).result()
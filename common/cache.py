@@ -0,0 +1,119 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+# Directory holding all on-disk caches, relative to the working directory unless overridden
+CACHE_DIR = os.environ.get("DATA_FORMATTER_CACHE_DIR", ".cache")
+
+_caches: Dict[Tuple[str, float, int], "SQLiteCache"] = {}
+_caches_lock = threading.Lock()
+
+
+def normalize_key(*parts: Any) -> str:
+    """
+    Build a cache key from free-text parts, ignoring case and repeated whitespace
+
+    Args:
+        parts: Values making up the key, e.g. place name and city
+
+    Returns:
+        Normalized key string
+    """
+    return "|".join(" ".join(str(part).lower().split()) for part in parts)
+
+
+class SQLiteCache:
+    """
+    Small persistent key/value cache backed by SQLite with a TTL and LRU eviction
+
+    Values are stored as JSON. Entries older than ttl_seconds are treated as missing,
+    and once more than max_entries are stored the least recently used ones are evicted.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float, max_entries: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_last_accessed ON cache (last_accessed)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for key, or None if it is missing or expired"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+
+            value, created_at = row
+            if now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+
+            self._conn.execute("UPDATE cache SET last_accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(value)
+
+    def set(self, key: str, value: Any) -> None:
+        """Store value under key and evict least recently used entries beyond max_entries"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, created_at, last_accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, default=str), now, now),
+            )
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN ("
+                "SELECT key FROM cache ORDER BY last_accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        """Remove a single entry"""
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def clear(self) -> None:
+        """Remove every entry"""
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self._conn.commit()
+
+
+def get_cache(name: str, ttl_seconds: float, max_entries: int) -> SQLiteCache:
+    """
+    Return the process-wide cache with the given name and limits, creating it on first use
+
+    Args:
+        name: Cache name, used as the SQLite file name inside CACHE_DIR
+        ttl_seconds: Maximum age of an entry before it is treated as missing
+        max_entries: Maximum number of entries kept before LRU eviction
+
+    Returns:
+        Shared SQLiteCache instance
+    """
+    with _caches_lock:
+        # Configs with different [cache] limits get their own instance on the same file
+        key = (name, ttl_seconds, max_entries)
+        if key not in _caches:
+            _caches[key] = SQLiteCache(os.path.join(CACHE_DIR, f"{name}.sqlite"), ttl_seconds, max_entries)
+        return _caches[key]
@@ -0,0 +1,43 @@
+import hashlib
+import json
+from typing import Optional
+
+from common.config import Config, get_config
+from common.cache import get_cache
+
+# Defaults for the on-disk LLM completion cache, overridable via the [cache] config section
+COMPLETION_CACHE_TTL_SECONDS = 30 * 24 * 60 * 60
+COMPLETION_CACHE_MAX_ENTRIES = 20000
+
+
+def get_completion_cache(config: Optional[Config] = None):
+    """Return the shared LLM completion cache configured from the [cache] config section"""
+    cache_settings = (config or get_config()).section("cache")
+    return get_cache(
+        "completions",
+        ttl_seconds=cache_settings.get("completions_ttl_seconds", COMPLETION_CACHE_TTL_SECONDS),
+        max_entries=cache_settings.get("completions_max_entries", COMPLETION_CACHE_MAX_ENTRIES),
+    )
+
+
+def template_version(template: str) -> str:
+    """Short content hash of a prompt template, so editing a template changes every key built from it"""
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()[:16]
+
+
+def completion_cache_key(provider: str, model: str, template: str, prompt: str, max_tokens: int) -> str:
+    """
+    Build a content-addressed key for a deterministic (temperature 0) completion
+
+    Args:
+        provider: Provider name, e.g. "perplexity" or "azure_openai"
+        model: Model or deployment name
+        template: Unrendered prompt template the prompt was built from
+        prompt: Fully rendered prompt sent to the provider
+        max_tokens: Completion token limit of the request
+
+    Returns:
+        Hex digest identifying the request
+    """
+    key_material = json.dumps([provider, model, template_version(template), prompt, max_tokens])
+    return hashlib.sha256(key_material.encode("utf-8")).hexdigest()
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+from typing import Any, Dict, Optional
+
+import toml
+
+# Optional explicit TOML file; otherwise the Streamlit secrets files are read directly
+CONFIG_PATH_ENV = "DATA_FORMATTER_CONFIG"
+DEFAULT_CONFIG_PATHS = [
+    os.path.join(os.path.expanduser("~"), ".streamlit", "secrets.toml"),
+    os.path.join(".streamlit", "secrets.toml"),
+]
+# Environment overrides: DATA_FORMATTER__<SECTION>__<KEY>=value, e.g. DATA_FORMATTER__API_KEYS__PERPLEXITY
+ENV_PREFIX = "DATA_FORMATTER__"
+
+DEFAULT_BASE_URLS = {
+    "google_places": "https://places.googleapis.com",
+    "perplexity": "https://api.perplexity.ai",
+}
+
+_config: Optional["Config"] = None
+_config_lock = threading.Lock()
+
+
+class Config:
+    """
+    Settings for the pipeline, shaped like the Streamlit secrets file
+
+    Sections are plain dictionaries, e.g. config.section("cache") or config["api_keys"]["perplexity"].
+    """
+
+    def __init__(self, settings: Dict[str, Any]):
+        self._settings = settings
+
+    def __getitem__(self, name: str) -> Any:
+        return self._settings[name]
+
+    def __repr__(self) -> str:
+        # Keep secrets out of logs and request keys; the digest still tells different configs apart
+        digest = hashlib.sha256(json.dumps(self._settings, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:12]
+        return f"Config(sections={sorted(self._settings)}, digest={digest})"
+
+    def get(self, name: str, default: Any = None) -> Any:
+        return self._settings.get(name, default)
+
+    def section(self, name: str) -> Dict[str, Any]:
+        """Return a settings section, or an empty dictionary if it is not configured"""
+        return self._settings.get(name, {})
+
+    def api_key(self, provider: str) -> str:
+        """Return the API key for "google_places", "perplexity" or "azure_openai" """
+        return self._settings["api_keys"][provider]
+
+    def with_overrides(self, overrides: Dict[str, Any]) -> "Config":
+        """Return a copy with overrides merged in section by section, e.g. for a CLI run"""
+        return Config(_merge(self._settings, overrides))
+
+    def base_url(self, provider: str) -> str:
+        """Return the scheme and host requests to a provider go to, without a trailing slash"""
+        if provider == "azure_openai":
+            return self._settings["azure_openai"]["endpoint"].rstrip("/")
+        return self.section("base_urls").get(provider, DEFAULT_BASE_URLS[provider]).rstrip("/")
+
+
+def _merge(base: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
+    merged = dict(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def _streamlit_secrets() -> Optional[Dict[str, Any]]:
+    # Only use st.secrets when the app is already running under Streamlit; importing it costs seconds
+    streamlit = sys.modules.get("streamlit")
+    if streamlit is None or not streamlit.runtime.exists():
+        return None
+    from streamlit.errors import StreamlitSecretNotFoundError
+
+    try:
+        return streamlit.secrets.to_dict()
+    except StreamlitSecretNotFoundError:
+        # No secrets.toml; the app then runs on DATA_FORMATTER_CONFIG and env overrides alone
+        return None
+
+
+def _env_settings() -> Dict[str, Any]:
+    settings: Dict[str, Any] = {}
+    for name, value in os.environ.items():
+        if not name.startswith(ENV_PREFIX):
+            continue
+        *sections, key = name[len(ENV_PREFIX):].lower().split("__")
+        target = settings
+        for section in sections:
+            target = target.setdefault(section, {})
+        try:
+            target[key] = json.loads(value)
+        except ValueError:
+            target[key] = value
+    return settings
+
+
+def load_config(path: Optional[str] = None) -> Config:
+    """
+    Load settings from st.secrets when running under Streamlit, otherwise from TOML, then apply env overrides
+
+    An explicit TOML file (path or DATA_FORMATTER_CONFIG) is used even under Streamlit.
+
+    Args:
+        path: TOML file to read instead of DATA_FORMATTER_CONFIG or the Streamlit secrets files
+
+    Returns:
+        Config with every source merged
+    """
+    explicit_path = path or os.environ.get(CONFIG_PATH_ENV)
+    settings = None if explicit_path else _streamlit_secrets()
+    if settings is None:
+        settings = {}
+        for config_path in [explicit_path] if explicit_path else DEFAULT_CONFIG_PATHS:
+            if os.path.exists(config_path):
+                with open(config_path, encoding="utf-8") as f:
+                    settings = _merge(settings, toml.load(f))
+    return Config(_merge(settings, _env_settings()))
+
+
+def get_config() -> Config:
+    """Return the process-wide config, loading it on first use"""
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                _config = load_config()
+    return _config
+
+
+def set_config(config: Config) -> None:
+    """Replace the process-wide config, e.g. in a worker or test that builds its own"""
+    global _config
+    with _config_lock:
+        _config = config
@@ -0,0 +1,74 @@
+import asyncio
+import time
+from typing import Any, Coroutine, Dict, Optional
+
+from common.config import Config, get_config
+from common.metrics import stage_span
+
+# End-to-end budget for one populate call and the share each stage may use, overridable via the [timeouts] config section
+DEFAULT_DEADLINE_SECONDS = 150.0
+DEFAULT_STAGE_TIMEOUTS = {
+    "places": 15.0,
+    "perplexity": 90.0,
+    "azure": 45.0,
+}
+
+
+class Deadline:
+    """Point in time by which a whole populate call must finish, split into per-stage budgets"""
+
+    def __init__(self, seconds: Optional[float] = None, stage_timeouts: Optional[Dict[str, float]] = None, config: Optional[Config] = None):
+        timeout_settings = (config or get_config()).section("timeouts")
+        if seconds is None:
+            seconds = timeout_settings.get("deadline_seconds", DEFAULT_DEADLINE_SECONDS)
+        self.stage_timeouts = dict(DEFAULT_STAGE_TIMEOUTS)
+        self.stage_timeouts.update(timeout_settings.get("stages", {}))
+        self.stage_timeouts.update(stage_timeouts or {})
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline, never negative"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def stage_timeout(self, stage: str) -> float:
+        """Time the given stage may use: its own budget, capped by what is left of the deadline"""
+        return min(self.stage_timeouts.get(stage, self.remaining()), self.remaining())
+
+
+def timeout_result(stage: str, timeout: float) -> Dict[str, Any]:
+    """Structured result returned in place of a stage's output when it runs out of time"""
+    return {
+        "error": f"{stage} stage timed out after {timeout:.1f}s",
+        "timeout": True,
+        "stage": stage,
+    }
+
+
+async def run_stage(stage: str, coro: Coroutine[Any, Any, Dict[str, Any]], deadline: Deadline) -> Dict[str, Any]:
+    """
+    Await a stage coroutine within its budget, cancelling it when the budget runs out
+
+    The stage is timed as a span of the active metrics run (see common.metrics).
+
+    Args:
+        stage: Stage name used to look up the budget, e.g. "places", "perplexity" or "azure"
+        coro: Stage coroutine returning a result dictionary
+        deadline: Deadline of the enclosing populate call
+
+    Returns:
+        The stage result, or a timeout_result if the stage did not finish in time
+    """
+    with stage_span(stage) as span:
+        timeout = deadline.stage_timeout(stage)
+        if timeout <= 0:
+            coro.close()
+            result = timeout_result(stage, timeout)
+        else:
+            try:
+                result = await asyncio.wait_for(coro, timeout)
+            except asyncio.TimeoutError:
+                print(f"[TIMEOUT] {stage} stage cancelled after {timeout:.1f}s")
+                result = timeout_result(stage, timeout)
+        if span is not None and "error" in result:
+            span.status = "timeout" if result.get("timeout") else "error"
+        return result
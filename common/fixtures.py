@@ -0,0 +1,293 @@
+import base64
+import contextvars
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+import httpx
+from common.config import Config, get_config
+
+# Query parameters and response headers that may carry credentials or are not needed to replay
+SECRET_QUERY_PARAMS = {"key", "api-key", "api_key"}
+KEPT_RESPONSE_HEADERS = {"content-type", "content-encoding", "retry-after", "retry-after-ms"}
+SCRUBBED = "<scrubbed>"
+FIXTURE_SUFFIX = ".json.gz"
+AZURE_DEPLOYMENT_PATH = re.compile(r"/openai/deployments/[^/]+/")
+
+# Name of the (category, name, city) pair whose requests are being recorded or replayed
+_scope: contextvars.ContextVar[str] = contextvars.ContextVar("fixture_scope", default="")
+
+
+def scope_name(category: str, name: str, city: str) -> str:
+    """File-name-safe fixture name for a place, e.g. "dining-toit-bangalore" """
+    return re.sub(r"[^a-z0-9]+", "-", f"{category} {name} {city}".lower()).strip("-")
+
+
+@contextmanager
+def fixture_scope(name: str) -> Iterator[None]:
+    """Attribute the requests made inside the block (including tasks it starts) to one fixture"""
+    token = _scope.set(name)
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def _provider_for(url: httpx.URL, config: Config) -> str:
+    origin = f"{url.scheme}://{url.netloc.decode('ascii')}"
+    providers = []
+    for provider in ("google_places", "perplexity", "azure_openai"):
+        try:
+            if config.base_url(provider) == origin:
+                providers.append(provider)
+        except KeyError:
+            continue
+    if len(providers) > 1:
+        # Providers behind one host (a proxy or a local stand-in) are told apart by their paths
+        if AZURE_DEPLOYMENT_PATH.match(url.path):
+            return "azure_openai"
+        return "perplexity" if url.path.endswith("/chat/completions") else "google_places"
+    return providers[0] if providers else "other"
+
+
+def _route(url: httpx.URL) -> str:
+    """Request path plus non-secret query parameters, without the host"""
+    query = [(name, value) for name, value in parse_qsl(url.query.decode("ascii")) if name.lower() not in SECRET_QUERY_PARAMS]
+    path = url.path
+    if AZURE_DEPLOYMENT_PATH.match(path):
+        # Azure deployment names and API versions differ between setups; fixtures replay under any of them
+        path = AZURE_DEPLOYMENT_PATH.sub("/openai/deployments/*/", path)
+        query = [(name, value) for name, value in query if name != "api-version"]
+    return path + (f"?{urlencode(sorted(query))}" if query else "")
+
+
+def _body_key(content: bytes) -> str:
+    if not content:
+        return ""
+    try:
+        canonical = json.dumps(json.loads(content), sort_keys=True, separators=(",", ":")).encode("utf-8")
+    except ValueError:
+        canonical = content
+    return hashlib.sha256(canonical).hexdigest()[:16]
+
+
+def _is_streamed(content: bytes) -> bool:
+    try:
+        body = json.loads(content) if content else {}
+    except ValueError:
+        return False
+    return isinstance(body, dict) and bool(body.get("stream"))
+
+
+def _secrets(config: Config) -> List[str]:
+    return [str(key) for key in config.section("api_keys").values() if key]
+
+
+def _scrub(text: str, secrets: List[str]) -> str:
+    for secret in secrets:
+        text = text.replace(secret, SCRUBBED)
+    return text
+
+
+class FixtureStore:
+    """
+    Recorded provider responses, grouped by fixture
+
+    Each interaction is stored under its provider, method and route (path and non-secret
+    query) plus a hash of the JSON request body. Request headers, API keys and the
+    provider hosts are never written, so fixtures can be shared and replayed against any
+    configured endpoint.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.fixtures: Dict[str, List[Dict[str, Any]]] = {}
+        # What each fixture was recorded for, e.g. {"category": ..., "name": ..., "city": ...}
+        self.places: Dict[str, Dict[str, str]] = {}
+        self._endpoint_cursor: Dict[Tuple[str, str, str, str], int] = {}
+
+    def add(self, fixture: str, interaction: Dict[str, Any]) -> None:
+        with self._lock:
+            interactions = self.fixtures.setdefault(fixture, [])
+            # Hedged duplicates and repeated lookups only need one copy
+            if not any(self._same_request(existing, interaction) for existing in interactions):
+                interactions.append(interaction)
+
+    @staticmethod
+    def _same_request(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+        return all(a[field] == b[field] for field in ("provider", "method", "route", "body_key"))
+
+    def find(self, fixture: str, provider: str, method: str, route: str, body_key: str, streamed: bool = False, strict: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Look up the recorded response for a request
+
+        An exact match (same body) is preferred, from the request's fixture or any other.
+        Unless strict, a request whose body changed, e.g. after a prompt edit, gets the
+        fixture's recorded response for the same provider, method and route, streamed
+        or not like the request.
+        """
+        with self._lock:
+            same_route = []
+            for candidate_fixture in ([fixture] if fixture else []) + [name for name in self.fixtures if name != fixture]:
+                for interaction in self.fixtures.get(candidate_fixture, []):
+                    if (interaction["provider"], interaction["method"], interaction["route"]) != (provider, method, route):
+                        continue
+                    if interaction["body_key"] == body_key:
+                        return interaction
+                    if candidate_fixture == fixture:
+                        same_route.append(interaction)
+            if strict or not same_route:
+                return None
+            same_kind = [interaction for interaction in same_route if interaction.get("streamed", False) == streamed] or same_route
+            cursor_key = (fixture, provider, method, route)
+            cursor = self._endpoint_cursor.get(cursor_key, 0)
+            self._endpoint_cursor[cursor_key] = cursor + 1
+            return same_kind[cursor % len(same_kind)]
+
+    def save(self, directory: str) -> List[str]:
+        """Write one gzipped JSON file per fixture; returns the paths written"""
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        with self._lock:
+            for fixture, interactions in self.fixtures.items():
+                path = os.path.join(directory, fixture + FIXTURE_SUFFIX)
+                document = {"fixture": fixture, "place": self.places.get(fixture, {}), "recorded_at": time.time(), "interactions": interactions}
+                with gzip.open(path, "wt", encoding="utf-8") as f:
+                    json.dump(document, f, separators=(",", ":"))
+                paths.append(path)
+        return paths
+
+    @classmethod
+    def load(cls, directory: str) -> "FixtureStore":
+        """Read every fixture file in a directory into memory"""
+        store = cls()
+        for path in sorted(glob.glob(os.path.join(directory, "*" + FIXTURE_SUFFIX))):
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                document = json.load(f)
+            store.fixtures[document["fixture"]] = document["interactions"]
+            store.places[document["fixture"]] = document.get("place", {})
+        return store
+
+
+def _encode_body(content: bytes, headers: httpx.Headers, secrets: List[str]) -> Dict[str, Any]:
+    content_type = headers.get("content-type", "")
+    if not headers.get("content-encoding"):
+        try:
+            text = _scrub(content.decode("utf-8"), secrets)
+        except UnicodeDecodeError:
+            text = None
+        if text is not None and "json" in content_type:
+            try:
+                return {"json": json.loads(text)}
+            except ValueError:
+                pass
+        if text is not None and ("text" in content_type or "json" in content_type):
+            return {"text": text}
+    return {"base64": base64.b64encode(content).decode("ascii")}
+
+
+def _decode_body(interaction: Dict[str, Any]) -> bytes:
+    if "json" in interaction:
+        return json.dumps(interaction["json"]).encode("utf-8")
+    if "text" in interaction:
+        return interaction["text"].encode("utf-8")
+    return base64.b64decode(interaction["base64"])
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """Forward requests to the real transport and add each response to a FixtureStore"""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, store: FixtureStore, config: Config):
+        self._inner = inner
+        self._store = store
+        self._config = config
+        self._secrets = _secrets(config)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        # Uncompressed bodies can be scrubbed and stored as readable JSON
+        request.headers["Accept-Encoding"] = "identity"
+        response = await self._inner.handle_async_request(request)
+        # Streamed answers are buffered here; post_stream still reads them line by line
+        content = b"".join([chunk async for chunk in response.aiter_raw()])
+        await response.aclose()
+
+        fixture = _scope.get()
+        if fixture:
+            self._store.add(fixture, {
+                "provider": _provider_for(request.url, self._config),
+                "method": request.method,
+                "route": _scrub(_route(request.url), self._secrets),
+                "body_key": _body_key(request.content),
+                "streamed": _is_streamed(request.content),
+                "status": response.status_code,
+                "headers": {name: value for name, value in response.headers.items() if name.lower() in KEPT_RESPONSE_HEADERS},
+                **_encode_body(content, response.headers, self._secrets),
+            })
+        return httpx.Response(response.status_code, headers=response.headers, content=content, request=request)
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """Answer requests from a FixtureStore without touching the network"""
+
+    def __init__(self, store: FixtureStore, config: Config, strict: bool = False):
+        self._store = store
+        self._config = config
+        self._strict = strict
+        # Response bodies are rebuilt from the fixture once, then served as bytes
+        self._bodies: Dict[int, bytes] = {}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        provider = _provider_for(request.url, self._config)
+        route = _route(request.url)
+        interaction = self._store.find(_scope.get(), provider, request.method, route, _body_key(request.content), streamed=_is_streamed(request.content), strict=self._strict)
+        if interaction is None:
+            message = f"No recorded response for {request.method} {provider} {route} in fixture '{_scope.get() or '*'}'"
+            return httpx.Response(599, json={"error": {"message": message}}, request=request)
+        body = self._bodies.get(id(interaction))
+        if body is None:
+            body = self._bodies[id(interaction)] = _decode_body(interaction)
+        return httpx.Response(interaction["status"], headers=interaction["headers"], content=body, request=request)
+
+
+_stores: Dict[str, FixtureStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_fixture_store(directory: str) -> FixtureStore:
+    """Return the store for a fixture directory, loading it once per process in replay mode"""
+    with _stores_lock:
+        store = _stores.get(directory)
+        if store is None:
+            store = FixtureStore.load(directory) if os.path.isdir(directory) else FixtureStore()
+            _stores[directory] = store
+    return store
+
+
+def wrap_transports(default: httpx.AsyncBaseTransport, mounts: Dict[str, httpx.AsyncBaseTransport], config: Optional[Config] = None) -> Tuple[httpx.AsyncBaseTransport, Dict[str, httpx.AsyncBaseTransport]]:
+    """
+    Apply the [fixtures] config section to the HTTP client's transports
+
+    mode = "record" passes requests through and keeps every response in the store for the
+    directory in path (written by FixtureStore.save); mode = "replay" serves responses from
+    the fixture files in path instead of the network. Anything else leaves the transports as they are.
+    """
+    config = config or get_config()
+    fixture_settings = config.section("fixtures")
+    mode = fixture_settings.get("mode")
+    if mode not in ("record", "replay"):
+        return default, mounts
+    store = get_fixture_store(fixture_settings.get("path", "fixtures"))
+    if mode == "replay":
+        return ReplayTransport(store, config, strict=bool(fixture_settings.get("strict", False))), {}
+    return RecordingTransport(default, store, config), {origin: RecordingTransport(transport, store, config) for origin, transport in mounts.items()}
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from common.config import Config, get_config
+
+T = TypeVar("T")
+
+# Hedge after the given latency percentile, and for at most this fraction of calls; overridable via the [hedging] config section
+DEFAULT_HEDGE_PERCENTILE = 0.9
+DEFAULT_MAX_HEDGE_RATE = 0.1
+# Until enough latencies are observed a fixed delay is used instead of the percentile
+DEFAULT_HEDGE_DELAY_SECONDS = 30.0
+MIN_LATENCY_SAMPLES = 20
+WINDOW_SIZE = 200
+
+_hedgers: Dict[Tuple[str, str], "Hedger"] = {}
+_hedgers_lock = threading.Lock()
+
+
+class Hedger:
+    """
+    Sends a duplicate of a slow request and keeps whichever answers first
+
+    A duplicate is only sent once the first request has been running longer than the
+    chosen percentile of recent latencies, and only while the share of recent calls
+    that were hedged stays below max_hedge_rate.
+    """
+
+    def __init__(self, name: str, percentile: float, max_hedge_rate: float):
+        self.name = name
+        self.percentile = percentile
+        self.max_hedge_rate = max_hedge_rate
+        self._latencies = deque(maxlen=WINDOW_SIZE)
+        self._hedged_calls = deque(maxlen=WINDOW_SIZE)
+
+    def hedge_delay(self) -> float:
+        """Seconds to wait for the first request before sending a duplicate"""
+        if len(self._latencies) < MIN_LATENCY_SAMPLES:
+            return DEFAULT_HEDGE_DELAY_SECONDS
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))]
+
+    def _hedge_allowed(self) -> bool:
+        if not self._hedged_calls:
+            return self.max_hedge_rate > 0
+        return sum(self._hedged_calls) / len(self._hedged_calls) < self.max_hedge_rate
+
+    async def run(self, request: Callable[[], Awaitable[T]]) -> T:
+        """
+        Await request(), hedging it with a second request() call if it is slow
+
+        Args:
+            request: Zero-argument callable returning a new awaitable each time it is called; error
+                responses must raise, or a fast error would win over a slower answer
+
+        Returns:
+            The result of whichever request finishes first without raising
+        """
+        started = time.monotonic()
+        first = asyncio.ensure_future(request())
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_delay())
+        if done or not self._hedge_allowed():
+            self._hedged_calls.append(False)
+            result = await first
+            self._latencies.append(time.monotonic() - started)
+            return result
+
+        self._hedged_calls.append(True)
+        print(f"[HEDGE] {self.name} slower than {self.hedge_delay():.1f}s, sending a duplicate request")
+        hedge_started = time.monotonic()
+        pending = {first, asyncio.ensure_future(request())}
+        try:
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None or not pending:
+                        self._latencies.append(time.monotonic() - (started if task is first else hedge_started))
+                        return task.result()
+        finally:
+            # The losing request is cancelled so it stops holding a connection
+            for task in pending:
+                task.cancel()
+
+
+def get_hedger(name: str, config: Optional[Config] = None) -> Hedger:
+    """Return the process-wide hedger for a request type and config, configured from its [hedging] section on first use"""
+    config = config or get_config()
+    # The repr is a digest of the settings, so equal configs share a hedger and its latency history
+    key = (name, repr(config))
+    with _hedgers_lock:
+        if key not in _hedgers:
+            hedging_settings = config.section("hedging")
+            _hedgers[key] = Hedger(
+                name,
+                percentile=hedging_settings.get("percentile", DEFAULT_HEDGE_PERCENTILE),
+                max_hedge_rate=hedging_settings.get("max_hedge_rate", DEFAULT_MAX_HEDGE_RATE),
+            )
+        return _hedgers[key]
@@ -0,0 +1,221 @@
+import asyncio
+import json
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+from common.config import Config, get_config
+from common.fixtures import wrap_transports
+from common.metrics import record_http, record_usage
+from common.rate_limit import get_limiter, parse_retry_after
+
+# Keep-alive connection pool size per provider, overridable via the [http] config section
+DEFAULT_POOL_SIZES = {
+    "google_places": 100,
+    "perplexity": 100,
+    "azure_openai": 50,
+}
+DEFAULT_POOL_SIZE = 50
+KEEPALIVE_EXPIRY_SECONDS = 120
+DEFAULT_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+MAX_THROTTLE_RETRIES = 5
+
+# Async clients are bound to the event loop they were created on, so keep one per loop and config
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, httpx.AsyncClient]]" = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _build_client(config: Config) -> httpx.AsyncClient:
+    http_settings = config.section("http")
+    http2 = bool(http_settings.get("http2", False))
+    if http2 and not _http2_available():
+        print("HTTP/2 requested but the h2 package is not installed, falling back to HTTP/1.1")
+        http2 = False
+
+    pool_sizes = {}
+    for provider, pool_size in DEFAULT_POOL_SIZES.items():
+        try:
+            pool_sizes[config.base_url(provider)] = pool_size
+        except KeyError:
+            continue  # Azure OpenAI is not configured
+    pool_sizes.update(http_settings.get("pool_sizes", {}))
+
+    def transport(pool_size: int) -> httpx.AsyncHTTPTransport:
+        limits = httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS,
+        )
+        return httpx.AsyncHTTPTransport(limits=limits, http2=http2)
+
+    # One transport (and connection pool) per provider host, plus a default for anything else;
+    # the [fixtures] section can record these requests or replay them from files instead
+    default_transport, mounts = wrap_transports(
+        transport(http_settings.get("pool_size", DEFAULT_POOL_SIZE)),
+        {_origin(host): transport(size) for host, size in pool_sizes.items()},
+        config,
+    )
+    return httpx.AsyncClient(transport=default_transport, mounts=mounts, timeout=DEFAULT_TIMEOUT)
+
+
+def get_async_client(config: Optional[Config] = None) -> httpx.AsyncClient:
+    """
+    Return the HTTP client used for every provider call on the running event loop
+
+    The client keeps connections alive between calls, so repeat requests to
+    Google Places, Perplexity and Azure OpenAI skip the TCP and TLS handshake.
+    Blocking callers all share the loop from common.aio, and therefore one client
+    per config; an injected config gets its own pools, hosts and fixture settings.
+
+    Args:
+        config: Settings to use instead of the process-wide config
+    """
+    config = config or get_config()
+    # The repr is a digest of the settings, so equal configs share a client
+    config_key = repr(config)
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop, {}).get(config_key)
+    if client is None:
+        with _clients_lock:
+            loop_clients = _clients.setdefault(loop, {})
+            client = loop_clients.get(config_key)
+            if client is None:
+                client = _build_client(config)
+                loop_clients[config_key] = client
+    return client
+
+
+async def request(provider: str, method: str, url: str, estimated_tokens: int = 0, config: Optional[Config] = None, **kwargs) -> httpx.Response:
+    """
+    Send a request to a provider through its shared rate limiter, retrying throttled responses
+
+    Args:
+        provider: Rate limiter name, e.g. "google_places", "perplexity" or "azure_openai"
+        method: HTTP method
+        url: Request URL
+        estimated_tokens: Tokens to reserve against the provider's tokens/min budget
+        config: Settings for the HTTP client, rate limiter and pricing instead of the process-wide config
+        kwargs: Passed through to httpx.AsyncClient.request
+
+    Returns:
+        The final response, which is still a 429 only if every retry was throttled
+    """
+    limiter = get_limiter(provider, config)
+    for attempt in range(MAX_THROTTLE_RETRIES + 1):
+        await limiter.acquire(estimated_tokens)
+        started = time.monotonic()
+        response = await get_async_client(config).request(method, url, **kwargs)
+        if response.status_code != 429:
+            break
+
+        # Throttled requests cost no tokens; give the reservation back and honor Retry-After
+        limiter.record_tokens(estimated_tokens, 0)
+        limiter.on_throttled(parse_retry_after(response.headers, attempt))
+
+    record_http(provider, url, response.status_code, time.monotonic() - started, retries=attempt, config=config)
+    if response.is_success:
+        limiter.on_success()
+        if estimated_tokens:
+            try:
+                usage = response.json().get("usage", {})
+            except ValueError:
+                usage = {}
+            record_usage(provider, usage, config)
+            if usage.get("total_tokens") is not None:
+                limiter.record_tokens(estimated_tokens, usage["total_tokens"])
+    return response
+
+
+async def post(provider: str, url: str, estimated_tokens: int = 0, config: Optional[Config] = None, **kwargs) -> httpx.Response:
+    """POST to a provider through its shared rate limiter, see request()"""
+    return await request(provider, "POST", url, estimated_tokens=estimated_tokens, config=config, **kwargs)
+
+
+async def get(provider: str, url: str, config: Optional[Config] = None, **kwargs) -> httpx.Response:
+    """GET from a provider through its shared rate limiter, see request()"""
+    return await request(provider, "GET", url, config=config, **kwargs)
+
+
+async def warm_up(providers=("google_places", "perplexity", "azure_openai"), config: Optional[Config] = None) -> None:
+    """Create the HTTP client and provider rate limiters of a config for the running loop ahead of the first request"""
+    get_async_client(config)
+    for provider in providers:
+        get_limiter(provider, config)
+
+
+async def post_stream(provider: str, url: str, on_token: Callable[[str], None], estimated_tokens: int = 0, config: Optional[Config] = None, **kwargs) -> Dict[str, Any]:
+    """
+    POST a streaming (server-sent events) chat completion request through the provider's rate limiter
+
+    Args:
+        provider: Rate limiter name, e.g. "perplexity" or "azure_openai"
+        url: Request URL; the JSON body must set "stream": true
+        on_token: Called with each piece of content as it arrives
+        estimated_tokens: Tokens to reserve against the provider's tokens/min budget
+        config: Settings for the HTTP client, rate limiter and pricing instead of the process-wide config
+        kwargs: Passed through to httpx.AsyncClient.stream
+
+    Returns:
+        The assembled completion in the same shape as a non-streaming chat completion response
+
+    Raises:
+        httpx.HTTPStatusError: If the provider answers with an error status
+    """
+    limiter = get_limiter(provider, config)
+    content_parts = []
+    finish_reason = None
+    usage = None
+    for attempt in range(MAX_THROTTLE_RETRIES + 1):
+        await limiter.acquire(estimated_tokens)
+        started = time.monotonic()
+        async with get_async_client(config).stream("POST", url, **kwargs) as response:
+            if response.status_code == 429 and attempt < MAX_THROTTLE_RETRIES:
+                limiter.record_tokens(estimated_tokens, 0)
+                limiter.on_throttled(parse_retry_after(response.headers, attempt))
+                continue
+            if response.is_error:
+                record_http(provider, url, response.status_code, time.monotonic() - started, retries=attempt, config=config)
+                await response.aread()
+                response.raise_for_status()
+
+            limiter.on_success()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                usage = chunk.get("usage") or usage
+                for choice in chunk.get("choices", []):
+                    delta = (choice.get("delta") or {}).get("content")
+                    if delta:
+                        content_parts.append(delta)
+                        on_token(delta)
+                    finish_reason = choice.get("finish_reason") or finish_reason
+            record_http(provider, url, response.status_code, time.monotonic() - started, retries=attempt, config=config)
+            break
+
+    record_usage(provider, usage, config)
+    if usage and estimated_tokens and usage.get("total_tokens") is not None:
+        limiter.record_tokens(estimated_tokens, usage["total_tokens"])
+    return {
+        "choices": [{"message": {"role": "assistant", "content": "".join(content_parts)}, "finish_reason": finish_reason}],
+        "usage": usage or {},
+    }
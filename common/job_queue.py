@@ -0,0 +1,219 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from common.cache import CACHE_DIR
+
+# Default location of the job queue database, next to the provider caches
+JOB_QUEUE_PATH = os.path.join(CACHE_DIR, "jobs.sqlite")
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+class Checkpoint(dict):
+    """
+    Stage outputs saved for one queued row
+
+    The populators read finished stages from it and store each stage's output as soon
+    as it succeeds; every store is written through to the queue, so a restarted run
+    continues after the last completed stage.
+    """
+
+    def __init__(self, stages: Dict[str, Any], on_save: Callable[[Dict[str, Any]], None]):
+        super().__init__(stages)
+        self._on_save = on_save
+
+    def __setitem__(self, stage: str, output: Any) -> None:
+        super().__setitem__(stage, output)
+        self._on_save(dict(self))
+
+
+class JobQueue:
+    """
+    Persistent work queue of (category, name, city) rows backed by SQLite
+
+    Rows are claimed with a lease. A row whose lease runs out (its worker crashed or the
+    machine slept) goes back to the queue, and any worker process sharing the database
+    picks it up with its checkpoint.
+    """
+
+    def __init__(self, path: str = JOB_QUEUE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, job TEXT NOT NULL, category TEXT NOT NULL, "
+            "name TEXT NOT NULL, city TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'pending', "
+            "checkpoint TEXT NOT NULL DEFAULT '{}', result TEXT, error TEXT, "
+            "attempts INTEGER NOT NULL DEFAULT 0, lease_owner TEXT, lease_expires REAL, "
+            "updated_at REAL NOT NULL, UNIQUE (job, category, name, city))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_job_status ON jobs (job, status)")
+        self._conn.commit()
+
+    def enqueue(self, job: str, category: str, rows: Iterable[Dict[str, str]]) -> int:
+        """
+        Add rows to a job, skipping rows that are already queued for it
+
+        Args:
+            job: Job name, e.g. the city being onboarded
+            category: "accommodation" or "dining"
+            rows: Iterable of {"name": ..., "city": ...} dictionaries
+
+        Returns:
+            Number of rows added
+        """
+        now = time.time()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO jobs (job, category, name, city, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(job, category, row["name"], row["city"], now) for row in rows],
+            )
+            self._conn.commit()
+            return self._conn.total_changes - before
+
+    def claim(self, job: str, worker_id: str, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> Optional[Dict[str, Any]]:
+        """
+        Lease the next pending row of a job, or a row whose previous lease expired
+
+        Returns:
+            Row dictionary with id, category, name, city, attempts and checkpoint, or None if nothing is left
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "UPDATE jobs SET status = 'running', lease_owner = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE id = ("
+                "SELECT id FROM jobs WHERE job = ? AND (status = 'pending' OR "
+                "(status = 'running' AND lease_expires < ?)) ORDER BY id LIMIT 1) "
+                "RETURNING id, category, name, city, attempts, checkpoint",
+                (worker_id, now + lease_seconds, now, job, now),
+            ).fetchone()
+            self._conn.commit()
+        if row is None:
+            return None
+        row_id, category, name, city, attempts, checkpoint = row
+        return {
+            "id": row_id,
+            "category": category,
+            "name": name,
+            "city": city,
+            "attempts": attempts,
+            "checkpoint": json.loads(checkpoint),
+        }
+
+    def renew_lease(self, row_id: int, worker_id: str, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> bool:
+        """Extend a held lease; returns False if the row was reclaimed by another worker"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND lease_owner = ? AND status = 'running'",
+                (time.time() + lease_seconds, row_id, worker_id),
+            )
+            self._conn.commit()
+            return cursor.rowcount == 1
+
+    def lease_owners(self, job: str) -> List[str]:
+        """Return the workers currently holding leases on a job's rows"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT lease_owner FROM jobs WHERE job = ? AND status = 'running'", (job,)
+            ).fetchall()
+        return [owner for (owner,) in rows if owner]
+
+    def release(self, job: str, worker_id: str) -> int:
+        """Return a worker's leased rows to the queue right away, e.g. after its process died"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'pending', lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+                "WHERE job = ? AND lease_owner = ? AND status = 'running'",
+                (time.time(), job, worker_id),
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    # The writes below only apply while worker_id still holds the row's lease; once the row has
+    # been reclaimed, the new owner's checkpoint and result must not be overwritten
+
+    def save_checkpoint(self, row_id: int, worker_id: str, stages: Dict[str, Any]) -> bool:
+        """Persist the finished stage outputs of a row; returns False if the lease was lost"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET checkpoint = ?, updated_at = ? WHERE id = ? AND lease_owner = ? AND status = 'running'",
+                (json.dumps(stages, default=str), time.time(), row_id, worker_id),
+            )
+            self._conn.commit()
+            return cursor.rowcount == 1
+
+    def checkpoint(self, row: Dict[str, Any], worker_id: str) -> Checkpoint:
+        """Return a Checkpoint for a claimed row that writes each stage through to the queue"""
+        return Checkpoint(row["checkpoint"], lambda stages: self.save_checkpoint(row["id"], worker_id, stages))
+
+    def complete(self, row_id: int, worker_id: str, result: Dict[str, Any]) -> bool:
+        """Mark a row done and store its final result; returns False if the lease was lost"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, error = NULL, lease_owner = NULL, "
+                "lease_expires = NULL, updated_at = ? WHERE id = ? AND lease_owner = ? AND status = 'running'",
+                (json.dumps(result, default=str), time.time(), row_id, worker_id),
+            )
+            self._conn.commit()
+            return cursor.rowcount == 1
+
+    def fail(self, row_id: int, worker_id: str, error: str, max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> bool:
+        """
+        Record an error; the row is retried (keeping its checkpoint) until max_attempts is reached
+
+        Returns False if the lease was lost, in which case the row is left to its new owner.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "error = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+                "WHERE id = ? AND lease_owner = ? AND status = 'running'",
+                (max_attempts, error, time.time(), row_id, worker_id),
+            )
+            self._conn.commit()
+            return cursor.rowcount == 1
+
+    def retry_failed(self, job: str) -> int:
+        """Put a job's failed rows back in the queue; returns the number of rows requeued"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'pending', attempts = 0, updated_at = ? WHERE job = ? AND status = 'failed'",
+                (time.time(), job),
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def status(self, job: str) -> Dict[str, int]:
+        """Count a job's rows by status"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs WHERE job = ? GROUP BY status", (job,)).fetchall()
+        return dict(rows)
+
+    def results(self, job: str) -> Iterator[Dict[str, Any]]:
+        """Return every finished or failed row of a job, in queue order"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, category, name, city, status, result, error FROM jobs "
+                "WHERE job = ? AND status IN ('done', 'failed') ORDER BY id",
+                (job,),
+            ).fetchall()
+        for row_id, category, name, city, status, result, error in rows:
+            output = {"row": row_id, "category": category, "name": name, "city": city, "status": status}
+            if result is not None:
+                output["result"] = json.loads(result)
+            else:
+                output["error"] = error
+            yield output
@@ -0,0 +1,372 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from common.cache import CACHE_DIR
+from common.config import Config, get_config
+
+# Where finished runs are exported, overridable via the [metrics] config section
+PROMETHEUS_PATH = os.path.join(CACHE_DIR, "metrics.prom")
+RUNS_PATH = os.path.join(CACHE_DIR, "runs.jsonl")
+# Once the runs file reaches runs_max_bytes it is rotated to runs.jsonl.1, keeping runs_backups old files; 0 disables the cap
+DEFAULT_RUNS_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_RUNS_BACKUPS = 3
+
+# Upper bounds of the stage latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0, 160.0)
+
+# USD list prices when this was written; set the [pricing] config section to your actual rates.
+# Google Places is billed per request by endpoint, the LLMs per request and per million tokens.
+DEFAULT_PRICING = {
+    "google_places": {"searchText": 0.040, "details": 0.020, "photo": 0.007},
+    "perplexity": {"request": 0.006, "prompt_per_million": 3.0, "completion_per_million": 15.0},
+    "azure_openai": {"request": 0.0, "prompt_per_million": 2.5, "completion_per_million": 10.0},
+}
+
+_current_run: contextvars.ContextVar[Optional["RunMetrics"]] = contextvars.ContextVar("current_run", default=None)
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+def _endpoint(provider: str, url: str) -> str:
+    """Billing endpoint of a request, e.g. "searchText" or "photo" for Google Places"""
+    if provider != "google_places":
+        return "chat"
+    path = url.split("?", 1)[0]
+    if path.endswith(":searchText"):
+        return "searchText"
+    if path.endswith("/media"):
+        return "photo"
+    return "details"
+
+
+def _pricing(config: Optional[Config] = None) -> Dict[str, Dict[str, float]]:
+    pricing = {provider: dict(prices) for provider, prices in DEFAULT_PRICING.items()}
+    for provider, prices in (config or get_config()).section("pricing").items():
+        pricing.setdefault(provider, {}).update(prices)
+    return pricing
+
+
+class Span:
+    """Timing and usage of one pipeline stage within a run"""
+
+    def __init__(self, stage: str, run_started: float):
+        self.stage = stage
+        self.offset_s = time.monotonic() - run_started
+        self._started = time.monotonic()
+        self.duration_s = 0.0
+        self.status = "ok"
+        self.http: List[Dict[str, Any]] = []
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cache: Dict[str, str] = {}
+        self.cost_usd = 0.0
+        # How an answer cut off at its output-token limit was recovered, if one was
+        self.truncated: Optional[str] = None
+
+    def finish(self) -> None:
+        self.duration_s = time.monotonic() - self._started
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "stage": self.stage,
+            "offset_s": round(self.offset_s, 3),
+            "duration_s": round(self.duration_s, 3),
+            "status": self.status,
+            "http": self.http,
+            "retries": self.retries,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cache": self.cache,
+            "cost_usd": round(self.cost_usd, 6),
+            "truncated": self.truncated,
+        }
+
+
+class RunMetrics:
+    """Spans and totals of one populate or refresh call"""
+
+    def __init__(self, category: str, kind: str, name: str, city: str, config: Optional[Config] = None):
+        self.run_id = uuid.uuid4().hex[:12]
+        # Settings of the call, deciding where the run is exported
+        self.config = config
+        self.category = category
+        self.kind = kind
+        self.name = name
+        self.city = city
+        self.started_at = time.time()
+        self._started = time.monotonic()
+        self.duration_s = 0.0
+        self.status = "ok"
+        self.spans: List[Span] = []
+        # Requests made outside a stage span, e.g. photo lookups after the Places stage
+        self.unattributed = Span("other", self._started)
+
+    def start_span(self, stage: str) -> Span:
+        span = Span(stage, self._started)
+        self.spans.append(span)
+        return span
+
+    def summary(self) -> Dict[str, Any]:
+        """JSON-serializable summary with the per-stage breakdown and run totals"""
+        spans = self.spans + ([self.unattributed] if self.unattributed.http else [])
+        return {
+            "run_id": self.run_id,
+            "category": self.category,
+            "kind": self.kind,
+            "name": self.name,
+            "city": self.city,
+            "started_at": self.started_at,
+            "duration_s": round(self.duration_s, 3),
+            "status": self.status,
+            "stages": [span.to_dict() for span in spans],
+            "totals": {
+                "http_requests": sum(len(span.http) for span in spans),
+                "retries": sum(span.retries for span in spans),
+                "prompt_tokens": sum(span.prompt_tokens for span in spans),
+                "completion_tokens": sum(span.completion_tokens for span in spans),
+                "cost_usd": round(sum(span.cost_usd for span in spans), 6),
+            },
+        }
+
+
+class MetricsRegistry:
+    """Process-wide counters and histograms, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List[float]] = {}
+        self._help: Dict[str, Tuple[str, str]] = {}
+
+    def inc(self, name: str, help_text: str, value: float = 1.0, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help[name] = ("counter", help_text)
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, help_text: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help[name] = ("histogram", help_text)
+            # Bucket counts, then sum and count
+            series = self._histograms.setdefault(key, [0.0] * (len(LATENCY_BUCKETS) + 2))
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> str:
+        """Return every metric in the Prometheus text exposition format"""
+        def label_text(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+            parts = [f'{key}="{str(value)}"' for key, value in labels] + ([extra] if extra else [])
+            return "{" + ",".join(parts) + "}" if parts else ""
+
+        lines = []
+        with self._lock:
+            for name, (metric_type, help_text) in sorted(self._help.items()):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                if metric_type == "counter":
+                    for (series_name, labels), value in sorted(self._counters.items()):
+                        if series_name == name:
+                            lines.append(f"{name}{label_text(labels)} {value:g}")
+                else:
+                    for (series_name, labels), series in sorted(self._histograms.items()):
+                        if series_name != name:
+                            continue
+                        for bound, count in zip(LATENCY_BUCKETS, series):
+                            bucket_label = 'le="%g"' % bound
+                            lines.append(f"{name}_bucket{label_text(labels, bucket_label)} {count:g}")
+                        inf_label = 'le="+Inf"'
+                        lines.append(f"{name}_bucket{label_text(labels, inf_label)} {series[-1]:g}")
+                        lines.append(f"{name}_sum{label_text(labels)} {series[-2]:.6f}")
+                        lines.append(f"{name}_count{label_text(labels)} {series[-1]:g}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+_export_lock = threading.Lock()
+
+
+def _write_atomic(path: str, text: str, append: bool = False) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if append:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(text)
+        return
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+def _rotate(path: str, max_bytes: int, backups: int) -> None:
+    """Shift path to path.1 (path.1 to path.2, and so on, dropping the oldest) once it holds max_bytes"""
+    if not max_bytes:
+        return
+    try:
+        if os.path.getsize(path) < max_bytes:
+            return
+    except OSError:
+        return
+    if backups <= 0:
+        os.remove(path)
+        return
+    for index in range(backups - 1, 0, -1):
+        if os.path.exists(f"{path}.{index}"):
+            os.replace(f"{path}.{index}", f"{path}.{index + 1}")
+    os.replace(path, f"{path}.1")
+
+
+def export_run(run: RunMetrics) -> None:
+    """Append the run's JSON summary, rotating the runs file once it is full, and rewrite the Prometheus text file"""
+    metrics_settings = (run.config or get_config()).section("metrics")
+    if not metrics_settings.get("enabled", True):
+        return
+    try:
+        with _export_lock:
+            runs_path = metrics_settings.get("runs_path", RUNS_PATH)
+            _rotate(runs_path, metrics_settings.get("runs_max_bytes", DEFAULT_RUNS_MAX_BYTES), metrics_settings.get("runs_backups", DEFAULT_RUNS_BACKUPS))
+            _write_atomic(runs_path, json.dumps(run.summary(), default=str) + "\n", append=True)
+            _write_atomic(metrics_settings.get("prometheus_path", PROMETHEUS_PATH), REGISTRY.render())
+    except OSError as e:
+        print(f"[METRICS] Could not write metrics: {e}")
+
+
+def _finish_run(run: RunMetrics, result: Any) -> None:
+    run.duration_s = time.monotonic() - run._started
+    if not result:
+        run.status = "error"
+    elif isinstance(result, dict) and "error" in result:
+        run.status = "timeout" if result.get("timeout") else "error"
+    REGISTRY.inc("data_formatter_runs_total", "Populate and refresh calls by outcome", category=run.category, kind=run.kind, status=run.status)
+    REGISTRY.observe("data_formatter_run_duration_seconds", "End-to-end duration of populate and refresh calls", run.duration_s, category=run.category, kind=run.kind)
+    export_run(run)
+
+
+def instrumented(category: str, kind: str = "populate") -> Callable[[Callable[..., Awaitable[Any]]], Callable[..., Awaitable[Any]]]:
+    """
+    Decorator for a category's populate/refresh coroutine: records its stages as one run
+
+    The first two positional arguments are the place name and city, and a config keyword
+    argument decides where the run is exported. Calls made while a run
+    is already active (e.g. a refresh falling back to a full populate) join that run. When
+    the call gets an on_event callback, the finished run's summary is sent as ("metrics", summary).
+    """
+    def decorator(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        @functools.wraps(func)
+        async def wrapper(name: str, city: str, *args: Any, **kwargs: Any) -> Any:
+            if _current_run.get() is not None:
+                return await func(name, city, *args, **kwargs)
+
+            run = RunMetrics(category, kind, name, city, config=kwargs.get("config"))
+            token = _current_run.set(run)
+            result = None
+            try:
+                result = await func(name, city, *args, **kwargs)
+                return result
+            finally:
+                _current_run.reset(token)
+                _finish_run(run, result)
+                on_event = kwargs.get("on_event")
+                if on_event is not None:
+                    on_event("metrics", run.summary())
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def stage_span(stage: str) -> Iterator[Optional[Span]]:
+    """Time a stage of the active run; the caller sets span.status. Yields None when no run is active"""
+    run = _current_run.get()
+    if run is None:
+        yield None
+        return
+    span = run.start_span(stage)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException:
+        span.status = "cancelled"
+        raise
+    finally:
+        _current_span.reset(token)
+        span.finish()
+        REGISTRY.observe("data_formatter_stage_duration_seconds", "Duration of pipeline stages", span.duration_s, category=run.category, stage=stage, status=span.status)
+
+
+def _active_span() -> Optional[Span]:
+    span = _current_span.get()
+    if span is None:
+        run = _current_run.get()
+        span = run.unattributed if run is not None else None
+    return span
+
+
+def record_http(provider: str, url: str, status_code: int, duration_s: float, retries: int = 0, config: Optional[Config] = None) -> None:
+    """Record a finished provider request, including how many throttled attempts preceded it, priced from config's [pricing]"""
+    endpoint = _endpoint(provider, url)
+    REGISTRY.inc("data_formatter_http_requests_total", "Provider HTTP requests by status", provider=provider, endpoint=endpoint, status=str(status_code))
+    if retries:
+        REGISTRY.inc("data_formatter_http_retries_total", "Provider requests retried after a 429", value=retries, provider=provider)
+
+    cost = 0.0
+    if 200 <= status_code < 300:
+        prices = _pricing(config).get(provider, {})
+        cost = prices.get(endpoint if provider == "google_places" else "request", 0.0)
+        if cost:
+            REGISTRY.inc("data_formatter_cost_usd_total", "Estimated provider spend in USD", value=cost, provider=provider)
+
+    span = _active_span()
+    if span is not None:
+        span.http.append({"provider": provider, "endpoint": endpoint, "status": status_code, "duration_s": round(duration_s, 3)})
+        span.retries += retries
+        span.cost_usd += cost
+
+
+def record_usage(provider: str, usage: Optional[Dict[str, Any]], config: Optional[Config] = None) -> None:
+    """Record prompt and completion tokens from a chat completion's "usage" block, priced from config's [pricing]"""
+    if not usage:
+        return
+    prompt_tokens = int(usage.get("prompt_tokens") or 0)
+    completion_tokens = int(usage.get("completion_tokens") or 0)
+    prices = _pricing(config).get(provider, {})
+    cost = (prompt_tokens * prices.get("prompt_per_million", 0.0) + completion_tokens * prices.get("completion_per_million", 0.0)) / 1_000_000
+
+    REGISTRY.inc("data_formatter_tokens_total", "LLM tokens used", value=prompt_tokens, provider=provider, kind="prompt")
+    REGISTRY.inc("data_formatter_tokens_total", "LLM tokens used", value=completion_tokens, provider=provider, kind="completion")
+    if cost:
+        REGISTRY.inc("data_formatter_cost_usd_total", "Estimated provider spend in USD", value=cost, provider=provider)
+
+    span = _active_span()
+    if span is not None:
+        span.prompt_tokens += prompt_tokens
+        span.completion_tokens += completion_tokens
+        span.cost_usd += cost
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    """Record a lookup in one of the provider caches"""
+    result = "hit" if hit else "miss"
+    REGISTRY.inc("data_formatter_cache_lookups_total", "Provider cache lookups", cache=cache, result=result)
+    span = _active_span()
+    if span is not None:
+        span.cache[cache] = result
+
+
+def record_truncation(provider: str, outcome: str) -> None:
+    """Record an LLM answer cut off at its output-token limit and whether it was "continued", "repaired" or "failed" """
+    REGISTRY.inc("data_formatter_truncations_total", "LLM answers that hit their output-token limit, by recovery", provider=provider, outcome=outcome)
+    span = _active_span()
+    if span is not None:
+        span.truncated = outcome
@@ -0,0 +1,222 @@
+import json
+import math
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from common.cache import get_cache
+from common.completion_cache import template_version
+from common.config import Config, get_config
+from common.metrics import record_truncation
+from common.prompts import count_tokens
+
+# Defaults for adaptive output budgets, overridable via the [output_budget] config section
+DEFAULT_MIN_SAMPLES = 20
+DEFAULT_PERCENTILE = 0.95
+DEFAULT_HEADROOM = 1.25
+DEFAULT_MIN_OUTPUT_TOKENS = 300
+DEFAULT_WINDOW = 200
+OUTPUT_STATS_TTL_SECONDS = 90 * 24 * 60 * 60
+OUTPUT_STATS_MAX_ENTRIES = 1000
+# Length samples of everything in an answer outside its field values (keys, braces, fences)
+OVERHEAD = "__overhead__"
+
+CONTINUE_PROMPT = "Your answer was cut off. Continue it exactly where it stopped, without repeating anything and without any other text."
+
+_stats: Dict[str, Dict[str, List[int]]] = {}
+_stats_lock = threading.Lock()
+
+
+def _settings(config: Optional[Config] = None) -> Dict[str, Any]:
+    return (config or get_config()).section("output_budget")
+
+
+def _stats_cache():
+    return get_cache("output_lengths", ttl_seconds=OUTPUT_STATS_TTL_SECONDS, max_entries=OUTPUT_STATS_MAX_ENTRIES)
+
+
+def _stats_key(provider: str, template: str) -> str:
+    # Editing a template resets its statistics, since the answers it asks for may change length
+    return f"{provider}:{template_version(template)}"
+
+
+def _samples(key: str) -> Dict[str, List[int]]:
+    # Caller holds _stats_lock
+    if key not in _stats:
+        _stats[key] = _stats_cache().get(key) or {}
+    return _stats[key]
+
+
+def strip_fence(content: str) -> str:
+    """Remove an optional ```json (or bare ```) fence around a completion"""
+    content = content.strip()
+    if content.startswith("```"):
+        content = content[3:]
+        if content.startswith("json"):
+            content = content[4:]
+    if content.endswith("```"):
+        content = content[:-3]
+    return content.strip()
+
+
+def _percentile(values: List[int], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(q * len(ordered))) - 1)]
+
+
+def record_output_lengths(provider: str, template: str, content: str, config: Optional[Config] = None) -> None:
+    """
+    Add the per-field token lengths of a complete JSON answer to the template's statistics
+
+    Answers that are not JSON objects are ignored.
+    """
+    settings = _settings(config)
+    if not settings.get("enabled", True):
+        return
+    try:
+        answer = json.loads(strip_fence(content))
+    except ValueError:
+        return
+    if not isinstance(answer, dict):
+        return
+
+    lengths = {field: count_tokens(value if isinstance(value, str) else json.dumps(value)) for field, value in answer.items()}
+    lengths[OVERHEAD] = max(0, count_tokens(content) - sum(lengths.values()))
+    window = settings.get("window", DEFAULT_WINDOW)
+    key = _stats_key(provider, template)
+    with _stats_lock:
+        samples = _samples(key)
+        for field, length in lengths.items():
+            samples[field] = (samples.get(field, []) + [length])[-window:]
+        _stats_cache().set(key, samples)
+
+
+def output_token_budget(provider: str, template: str, ceiling: int, config: Optional[Config] = None) -> int:
+    """
+    Choose max_tokens for a prompt template from the lengths its earlier answers needed
+
+    The budget is the sum of each field's length percentile plus the JSON overhead, times a
+    headroom factor, clamped between min_tokens and ceiling. Until min_samples answers have
+    been seen (or with [output_budget] enabled = false) the ceiling is used.
+
+    Args:
+        provider: "perplexity" or "azure_openai"
+        template: Prompt template the answers were given for
+        ceiling: The stage's fixed maximum, also used when there is too little data
+        config: Settings to use instead of the process-wide config
+
+    Returns:
+        Number of output tokens to request
+    """
+    settings = _settings(config)
+    if not settings.get("enabled", True):
+        return ceiling
+    with _stats_lock:
+        samples = _samples(_stats_key(provider, template))
+        if len(samples.get(OVERHEAD, [])) < settings.get("min_samples", DEFAULT_MIN_SAMPLES):
+            return ceiling
+        percentile = settings.get("percentile", DEFAULT_PERCENTILE)
+        expected = sum(_percentile(lengths, percentile) for lengths in samples.values() if lengths)
+    budget = int(math.ceil(expected * settings.get("headroom", DEFAULT_HEADROOM)))
+    return max(settings.get("min_tokens", DEFAULT_MIN_OUTPUT_TOKENS), min(ceiling, budget))
+
+
+def repair_json(content: str) -> Optional[str]:
+    """
+    Close a JSON object that was cut off mid-answer
+
+    The unfinished string is closed where it stopped, so a truncated last field keeps the text
+    it has. If that does not parse (e.g. the cut fell inside a key), the answer is cut back to
+    the last complete value instead.
+
+    Returns:
+        Parseable JSON text, or None if nothing could be recovered
+    """
+    text = strip_fence(content)
+    stack: List[str] = []
+    in_string = False
+    escaped = False
+    # (position of a comma between values, open containers at that point)
+    cut_points: List[Tuple[int, List[str]]] = []
+    for position, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+        elif char == ",":
+            cut_points.append((position, list(stack)))
+
+    tail = text[:-1] if escaped else text
+    candidates = [tail + ('"' if in_string else "") + "".join(reversed(stack))]
+    candidates += [text[:position] + "".join(reversed(open_containers)) for position, open_containers in reversed(cut_points[-5:])]
+    for candidate in candidates:
+        try:
+            json.loads(candidate)
+        except ValueError:
+            continue
+        return candidate
+    return None
+
+
+async def finish_truncated(provider: str, complete: Callable[[List[Dict[str, str]], int], Awaitable[Dict[str, Any]]], prompt: str, content: str, max_tokens: int, ceiling: int) -> Tuple[str, bool]:
+    """
+    Recover a completion that stopped at max_tokens (finish_reason "length")
+
+    The model is asked once to continue from where it stopped, with what is left of the stage's
+    fixed ceiling (at least half of it). If the joined answer still is not valid JSON, it is
+    repaired locally with repair_json.
+
+    Args:
+        provider: "perplexity" or "azure_openai", for logging and metrics
+        complete: Sends chat messages with a max_tokens value and returns the chat completion response
+        prompt: The original user prompt
+        content: The truncated answer
+        max_tokens: Output budget the truncated answer was given
+        ceiling: The stage's fixed maximum output budget
+
+    Returns:
+        Tuple of the recovered answer and whether it is complete (False if it was repaired)
+    """
+    print(f"[OUTPUT] {provider} answer hit its {max_tokens}-token limit, asking it to continue")
+    messages = [
+        {"role": "user", "content": prompt},
+        {"role": "assistant", "content": content},
+        {"role": "user", "content": CONTINUE_PROMPT},
+    ]
+    finish_reason = "length"
+    continuation = ""
+    try:
+        response_data = await complete(messages, max(ceiling - max_tokens, ceiling // 2))
+        if response_data.get("choices"):
+            continuation = response_data["choices"][0]["message"]["content"] or ""
+            finish_reason = response_data["choices"][0].get("finish_reason")
+    except Exception as e:
+        print(f"[OUTPUT] {provider} continuation failed: {e}")
+
+    # Models sometimes restart the whole answer instead of continuing it
+    joined = content + (strip_fence(continuation) if continuation.lstrip().startswith("```") else continuation)
+    for candidate in (joined, continuation):
+        try:
+            json.loads(strip_fence(candidate))
+        except ValueError:
+            continue
+        if finish_reason != "length":
+            record_truncation(provider, "continued")
+            return candidate, True
+
+    repaired = repair_json(joined)
+    if repaired is None:
+        record_truncation(provider, "failed")
+        print(f"[OUTPUT] {provider} answer could not be completed or repaired")
+        return joined, False
+    record_truncation(provider, "repaired")
+    print(f"[OUTPUT] Repaired the truncated {provider} answer")
+    return repaired, False
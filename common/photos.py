@@ -0,0 +1,225 @@
+import asyncio
+import hashlib
+import io
+import os
+import time
+from typing import List, Optional
+
+import httpx
+from PIL import Image
+from common.aio import run_sync
+from common.cache import CACHE_DIR, get_cache
+from common.config import Config, get_config
+from common.http_client import get, get_async_client
+from common.metrics import record_cache
+from common.singleflight import request_key, single_flight
+
+# Defaults for the on-disk photo cache, overridable via the [photos] config section
+PHOTO_DIR = os.path.join(CACHE_DIR, "photos")
+FULL_SIZE_PX = 800
+THUMBNAIL_SIZE_PX = 240
+PHOTO_MAX_AGE_SECONDS = 30 * 24 * 60 * 60
+THUMBNAIL_JPEG_QUALITY = 80
+# Resolved media URIs are short-lived, so they are only reused for a limited time
+PHOTO_URI_TTL_SECONDS = 12 * 60 * 60
+PHOTO_URI_MAX_ENTRIES = 20000
+
+
+def _photo_settings(config: Optional[Config] = None):
+    return (config or get_config()).section("photos")
+
+
+def get_photo_uri_cache(config: Optional[Config] = None):
+    """Return the shared cache of resolved photo media URIs configured from the [photos] config section"""
+    photo_settings = _photo_settings(config)
+    return get_cache(
+        "photo_uris",
+        ttl_seconds=photo_settings.get("uri_ttl_seconds", PHOTO_URI_TTL_SECONDS),
+        max_entries=photo_settings.get("uri_max_entries", PHOTO_URI_MAX_ENTRIES),
+    )
+
+
+async def _resolve_photo_uri(photo_name: str, size_px: int, config: Config) -> Optional[str]:
+    uri_cache = get_photo_uri_cache(config)
+    cache_key = f"{photo_name}|{size_px}"
+    photo_uri = uri_cache.get(cache_key)
+    record_cache("photo_uris", photo_uri is not None)
+    if photo_uri is not None:
+        return photo_uri
+
+    # skipHttpRedirect returns the final media URI as JSON instead of redirecting to it;
+    # the key goes in a header, so it never ends up in a URL shown to users
+    url = f"{config.base_url('google_places')}/v1/{photo_name}/media"
+    try:
+        response = await get(
+            "google_places",
+            url,
+            params={"maxHeightPx": size_px, "maxWidthPx": size_px, "skipHttpRedirect": "true"},
+            headers={"X-Goog-Api-Key": config.api_key("google_places")},
+            config=config,
+        )
+        response.raise_for_status()
+        photo_uri = response.json().get("photoUri")
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"Error resolving Google Places photo {photo_name}: {e}")
+        return None
+
+    if photo_uri:
+        uri_cache.set(cache_key, photo_uri)
+    return photo_uri
+
+
+async def resolve_photo_uri_async(photo_name: str, size_px: Optional[int] = None, config: Optional[Config] = None) -> Optional[str]:
+    """
+    Return the media URI of a Places photo, resolving it with the Photo API only if it is not cached
+
+    Args:
+        photo_name: Places photo resource name, e.g. "places/<id>/photos/<id>"
+        size_px: Maximum width and height requested from the Photo API
+        config: Settings to use instead of the process-wide config
+
+    Returns:
+        Media URI that can be fetched without an API key, or None if it could not be resolved
+    """
+    config = config or get_config()
+    size_px = size_px or _photo_settings(config).get("full_size_px", FULL_SIZE_PX)
+    return await single_flight(request_key("photo_uri", photo_name, size_px, config), lambda: _resolve_photo_uri(photo_name, size_px, config))
+
+
+async def resolve_photo_uris_async(photo_names: List[str], size_px: Optional[int] = None, config: Optional[Config] = None) -> List[Optional[str]]:
+    """Resolve the media URIs of several photos concurrently, in the order given"""
+    return list(await asyncio.gather(*(resolve_photo_uri_async(name, size_px, config=config) for name in photo_names)))
+
+
+def _photo_path(photo_name: str, size_px: int, kind: str) -> str:
+    digest = hashlib.sha256(photo_name.encode("utf-8")).hexdigest()[:32]
+    return os.path.join(PHOTO_DIR, f"{digest}_{kind}{size_px}")
+
+
+def _read_fresh(path: str, config: Config) -> Optional[bytes]:
+    max_age = _photo_settings(config).get("max_age_seconds", PHOTO_MAX_AGE_SECONDS)
+    try:
+        if time.time() - os.path.getmtime(path) > max_age:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def make_thumbnail(data: bytes, size_px: int) -> bytes:
+    """
+    Downscale image bytes to fit a size_px square, encoded as JPEG
+
+    Args:
+        data: Original image bytes
+        size_px: Maximum width and height of the thumbnail
+
+    Returns:
+        JPEG bytes of the thumbnail
+    """
+    image = Image.open(io.BytesIO(data))
+    image.thumbnail((size_px, size_px))
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=THUMBNAIL_JPEG_QUALITY, optimize=True)
+    return output.getvalue()
+
+
+async def _download_photo(photo_name: str, size_px: int, config: Config) -> Optional[bytes]:
+    path = _photo_path(photo_name, size_px, "full")
+    data = _read_fresh(path, config)
+    if data is not None:
+        return data
+
+    photo_uri = await resolve_photo_uri_async(photo_name, size_px, config=config)
+    if photo_uri is None:
+        return None
+    try:
+        # The media URI is served by Google's image CDN, outside the Places API quota
+        response = await get_async_client(config).get(photo_uri, follow_redirects=True)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        print(f"Error fetching Google Places photo {photo_name}: {e}")
+        return None
+
+    _write_atomic(path, response.content)
+    return response.content
+
+
+async def fetch_photo_async(photo_name: str, size_px: Optional[int] = None, config: Optional[Config] = None) -> Optional[bytes]:
+    """
+    Return a Places photo at full size, downloading it only if it is not cached on disk
+
+    Args:
+        photo_name: Places photo resource name, e.g. "places/<id>/photos/<id>"
+        size_px: Maximum width and height requested from the Photo API
+        config: Settings to use instead of the process-wide config
+
+    Returns:
+        Image bytes, or None if the photo could not be fetched
+    """
+    config = config or get_config()
+    size_px = size_px or _photo_settings(config).get("full_size_px", FULL_SIZE_PX)
+    # Sessions rendering the same place at once share one download
+    return await single_flight(request_key("photo", photo_name, size_px, config), lambda: _download_photo(photo_name, size_px, config))
+
+
+async def fetch_thumbnail_async(photo_name: str, size_px: Optional[int] = None, config: Optional[Config] = None) -> Optional[bytes]:
+    """
+    Return a cached thumbnail of a Places photo, creating it from the full size photo if needed
+
+    Args:
+        photo_name: Places photo resource name
+        size_px: Maximum width and height of the thumbnail
+        config: Settings to use instead of the process-wide config
+
+    Returns:
+        JPEG thumbnail bytes, or None if the photo could not be fetched
+    """
+    config = config or get_config()
+    size_px = size_px or _photo_settings(config).get("thumbnail_size_px", THUMBNAIL_SIZE_PX)
+    path = _photo_path(photo_name, size_px, "thumb")
+    thumbnail = _read_fresh(path, config)
+    if thumbnail is not None:
+        return thumbnail
+
+    data = await fetch_photo_async(photo_name, config=config)
+    if data is None:
+        return None
+    try:
+        thumbnail = make_thumbnail(data, size_px)
+    except OSError as e:
+        print(f"Could not create thumbnail for {photo_name}: {e}")
+        return None
+    _write_atomic(path, thumbnail)
+    return thumbnail
+
+
+async def fetch_thumbnails_async(photo_names: List[str], size_px: Optional[int] = None, config: Optional[Config] = None) -> List[Optional[bytes]]:
+    """Fetch thumbnails for several photos concurrently, in the order given"""
+    return list(await asyncio.gather(*(fetch_thumbnail_async(name, size_px, config=config) for name in photo_names)))
+
+
+def fetch_photo(photo_name: str, size_px: Optional[int] = None, config: Optional[Config] = None) -> Optional[bytes]:
+    """Blocking wrapper around fetch_photo_async"""
+    return run_sync(fetch_photo_async(photo_name, size_px, config=config))
+
+
+def resolve_photo_uri(photo_name: str, size_px: Optional[int] = None, config: Optional[Config] = None) -> Optional[str]:
+    """Blocking wrapper around resolve_photo_uri_async"""
+    return run_sync(resolve_photo_uri_async(photo_name, size_px, config=config))
+
+
+def fetch_thumbnails(photo_names: List[str], size_px: Optional[int] = None, config: Optional[Config] = None) -> List[Optional[bytes]]:
+    """Blocking wrapper around fetch_thumbnails_async"""
+    return run_sync(fetch_thumbnails_async(photo_names, size_px, config=config))
@@ -0,0 +1,236 @@
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from common.config import Config, get_config
+
+# Input-token budgets per LLM stage, overridable via the [prompts] config section
+DEFAULT_INPUT_TOKEN_BUDGETS = {
+    "perplexity": 1200,
+    "azure_openai": 2000,
+}
+DEFAULT_MAX_REVIEWS = 5
+DEFAULT_REVIEW_SNIPPET_CHARS = 300
+# Trimming never shortens a value below this, so every field keeps some content
+MIN_TRIMMED_CHARS = 80
+# Values that carry no information for the model; the prompts tell it how to fill missing fields
+PLACEHOLDER_VALUES = {"", "n/a", "na", "none", "null", "to be filled", "not available", "unknown"}
+ELLIPSIS = "…"
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_encoding: Any = None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count the tokens a prompt will cost, locally and without a request
+
+    Uses tiktoken when it is installed; otherwise words and punctuation are counted, with long
+    words split into 4-character pieces, which stays within about 10% of the BPE count for
+    English prose and JSON.
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return sum((len(piece) + 3) // 4 for piece in _TOKEN_PATTERN.findall(text))
+
+
+def input_token_budget(stage: str, config: Optional[Config] = None) -> int:
+    """Input-token budget for "perplexity" or "azure_openai" from [prompts] <stage>_input_tokens"""
+    config = config or get_config()
+    return int(config.section("prompts").get(f"{stage}_input_tokens", DEFAULT_INPUT_TOKEN_BUDGETS[stage]))
+
+
+def is_placeholder(value: Any) -> bool:
+    if value is None:
+        return True
+    if isinstance(value, (list, dict)):
+        return not value
+    return str(value).strip().lower() in PLACEHOLDER_VALUES
+
+
+def compact_json(data: Any) -> str:
+    """JSON without indentation or spaces after separators, keeping non-ASCII text as is"""
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+def compact_context(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Drop placeholder values and values that repeat an earlier field verbatim
+
+    Args:
+        data: Context fields, e.g. the Google Places output
+
+    Returns:
+        New dictionary with the remaining fields in their original order
+    """
+    compacted = {}
+    seen = set()
+    for field, value in data.items():
+        if is_placeholder(value):
+            continue
+        fingerprint = compact_json(value).lower()
+        if fingerprint in seen:
+            continue
+        seen.add(fingerprint)
+        compacted[field] = value
+    return compacted
+
+
+def labelled_lines(data: Dict[str, Any], labels: Dict[str, str]) -> str:
+    """Render the non-placeholder, non-repeated fields named in labels as "Label: value" lines"""
+    compacted = compact_context({field: data.get(field) for field in labels})
+    return "\n".join(f"{labels[field]}: {_render_value(value)}" for field, value in compacted.items())
+
+
+def _collapse_whitespace(text: str) -> str:
+    return " ".join(text.split())
+
+
+def truncate_text(text: str, max_chars: int) -> str:
+    """Shorten text to at most max_chars, cutting at a word boundary and marking the cut"""
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max(1, max_chars - len(ELLIPSIS))]
+    if " " in cut:
+        cut = cut[:cut.rindex(" ")]
+    return cut.rstrip(" ,;:-") + ELLIPSIS
+
+
+def review_snippets(reviews: List[Any], max_reviews: int = DEFAULT_MAX_REVIEWS, max_chars: int = DEFAULT_REVIEW_SNIPPET_CHARS) -> List[str]:
+    """
+    Whitespace-collapsed, deduplicated review texts, each trimmed to max_chars
+
+    Args:
+        reviews: Review dictionaries with a "text" key (as Google Places returns them) or strings
+        max_reviews: Number of snippets to keep
+        max_chars: Longest snippet in characters
+
+    Returns:
+        List of snippets, in the order the reviews were given
+    """
+    snippets = []
+    seen = set()
+    for review in reviews:
+        text = review.get("text", "") if isinstance(review, dict) else review
+        if not isinstance(text, str):
+            continue
+        text = _collapse_whitespace(text)
+        if not text or text.lower() in seen:
+            continue
+        seen.add(text.lower())
+        snippets.append(truncate_text(text, max_chars))
+        if len(snippets) >= max_reviews:
+            break
+    return snippets
+
+
+def compact_answer(answer: Any) -> Any:
+    """
+    Reduce an earlier stage's LLM answer to its content
+
+    Accepts the raw completion text or the stage's result dictionary ({"raw_response": ...}).
+    A JSON answer (optionally in a ```json fence) is returned as a dictionary without its
+    placeholder fields; any other answer is returned as whitespace-collapsed text.
+    """
+    if isinstance(answer, dict):
+        answer = answer.get("raw_response", answer)
+    if isinstance(answer, dict):
+        return compact_context(answer)
+    text = str(answer or "").strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        if text.rstrip().endswith("```"):
+            text = text.rstrip()[:-3]
+    try:
+        parsed = json.loads(text)
+    except ValueError:
+        return _collapse_whitespace(text)
+    return compact_context(parsed) if isinstance(parsed, dict) else parsed
+
+
+def _render_value(value: Any) -> str:
+    if isinstance(value, list):
+        return " | ".join(str(item) for item in value)
+    if isinstance(value, dict):
+        return compact_json(value)
+    return str(value)
+
+
+def _trim_to_cap(value: Any, cap: int) -> Any:
+    if isinstance(value, str):
+        return truncate_text(value, cap)
+    if isinstance(value, list):
+        return [_trim_to_cap(item, cap) for item in value]
+    if isinstance(value, dict):
+        return {field: _trim_to_cap(item, cap) for field, item in value.items()}
+    return value
+
+
+def _longest_text(value: Any) -> int:
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, list):
+        return max((_longest_text(item) for item in value), default=0)
+    if isinstance(value, dict):
+        return max((_longest_text(item) for item in value.values()), default=0)
+    return 0
+
+
+def build_prompt(stage: str, template: str, fields: Dict[str, Any], trimmable: Optional[Dict[str, Any]] = None, config: Optional[Config] = None) -> Tuple[str, int]:
+    """
+    Format a prompt template and fit it into the stage's input-token budget
+
+    Fixed fields are formatted as given. Trimmable fields (review snippets as a list, an earlier
+    answer as a dictionary, or plain text) are rendered compactly; if the prompt is over budget,
+    every text in them is cut to one shared length cap, found by bisection, so long values are
+    shortened first and no field is dropped. A prompt that cannot fit even with every text at
+    MIN_TRIMMED_CHARS is sent at that size.
+
+    Args:
+        stage: "perplexity" or "azure_openai", selecting the budget
+        template: str.format template
+        fields: Values that are never shortened
+        trimmable: Values that may be shortened to fit the budget
+        config: Settings to use instead of the process-wide config
+
+    Returns:
+        Tuple of the prompt and its token count
+    """
+    trimmable = trimmable or {}
+    budget = input_token_budget(stage, config)
+
+    def render(cap: Optional[int]) -> Tuple[str, int]:
+        values = {field: _render_value(value if cap is None else _trim_to_cap(value, cap)) for field, value in trimmable.items()}
+        prompt = template.format(**fields, **values)
+        return prompt, count_tokens(prompt)
+
+    prompt, tokens = render(None)
+    longest = max((_longest_text(value) for value in trimmable.values()), default=0)
+    if tokens <= budget or longest <= MIN_TRIMMED_CHARS:
+        if tokens > budget:
+            print(f"[PROMPTS] {stage} prompt is {tokens} tokens, over its {budget}-token budget with nothing left to trim")
+        return prompt, tokens
+
+    low, high = MIN_TRIMMED_CHARS, longest
+    best = render(low)
+    if best[1] <= budget:
+        # Largest cap that still fits
+        while low < high:
+            cap = (low + high + 1) // 2
+            candidate = render(cap)
+            if candidate[1] <= budget:
+                low, best = cap, candidate
+            else:
+                high = cap - 1
+    else:
+        print(f"[PROMPTS] {stage} prompt is {best[1]} tokens after trimming, over its {budget}-token budget")
+    print(f"[PROMPTS] Trimmed {stage} prompt from {tokens} to {best[1]} tokens")
+    return best
@@ -0,0 +1,154 @@
+import asyncio
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Mapping, Optional, Tuple
+
+from common.config import Config, get_config
+
+# Default budgets per provider, overridable via [rate_limits.<provider>] config sections
+DEFAULT_LIMITS = {
+    "google_places": {"requests_per_minute": 600, "tokens_per_minute": None},
+    "perplexity": {"requests_per_minute": 50, "tokens_per_minute": None},
+    "azure_openai": {"requests_per_minute": 300, "tokens_per_minute": 60000},
+}
+
+# When throttled the request rate is halved, then recovers by this fraction of the configured rate per success
+THROTTLE_DECREASE_FACTOR = 0.5
+RECOVERY_INCREASE_FRACTION = 0.05
+MIN_REQUESTS_PER_MINUTE = 1.0
+
+_limiters: Dict[Tuple[str, str], "ProviderLimiter"] = {}
+_limiters_lock = threading.Lock()
+
+
+class _TokenBucket:
+    """Continuously refilling bucket; reservations may overdraw it and wait for the deficit to refill"""
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.per_minute, self.level + (now - self.updated) * self.per_minute / 60.0)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Take amount from the bucket and return how many seconds the caller must wait before using it"""
+        self._refill(now)
+        self.level -= amount
+        if self.level >= 0:
+            return 0.0
+        return -self.level * 60.0 / self.per_minute
+
+    def adjust(self, amount: float, now: float) -> None:
+        """Return (positive) or take (negative) amount after the real usage is known"""
+        self._refill(now)
+        self.level = min(self.per_minute, self.level + amount)
+
+    def set_rate(self, per_minute: float, now: float) -> None:
+        self._refill(now)
+        self.per_minute = per_minute
+        self.level = min(self.level, per_minute)
+
+
+class ProviderLimiter:
+    """
+    Request and token budget for one provider, shared by every caller in the process
+
+    The request rate adapts to throttling: a 429 halves it and pauses all callers for
+    the Retry-After interval, and each later success recovers part of the configured rate.
+    """
+
+    def __init__(self, provider: str, requests_per_minute: float, tokens_per_minute: Optional[float] = None):
+        self.provider = provider
+        self.configured_requests_per_minute = requests_per_minute
+        self.requests_per_minute = requests_per_minute
+        self._requests = _TokenBucket(requests_per_minute)
+        self._tokens = _TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    async def acquire(self, tokens: int = 0) -> None:
+        """Wait until one request (and the given number of tokens) fits in the budget"""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self._paused_until - now, 0.0, self._requests.reserve(1, now))
+            if self._tokens is not None and tokens:
+                wait = max(wait, self._tokens.reserve(tokens, now))
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def record_tokens(self, reserved: int, used: int) -> None:
+        """Correct the token budget once the provider reports real usage"""
+        if self._tokens is None:
+            return
+        with self._lock:
+            self._tokens.adjust(reserved - used, time.monotonic())
+
+    def on_throttled(self, retry_after: float) -> None:
+        """Back off after a 429: pause every caller and lower the request rate"""
+        with self._lock:
+            now = time.monotonic()
+            # Requests already in flight when the first 429 arrived don't lower the rate again
+            if now >= self._paused_until:
+                self.requests_per_minute = max(MIN_REQUESTS_PER_MINUTE, self.requests_per_minute * THROTTLE_DECREASE_FACTOR)
+                self._requests.set_rate(self.requests_per_minute, now)
+            self._paused_until = max(self._paused_until, now + retry_after)
+        print(f"[RATE LIMIT] {self.provider} throttled, pausing {retry_after:.1f}s at {self.requests_per_minute:.0f} requests/min")
+
+    def on_success(self) -> None:
+        """Recover towards the configured request rate after a successful call"""
+        if self.requests_per_minute >= self.configured_requests_per_minute:
+            return
+        with self._lock:
+            self.requests_per_minute = min(
+                self.configured_requests_per_minute,
+                self.requests_per_minute + self.configured_requests_per_minute * RECOVERY_INCREASE_FRACTION,
+            )
+            self._requests.set_rate(self.requests_per_minute, time.monotonic())
+
+
+def get_limiter(provider: str, config: Optional[Config] = None) -> ProviderLimiter:
+    """Return the process-wide limiter for a provider and config, configured from its [rate_limits] section on first use"""
+    config = config or get_config()
+    # The repr is a digest of the settings, so equal configs share a limiter
+    key = (provider, repr(config))
+    with _limiters_lock:
+        if key not in _limiters:
+            limits = dict(DEFAULT_LIMITS.get(provider, {"requests_per_minute": 60, "tokens_per_minute": None}))
+            limits.update(config.section("rate_limits").get(provider, {}))
+            _limiters[key] = ProviderLimiter(provider, limits["requests_per_minute"], limits.get("tokens_per_minute"))
+        return _limiters[key]
+
+
+def parse_retry_after(headers: Mapping[str, str], attempt: int) -> float:
+    """
+    Seconds to wait before retrying a throttled request
+
+    Args:
+        headers: Response headers of the 429 response
+        attempt: Zero-based retry attempt, used for exponential backoff when no header is present
+
+    Returns:
+        Delay in seconds
+    """
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    return min(60.0, 2.0 ** attempt)
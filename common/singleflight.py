@@ -0,0 +1,118 @@
+import asyncio
+import copy
+import functools
+import hashlib
+import json
+import weakref
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# In-flight executions per event loop, keyed by request key
+_flights: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, _Flight]]" = weakref.WeakKeyDictionary()
+
+
+class _Flight:
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        # Callbacks of every caller sharing the flight, by keyword name, and the calls made so far
+        self.subscribers: Dict[str, List[Callable[..., Any]]] = {}
+        self.history: Dict[str, List[Tuple[tuple, dict]]] = {}
+
+    def fan_out(self, name: str) -> Callable[..., None]:
+        """Callback passed to the shared execution in place of each caller's own"""
+        def dispatch(*args: Any, **kwargs: Any) -> None:
+            self.history.setdefault(name, []).append((args, kwargs))
+            for callback in list(self.subscribers.get(name, [])):
+                _call_safely(callback, args, kwargs)
+        return dispatch
+
+    def subscribe(self, callbacks: Dict[str, Callable[..., Any]]) -> None:
+        for name, callback in callbacks.items():
+            # Late joiners first get what they missed, e.g. the places event and earlier tokens
+            for args, kwargs in self.history.get(name, []):
+                _call_safely(callback, args, kwargs)
+            self.subscribers.setdefault(name, []).append(callback)
+
+    def unsubscribe(self, callbacks: Dict[str, Callable[..., Any]]) -> None:
+        for name, callback in callbacks.items():
+            if callback in self.subscribers.get(name, []):
+                self.subscribers[name].remove(callback)
+
+
+def _call_safely(callback: Callable[..., Any], args: tuple, kwargs: dict) -> None:
+    # One caller's failing callback must not break the execution the others share
+    try:
+        callback(*args, **kwargs)
+    except Exception as e:
+        print(f"[SINGLE FLIGHT] Callback failed: {e}")
+
+
+def request_key(*parts: Any) -> str:
+    """Stable hash of a call's identifying parts"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+async def single_flight(key: str, call: Callable[..., Awaitable[Any]], callbacks: Optional[Dict[str, Callable[..., Any]]] = None) -> Any:
+    """
+    Run call() once for all concurrent callers using the same key
+
+    The first caller starts the execution and later callers wait on it. Each caller gets
+    its own copy of the result, so callers may modify it freely. If every waiting caller
+    is cancelled (e.g. by a stage timeout) the shared execution is cancelled too.
+
+    Args:
+        key: Identifies identical requests, e.g. from request_key()
+        call: Callable returning the awaitable to run; with callbacks, it is called with one
+            keyword argument per callback name, a function that calls every caller's callback
+        callbacks: This caller's callbacks (e.g. on_event), which also get the calls made
+            before it joined
+
+    Returns:
+        A copy of the shared result
+    """
+    callbacks = callbacks or {}
+    loop = asyncio.get_running_loop()
+    flights = _flights.setdefault(loop, {})
+    flight = flights.get(key)
+    if flight is not None and flight.task.done():
+        # A finished or cancelled execution is only waiting for its done callback to remove it
+        flight = None
+    if flight is None:
+        flight = _Flight()
+        flight.task = asyncio.ensure_future(call(**{name: flight.fan_out(name) for name in callbacks}))
+        flights[key] = flight
+        flight.task.add_done_callback(lambda _, flight=flight: _remove(flights, key, flight))
+    else:
+        print(f"[SINGLE FLIGHT] Joining in-flight request {key[:12]}")
+
+    flight.waiters += 1
+    flight.subscribe(callbacks)
+    try:
+        result = await asyncio.shield(flight.task)
+    finally:
+        flight.waiters -= 1
+        flight.unsubscribe(callbacks)
+        if flight.waiters == 0 and not flight.task.done():
+            # Forget the flight before cancelling it, so a new caller starts afresh instead of joining it
+            _remove(flights, key, flight)
+            flight.task.cancel()
+    return copy.deepcopy(result)
+
+
+def _remove(flights: Dict[str, _Flight], key: str, flight: _Flight) -> None:
+    # Only remove the flight itself; a newer one may already run under the same key
+    if flights.get(key) is flight:
+        del flights[key]
+
+
+def coalesce(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """Decorator for async functions: concurrent calls with identical arguments share one execution"""
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        # Callbacks (e.g. on_event, on_token) don't change the result, so only their names are in the key;
+        # every caller's callbacks receive the shared execution's calls
+        callbacks = {name: value for name, value in kwargs.items() if callable(value)}
+        key_kwargs = {name: value for name, value in kwargs.items() if name not in callbacks}
+        key = request_key(func.__module__, func.__qualname__, args, key_kwargs, sorted(callbacks))
+        return await single_flight(key, lambda **fan_outs: func(*args, **{**kwargs, **fan_outs}), callbacks=callbacks)
+    return wrapper
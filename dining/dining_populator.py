@@ -1,12 +1,88 @@
-from .google_places import search_places_with_details
-from .perplexity_analyzer import analyze_place_with_perplexity
-from .openaicalls import format_with_azure_openai
+from .google_places import get_place_details_async, search_places_with_details_async
+from .perplexity_analyzer import analyze_place_with_perplexity_async
+from .openaicalls import format_with_azure_openai_async, validate_structured_output
+from common.aio import run_sync
+from common.singleflight import coalesce, request_key
+from common.deadline import Deadline, run_stage
+from common.metrics import instrumented
+import asyncio
 import json
 
-def populate_dining(restaurant_name, city):
+# Places context used when Perplexity starts before the Places lookup has returned
+SPECULATIVE_PLACES_CONTEXT = {
+    "Formatted Address": "N/A",
+    "Description": "N/A",
+    "google_rating": "N/A",
+    "Category": "N/A",
+}
+
+# Places context fields whose changes call for re-running the LLM stages on refresh; the rest
+# of what a refresh reads (rating, hours, map link) is updated in place
+FINGERPRINT_FIELDS = ["Formatted Address", "Description", "Category"]
+
+
+def context_fingerprint(places_api_output):
+    return request_key(*(places_api_output.get(field, "N/A") for field in FINGERPRINT_FIELDS))
+
+
+def format_timings(opening_hours):
+    # Places gives a list of weekday descriptions, or "N/A" when the place has no hours
+    if isinstance(opening_hours, list):
+        return "\n".join(opening_hours)
+    return opening_hours
+
+
+@coalesce
+@instrumented("dining")
+async def populate_dining_async(restaurant_name, city, use_cache=True, refresh=False, speculative=False, hedge=False, fast_path=False, deadline_seconds=None, stage_timeouts=None, on_event=None, checkpoint=None, config=None):
     print("[DINING] Starting dining populator")
-    places_api_output = search_places_with_details(restaurant_name, city)
-    if "error" in places_api_output:
+    deadline = Deadline(deadline_seconds, stage_timeouts, config=config)
+    if speculative and fast_path:
+        # A speculative Perplexity answer is written without the Places context, which only Azure
+        # merges in, so it must not be accepted as the final output
+        print("[DINING] Fast path is not used with speculative execution, formatting with Azure OpenAI")
+        fast_path = False
+
+    # on_event(stage, payload) receives the Places result as soon as it is available ("places")
+    # and the LLM answers as they stream ("perplexity_token", "azure_token"); once the call
+    # finishes it receives the per-stage timings, tokens and cost ("metrics", see common.metrics)
+    perplexity_on_token = (lambda text: on_event("perplexity_token", text)) if on_event else None
+    azure_on_token = (lambda text: on_event("azure_token", text)) if on_event else None
+
+    # config (a common.config.Config) is passed to every stage; None uses the process-wide config
+    # checkpoint holds the outputs of stages that already succeeded ("places", "perplexity",
+    # "formatted"); those stages are skipped and every newly finished stage is stored in it
+    if checkpoint is None:
+        checkpoint = {}
+
+    async def places_stage():
+        if "places" in checkpoint:
+            output = checkpoint["places"]
+        else:
+            output = await run_stage("places", search_places_with_details_async(restaurant_name, city, use_cache=use_cache, refresh=refresh, config=config), deadline)
+            if output and "error" not in output:
+                checkpoint["places"] = output
+        if on_event is not None and output and "error" not in output:
+            on_event("places", output)
+        return output
+
+    async def perplexity_stage(places_context):
+        if "perplexity" in checkpoint:
+            return checkpoint["perplexity"]
+        output = await run_stage("perplexity", analyze_place_with_perplexity_async(restaurant_name, city, places_context, use_cache=use_cache, refresh=refresh, hedge=hedge, final_schema=fast_path, on_token=perplexity_on_token, config=config), deadline)
+        if "error" not in output:
+            checkpoint["perplexity"] = output
+        return output
+
+    if speculative:
+        # Start the Perplexity research from name and city alone, in parallel with the Places lookup
+        places_api_output, perplexity_output = await asyncio.gather(
+            places_stage(),
+            perplexity_stage(SPECULATIVE_PLACES_CONTEXT),
+        )
+    else:
+        places_api_output = await places_stage()
+    if not places_api_output or "error" in places_api_output:
         return places_api_output
     
     print("[DINING] Google Places API call successful")
@@ -17,27 +93,126 @@ def populate_dining(restaurant_name, city):
         "google_rating": places_api_output["google_rating"],
         "Category": places_api_output["Category"],
     }
+    # Reviews only feed the Perplexity research prompt, so they stay out of the Azure formatting prompt
+    perplexity_places_context = {**places_context_for_llms, "reviews": places_api_output.get("reviews", [])}
 
-    perplexity_output = analyze_place_with_perplexity(restaurant_name, city, places_context_for_llms)
+    if not speculative:
+        perplexity_output = await perplexity_stage(perplexity_places_context)
     if "error" in perplexity_output:
+        if perplexity_output.get("timeout"):
+            return perplexity_output
         return {"error": "No perplexity data available"}
     
     print("[DINING] Perplexity API call successful")
     
-    formatted_output = format_with_azure_openai(restaurant_name, places_context_for_llms, perplexity_output)
-    if "error" in formatted_output:
-        return {"error": "No formatted output available"}
-    print("[DINING] Azure OpenAI API call successful")
+    formatted_output = checkpoint.get("formatted")
+    if formatted_output is None and fast_path:
+        # Perplexity was asked for the final fields directly; only call Azure if they fail local validation
+        formatted_output = validate_structured_output(perplexity_output["raw_response"], restaurant_name)
+        if "error" in formatted_output:
+            print(f"[DINING] {formatted_output['error']}, falling back to Azure OpenAI")
+            formatted_output = None
+        else:
+            print("[DINING] Structured output validated locally, skipping Azure OpenAI")
+
+    if formatted_output is None:
+        formatted_output = await run_stage("azure", format_with_azure_openai_async(restaurant_name, places_context_for_llms, perplexity_output, use_cache=use_cache, refresh=refresh, on_token=azure_on_token, config=config), deadline)
+        if "error" in formatted_output:
+            if formatted_output.get("timeout"):
+                return formatted_output
+            return {"error": "No formatted output available"}
+        print("[DINING] Azure OpenAI API call successful")
+
+    if "formatted" not in checkpoint:
+        checkpoint["formatted"] = formatted_output
+    formatted_output = dict(formatted_output)
     
     formatted_output["Heading"] = "Dining Options"
     formatted_output["Destination"] = city
     formatted_output["User Message"] = "Hi <Name>, these are the handpicked dining options by our curators for you"
-    formatted_output["Timings"] = "\n".join(places_api_output["opening_hours"])
+    formatted_output["Timings"] = format_timings(places_api_output["opening_hours"])
     formatted_output["Google Rating"] = places_api_output["google_rating"]
     formatted_output["Location"] = places_api_output["google_maps_url"]
-    formatted_output["photo_urls"] = places_api_output["photo_urls"]
+    formatted_output["photo_names"] = places_api_output.get("photo_names", [])
+    formatted_output["place_id"] = places_api_output.get("place_id", "N/A")
+    formatted_output["context_fingerprint"] = context_fingerprint(places_api_output)
     return formatted_output
 
 
+def populate_dining(restaurant_name, city, use_cache=True, refresh=False, speculative=False, hedge=False, fast_path=False, deadline_seconds=None, stage_timeouts=None, on_event=None, checkpoint=None, config=None):
+    return run_sync(populate_dining_async(
+        restaurant_name,
+        city,
+        use_cache=use_cache,
+        refresh=refresh,
+        speculative=speculative,
+        hedge=hedge,
+        fast_path=fast_path,
+        deadline_seconds=deadline_seconds,
+        stage_timeouts=stage_timeouts,
+        on_event=on_event,
+        checkpoint=checkpoint,
+        config=config,
+    ))
+
+
+@instrumented("dining", kind="refresh")
+async def refresh_dining_async(restaurant_name, city, record, use_cache=True, speculative=False, hedge=False, fast_path=False, deadline_seconds=None, stage_timeouts=None, config=None):
+    """
+    Refresh a stored dining record by place ID, re-running the LLM stages only if their Places inputs changed
+
+    Args:
+        restaurant_name: Name the record was populated for
+        city: City the record was populated for
+        record: Output of populate_dining, including place_id and context_fingerprint
+        config: Settings to use instead of the process-wide config
+        Remaining arguments are passed to populate_dining_async when the LLM stages have to re-run
+
+    Returns:
+        Updated record or error
+    """
+    place_id = record.get("place_id")
+    if not place_id or place_id == "N/A" or not record.get("context_fingerprint"):
+        print(f"[DINING] No place_id stored for '{restaurant_name}', running the full pipeline")
+        return await populate_dining_async(restaurant_name, city, use_cache=use_cache, refresh=True, speculative=speculative, hedge=hedge, fast_path=fast_path, deadline_seconds=deadline_seconds, stage_timeouts=stage_timeouts, config=config)
+
+    deadline = Deadline(deadline_seconds, stage_timeouts, config=config)
+    details = await run_stage("places", get_place_details_async(place_id, config=config), deadline)
+    if "error" in details:
+        return details
+
+    if context_fingerprint(details) != record["context_fingerprint"]:
+        print(f"[DINING] Places context changed for '{restaurant_name}', re-running the LLM stages")
+        # The LLM stages need every Places field, so fetch the rest by place ID and hand it over as the
+        # finished Places stage instead of repeating the text search (with Places done, nothing is left to speculate on)
+        places_api_output = await run_stage("places", get_place_details_async(place_id, field_profile="full", config=config), deadline)
+        if "error" in places_api_output:
+            return places_api_output
+        # The LLM stages get what is left of this refresh's deadline, not a fresh one
+        return await populate_dining_async(restaurant_name, city, use_cache=use_cache, refresh=True, speculative=False, hedge=hedge, fast_path=fast_path, deadline_seconds=deadline.remaining(), stage_timeouts=stage_timeouts, checkpoint={"places": places_api_output}, config=config)
+
+    print(f"[DINING] Places context unchanged for '{restaurant_name}', updating the Places fields only")
+    refreshed = dict(record)
+    refreshed["Timings"] = format_timings(details["opening_hours"])
+    refreshed["Google Rating"] = details["google_rating"]
+    refreshed["Location"] = details["google_maps_url"]
+    return refreshed
+
+
+def refresh_dining(restaurant_name, city, record, use_cache=True, speculative=False, hedge=False, fast_path=False, deadline_seconds=None, stage_timeouts=None, config=None):
+    return run_sync(refresh_dining_async(
+        restaurant_name,
+        city,
+        record,
+        use_cache=use_cache,
+        speculative=speculative,
+        hedge=hedge,
+        fast_path=fast_path,
+        deadline_seconds=deadline_seconds,
+        stage_timeouts=stage_timeouts,
+        config=config,
+    ))
+
+
 if __name__ == "__main__":
     print(json.dumps(populate_dining("Toit", "Bangalore"), indent=4))
\ No newline at end of file
@@ -1,45 +1,198 @@
-import requests
+import httpx
 import json
-from typing import List, Dict, Any
-import streamlit as st
+from typing import List, Dict, Any, Optional
+from common.aio import run_sync
+from common.singleflight import coalesce
+from common.http_client import get, post
+from common.cache import get_cache, normalize_key
+from common.config import Config, get_config
+from common.metrics import record_cache
 
-def search_places_with_details(place_name: str, city: str) -> Dict[str, str]:
+# Defaults for the on-disk searchText cache, overridable via the [cache] secrets section
+PLACES_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+PLACES_CACHE_MAX_ENTRIES = 5000
+
+# Place fields requested by each profile, matched to what the dining pipeline reads. Every
+# field added can move the call to a more expensive Places SKU, so only add fields that are used.
+FIELD_MASK_PROFILES = {
+    # Place ID only (the free ID-only SKU), for resolving a name to a place
+    "lookup": ["id"],
+    # Everything the populator and the LLM prompts use
+    "full": ["id", "formattedAddress", "types", "editorialSummary", "rating", "googleMapsUri", "regularOpeningHours", "photos", "reviews"],
+    # The fields that change over time (Timings, Google Rating, Location) plus the descriptive
+    # fields the populator fingerprints, for refreshing a stored record by place ID
+    "refresh": ["id", "rating", "googleMapsUri", "regularOpeningHours", "formattedAddress", "types", "editorialSummary"],
+}
+
+
+def field_mask(field_profile: str, prefix: str = "places.") -> str:
+    """Build the X-Goog-FieldMask header for a profile; use an empty prefix for Place Details"""
+    return ",".join(f"{prefix}{field}" for field in FIELD_MASK_PROFILES[field_profile])
+
+
+def get_places_cache(config: Optional[Config] = None):
+    """Return the shared Google Places cache configured from the [cache] config section"""
+    cache_settings = (config or get_config()).section("cache")
+    return get_cache(
+        "google_places",
+        ttl_seconds=cache_settings.get("places_ttl_seconds", PLACES_CACHE_TTL_SECONDS),
+        max_entries=cache_settings.get("places_max_entries", PLACES_CACHE_MAX_ENTRIES),
+    )
+
+
+def _parse_place(place: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn a Places API (New) place object into the structured place dictionary"""
+    # Extract address components for location hierarchy
+    location_info = place.get('formattedAddress', 'N/A')
+
+    # Extract category from types
+    types = place.get('types', [])
+    category = ", ".join(types) if types else 'N/A'
+
+    # Extract description
+    description = 'N/A'
+    if 'editorialSummary' in place:
+        description = place['editorialSummary'].get('text', 'N/A')
+    elif 'generativeSummary' in place:
+        description = place['generativeSummary'].get('text', 'N/A')
+
+    # Extract Google rating
+    google_rating = place.get('rating', 'N/A')
+
+    # Extract website
+    website = place.get('websiteUri', 'N/A')
+
+    # Clean website URL - remove query parameters and keep only base URL
+    if website != 'N/A' and website:
+        try:
+            # Split by '?' to remove query parameters
+            if '?' in website:
+                website = website.split('?')[0]
+            # Remove trailing slash if present
+            website = website.rstrip('/')
+        except Exception:
+            pass  # Keep original if cleaning fails
+
+    # Extract Google Maps URL
+    google_maps_url = place.get('googleMapsUri', 'N/A')
+
+    # Extract opening hours
+    opening_hours = 'N/A'
+    regular_opening_hours = place.get('regularOpeningHours', {})
+    if regular_opening_hours:
+        # Get weekday descriptions which provide formatted opening hours
+        weekday_descriptions = regular_opening_hours.get('weekdayDescriptions', [])
+        if weekday_descriptions:
+            # Clean up Unicode characters in opening hours
+            cleaned_hours = []
+            for hour_text in weekday_descriptions:
+                # Replace common Unicode characters with regular ones
+                cleaned_text = hour_text.replace('\u2009', ' ')  # Thin space -> regular space
+                cleaned_text = cleaned_text.replace('\u2013', '-')  # En dash -> hyphen
+                cleaned_text = cleaned_text.replace('\u202f', ' ')  # Narrow no-break space -> regular space
+                cleaned_text = cleaned_text.replace('\u00a0', ' ')  # Non-breaking space -> regular space
+                cleaned_hours.append(cleaned_text)
+            opening_hours = cleaned_hours
+        else:
+            opening_hours = 'N/A'
+
+    # Extract photo names; their media URIs are resolved separately
+    photos_data = place.get('photos', [])
+    photo_names = []
+
+    for photo in photos_data[:10]:  # Get only first 10 photos
+        photo_name = photo.get('name', '')
+        if photo_name:
+            photo_names.append(photo_name)
+
+    # Extract and process reviews - just the text content
+    reviews_data = place.get('reviews', [])
+    review_texts = []
+
+    for review in reviews_data:
+        review_text = review.get('text', {}).get('text', '')
+        publish_time = review.get('publishTime', 'N/A')
+
+        if review_text:  # Only include non-empty review texts
+            review_texts.append({
+                'text': review_text,
+                'publish_time': publish_time
+            })
+
+
+    # Create structured result with all required fields - return single object
+    place_data = {
+        'place_id': place.get('id', 'N/A'),
+        "Formatted Address": location_info,
+        'Category': category,
+        'Description': description,
+        'google_rating': google_rating,
+        'website': website,
+        'google_maps_url': google_maps_url,
+        'opening_hours': opening_hours,
+        'photo_names': photo_names,
+        'reviews': review_texts
+    }
+    return place_data
+
+
+@coalesce
+async def search_places_with_details_async(place_name: str, city: str, use_cache: bool = True, refresh: bool = False, field_profile: str = "full", config: Optional[Config] = None) -> Dict[str, str]:
     """
     Single function to search places and return structured data with required fields
     
     Args:
         place_name: Name of the place to search for
         city: City to search in
+        use_cache: Read from and write to the on-disk Places cache
+        refresh: Skip the cached entry and overwrite it with a fresh lookup
+        field_profile: Name of the FIELD_MASK_PROFILES entry to request; fields outside it come back as N/A
+        config: Settings to use instead of the process-wide config
         
     Returns:
-        Dictionary with keys: Country, Destination L1 (State), Destination L2 (City), 
+        Dictionary with keys: place_id, Country, Destination L1 (State), Destination L2 (City), 
         Destination L3 (Area), Category, Description, google_rating, website, google_maps_url,
-        opening_hours, photo_urls (list of 3), reviews (newest 100 review texts)
+        opening_hours, photo_names (Places photo resource names; media URIs are resolved when photos are shown),
+        reviews (newest 100 review texts)
         Returns the first place found, or empty dict if no places found
     """
     
+    config = config or get_config()
+
+    # Serve repeat lookups from the on-disk cache without spending Places quota
+    places_cache = get_places_cache(config) if use_cache else None
+    cache_key = normalize_key("dining", field_profile, place_name, city)
+    if places_cache is not None and not refresh:
+        cached_place = places_cache.get(cache_key)
+        # Entries from before photo names were stored still hold API-keyed photo URLs
+        cache_hit = cached_place is not None and "photo_names" in cached_place
+        record_cache("google_places", cache_hit)
+        if cache_hit:
+            print(f"Google Places cache hit for '{place_name}' in '{city}'")
+            return cached_place
+
     # Construct the search query
     query = f"{place_name} in {city}"
     
     # API endpoint for text search (New Places API)
-    url = "https://places.googleapis.com/v1/places:searchText"
+    url = f"{config.base_url('google_places')}/v1/places:searchText"
     
-    # Headers for the new API - Updated field mask to include reviews and rating
+    # Headers for the new API - the field mask decides which Places SKU the call is billed at
     headers = {
         'Content-Type': 'application/json',
-        'X-Goog-Api-Key': st.secrets["api_keys"]["google_places"],
-        'X-Goog-FieldMask': 'places.displayName,places.formattedAddress,places.types,places.primaryType,places.rating,places.userRatingCount,places.priceLevel,places.businessStatus,places.websiteUri,places.regularOpeningHours,places.photos,places.googleMapsUri,places.editorialSummary'
+        'X-Goog-Api-Key': config.api_key("google_places"),
+        'X-Goog-FieldMask': field_mask(field_profile)
     }
     
-    # Request body for the new API
+    # Request body for the new API - only the best match is used
     data = {
         'textQuery': query,
-        'maxResultCount': 20
+        'maxResultCount': 1
     }
     
     try:
         # Make the API request
-        response = requests.post(url, headers=headers, json=data)
+        response = await post("google_places", url, headers=headers, json=data, config=config)
         response.raise_for_status()
         
         # Parse JSON response
@@ -55,115 +208,68 @@ def search_places_with_details(place_name: str, city: str) -> Dict[str, str]:
         
         # Process only the first place
         place = places[0]
-        
-        # Extract address components for location hierarchy
-        location_info = place.get('formattedAddress', 'N/A')
-        
-        # Extract category from types
-        types = place.get('types', [])
-        category = ", ".join(types) if types else 'N/A'
-        
-        # Extract description
-        description = 'N/A'
-        if 'editorialSummary' in place:
-            description = place['editorialSummary'].get('text', 'N/A')
-        elif 'generativeSummary' in place:
-            description = place['generativeSummary'].get('text', 'N/A')
-        
-        # Extract Google rating
-        google_rating = place.get('rating', 'N/A')
-        
-        # Extract website
-        website = place.get('websiteUri', 'N/A')
-        
-        # Clean website URL - remove query parameters and keep only base URL
-        if website != 'N/A' and website:
-            try:
-                # Split by '?' to remove query parameters
-                if '?' in website:
-                    website = website.split('?')[0]
-                # Remove trailing slash if present
-                website = website.rstrip('/')
-            except Exception:
-                pass  # Keep original if cleaning fails
-        
-        # Extract Google Maps URL
-        google_maps_url = place.get('googleMapsUri', 'N/A')
-        
-        # Extract opening hours
-        opening_hours = 'N/A'
-        regular_opening_hours = place.get('regularOpeningHours', {})
-        if regular_opening_hours:
-            # Get weekday descriptions which provide formatted opening hours
-            weekday_descriptions = regular_opening_hours.get('weekdayDescriptions', [])
-            if weekday_descriptions:
-                # Clean up Unicode characters in opening hours
-                cleaned_hours = []
-                for hour_text in weekday_descriptions:
-                    # Replace common Unicode characters with regular ones
-                    cleaned_text = hour_text.replace('\u2009', ' ')  # Thin space -> regular space
-                    cleaned_text = cleaned_text.replace('\u2013', '-')  # En dash -> hyphen
-                    cleaned_text = cleaned_text.replace('\u202f', ' ')  # Narrow no-break space -> regular space
-                    cleaned_text = cleaned_text.replace('\u00a0', ' ')  # Non-breaking space -> regular space
-                    cleaned_hours.append(cleaned_text)
-                opening_hours = cleaned_hours
-            else:
-                opening_hours = 'N/A'
-        
-        # Extract and construct photo URLs
-        photos_data = place.get('photos', [])
-        photo_urls = []
-        api_key = st.secrets["api_keys"]["google_places"]
-        
-        for photo in photos_data[:10]:  # Get only first 10 photos
-            photo_name = photo.get('name', '')
-            if photo_name:
-                # Construct photo URL using the Photo API
-                photo_url = f"https://places.googleapis.com/v1/{photo_name}/media?maxHeightPx=800&maxWidthPx=800&key={api_key}"
-                photo_urls.append(photo_url)
-        
-        # Ensure we have exactly 10 photo URLs (pad with N/A if needed)
-        while len(photo_urls) < 10:
-            photo_urls.append('N/A')
-        
-        # Extract and process reviews - just the text content
-        reviews_data = place.get('reviews', [])
-        review_texts = []
-      
-        for review in reviews_data:
-            review_text = review.get('text', {}).get('text', '')
-            publish_time = review.get('publishTime', 'N/A')
-            
-            if review_text:  # Only include non-empty review texts
-                review_texts.append({
-                    'text': review_text,
-                    'publish_time': publish_time
-                })
-        
-        
-        # Create structured result with all required fields - return single object
-        place_data = {
-            "Formatted Address": location_info,
-            'Category': category,
-            'Description': description,
-            'google_rating': google_rating,
-            'website': website,
-            'google_maps_url': google_maps_url,
-            'opening_hours': opening_hours,
-            'photo_urls': photo_urls,
-            'reviews': review_texts
-        }
+        place_data = _parse_place(place)
+
+        if places_cache is not None:
+            places_cache.set(cache_key, place_data)
         
         return place_data
         
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"Error making API request: {e}")
         if hasattr(e, 'response') and e.response is not None:
             print(f"Response content: {e.response.text}")
-        return {"Error making Google Places API request": e}
+        return {"error": f"Error making Google Places API request: {str(e)}"}
+    except json.JSONDecodeError as e:
+        print(f"Error parsing JSON response: {e}")
+        return {"error": f"Error parsing JSON response in Google Places API: {str(e)}"}
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        return {"error": f"Unexpected error in Google Places API: {str(e)}"}
+
+
+@coalesce
+async def get_place_details_async(place_id: str, field_profile: str = "refresh", config: Optional[Config] = None) -> Dict[str, Any]:
+    """
+    Fetch a known place by ID with Place Details, skipping the text search
+
+    Args:
+        place_id: Google place ID, e.g. the place_id stored with a populated record
+        field_profile: Name of the FIELD_MASK_PROFILES entry to request; fields outside it come back as N/A
+        config: Settings to use instead of the process-wide config
+
+    Returns:
+        Dictionary with the same keys as search_places_with_details_async, or error
+    """
+    config = config or get_config()
+    url = f"{config.base_url('google_places')}/v1/places/{place_id}"
+    headers = {
+        'X-Goog-Api-Key': config.api_key("google_places"),
+        'X-Goog-FieldMask': field_mask(field_profile, prefix="")
+    }
+
+    try:
+        response = await get("google_places", url, headers=headers, config=config)
+        response.raise_for_status()
+        return _parse_place(response.json())
+    except httpx.HTTPError as e:
+        print(f"Error making Place Details request: {e}")
+        if hasattr(e, 'response') and e.response is not None:
+            print(f"Response content: {e.response.text}")
+        return {"error": f"Google Place Details request failed: {str(e)}"}
     except json.JSONDecodeError as e:
         print(f"Error parsing JSON response: {e}")
-        return {"Error parsing JSON response in Google Places API": e}
+        return {"error": f"Error parsing JSON response in Google Place Details: {str(e)}"}
     except Exception as e:
         print(f"Unexpected error: {e}")
-        return {"Unexpected error in Google Places API": e}
\ No newline at end of file
+        return {"error": f"Unexpected error in Google Place Details: {str(e)}"}
+
+
+def search_places_with_details(place_name: str, city: str, use_cache: bool = True, refresh: bool = False, field_profile: str = "full", config: Optional[Config] = None) -> Dict[str, str]:
+    """Blocking wrapper around search_places_with_details_async"""
+    return run_sync(search_places_with_details_async(place_name, city, use_cache=use_cache, refresh=refresh, field_profile=field_profile, config=config))
+
+
+def get_place_details(place_id: str, field_profile: str = "refresh", config: Optional[Config] = None) -> Dict[str, Any]:
+    """Blocking wrapper around get_place_details_async"""
+    return run_sync(get_place_details_async(place_id, field_profile=field_profile, config=config))
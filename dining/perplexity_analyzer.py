@@ -1,8 +1,69 @@
-import requests
-from typing import Dict, Any
-import streamlit as st
+import httpx
+from typing import Callable, Dict, Any, Optional
+from common.aio import run_sync
+from common.singleflight import coalesce
+from common.http_client import post, post_stream
+from common.hedging import get_hedger
+from common.completion_cache import completion_cache_key, get_completion_cache
+from common.config import Config, get_config
+from common.metrics import record_cache
+from common.prompts import DEFAULT_MAX_REVIEWS, DEFAULT_REVIEW_SNIPPET_CHARS, build_prompt, count_tokens, labelled_lines, review_snippets
+from common.output_budget import finish_truncated, output_token_budget, record_output_lengths
 
-def analyze_place_with_perplexity(place_name: str, city: str, places_api_output: Dict[str, Any]) -> Dict[str, Any]:
+PERPLEXITY_MODEL = "sonar-pro"
+PERPLEXITY_MAX_TOKENS = 4000
+# Places fields given to the research prompt, with their labels; empty or repeated ones are left out
+PLACE_CONTEXT_LABELS = {
+    "Category": "Google Category",
+    "Description": "Google Description",
+    "google_rating": "Google Rating",
+    "Formatted Address": "Formatted Address",
+}
+
+PERPLEXITY_RESEARCH_PROMPT = """
+Research the following restaurant using reliable, up-to-date sources and write compelling content for a travel crew's dining recommendations.
+
+Restaurant Name: {place_name}
+City: {city}
+{place_context}
+Sample Reviews: {reviews_text}
+
+Sources: the official website and social media; Zomato, Swiggy, EazyDiner, OpenTable, TripAdvisor; food blogs, professional reviews, critics and local dining guides; recent customer reviews and menus; "best of" lists.
+Use only factual, verified information from reputable sources. If something is unavailable or unclear, use "To be filled" for that field.
+
+"""
+
+# Asks for the intermediate research JSON that format_with_azure_openai turns into the final fields
+PERPLEXITY_PROMPT_TEMPLATE = PERPLEXITY_RESEARCH_PROMPT + """Respond with ONLY this JSON object, no additional text or source citations:
+
+{{
+    "restaurant_name": "Name of the restaurant from the place name",
+    "cuisines": "All types of cuisine served, e.g. 'Indian, Continental, Asian'",
+    "price": "Price range or average cost",
+    "crew_exclusive_price": "To be filled",
+    "why_we_love_it": "Compelling, personal 1-2 sentence recommendation: what makes this restaurant special, unique dishes, standout features and why someone should dine here",
+    "everything_you_need_to_know": "Comprehensive description: menu highlights, signature dishes, ambiance, service style, dietary options (veg/non-veg/vegan), reservation requirements, operating hours, special features, location details"
+}}
+"""
+
+# Asks for the final field schema directly, so the Azure formatting call can be skipped
+PERPLEXITY_STRUCTURED_PROMPT_TEMPLATE = PERPLEXITY_RESEARCH_PROMPT + """Respond with ONLY this JSON object, no additional text or source citations:
+
+{{
+    "Restaurant Name": "{place_name}",
+    "Cuisines": "All types of cuisine served, e.g. 'Indian, Continental, Asian'",
+    "Price": "To be filled",
+    "Crew Exclusive Price": "To be filled",
+    "Why we love it": "Compelling, personal 1-2 sentence recommendation: what makes this restaurant special and why someone should dine here",
+    "Everything you need to know": "Comprehensive information: menu highlights, signature dishes, ambiance, service style, dietary options (veg/non-veg/vegan), reservation requirements, operating hours, special features, location details"
+}}
+
+"Restaurant Name" must be exactly "{place_name}"; "Price" and "Crew Exclusive Price" are always "To be filled".
+"""
+
+
+@coalesce
+async def analyze_place_with_perplexity_async(place_name: str, city: str, places_api_output: Dict[str, Any], use_cache: bool = True, refresh: bool = False, hedge: bool = False, final_schema: bool = False, on_token: Optional[Callable[[str], None]] = None, config: Optional[Config] = None) -> Dict[str, Any]:
     """
     Analyze restaurant information using Perplexity Sonar Pro model for the new dining format
     
@@ -10,11 +71,18 @@ def analyze_place_with_perplexity(place_name: str, city: str, places_api_output:
         place_name: Name of the restaurant to search for
         city: City where the restaurant is located
         places_api_output: Single place dictionary from Google Places API
+        use_cache: Read from and write to the on-disk completion cache
+        refresh: Skip the cached completion and overwrite it with a fresh one
+        hedge: Send a duplicate request if the first one is unusually slow, keeping the first answer
+        final_schema: Ask for the final listing fields directly instead of the intermediate research JSON
+        on_token: Stream the answer, calling this with each piece of text as it arrives (hedging is skipped)
+        config: Settings to use instead of the process-wide config
         
     Returns:
         Dictionary with analyzed restaurant information for new format
     """
-    api_key = st.secrets["api_keys"]["perplexity"]
+    config = config or get_config()
+    api_key = config.api_key("perplexity")
     
     # Validate API key format
     if not api_key.startswith('pplx-'):
@@ -24,73 +92,45 @@ def analyze_place_with_perplexity(place_name: str, city: str, places_api_output:
     if not places_api_output:
         return {"error": "No places data provided"}
     
-    # Extract relevant information from places API output
-    google_description = places_api_output.get('Description', 'N/A')
-    google_category = places_api_output.get('Category', 'N/A')
-    google_rating = places_api_output.get('google_rating', 'N/A')
-    reviews = places_api_output.get('reviews', [])
-    formatted_address = places_api_output.get('Formatted Address', 'N/A')
-    
-    # Prepare reviews text for analysis (first 5 reviews)
-    reviews_text = ""
-    if reviews:
-        reviews_sample = reviews[:5]  # Take first 5 reviews
-        for review in reviews_sample:
-            if isinstance(review, dict) and 'text' in review:
-                reviews_text += review['text'] + " | "
-            elif isinstance(review, str):
-                reviews_text += review + " | "
-    
-    # Construct the prompt for new simplified format
-    prompt = f"""
-Please research and provide comprehensive information for the following restaurant using reliable and up-to-date sources. Focus on creating compelling content for a travel crew's dining recommendations.
-
-Restaurant Name: {place_name}
-City: {city}
-Google Category: {google_category}
-Google Description: {google_description}
-Google Rating: {google_rating}
-Sample Reviews: {reviews_text}
-Formatted Address: {formatted_address}
-
-RESEARCH INSTRUCTIONS:
-Research through multiple reliable sources including:
-- Official restaurant website and social media
-- Zomato, Swiggy, EazyDiner, OpenTable, TripAdvisor
-- Food blogs and professional restaurant reviews
-- Local dining guides and food critics
-- Recent customer reviews and menu information
-- Travel recommendation articles and "best of" lists
-
-FOCUS AREAS FOR NEW FORMAT:
-1. **Cuisines**: Identify all types of cuisine served (e.g., Indian, Continental, Asian, Italian, etc.)
+    # Only the Places fields that carry information go into the prompt, and repeated reviews are dropped
+    prompt_settings = config.section("prompts")
+    reviews = review_snippets(
+        places_api_output.get('reviews', []),
+        max_reviews=prompt_settings.get("max_reviews", DEFAULT_MAX_REVIEWS),
+        max_chars=prompt_settings.get("review_snippet_chars", DEFAULT_REVIEW_SNIPPET_CHARS),
+    )
 
-2. **Why We Love It Content**: Focus on what makes this restaurant special, unique dishes, standout features, and compelling reasons to dine here
+    # Construct the prompt for new simplified format, trimming the reviews to the input-token budget
+    prompt_template = PERPLEXITY_STRUCTURED_PROMPT_TEMPLATE if final_schema else PERPLEXITY_PROMPT_TEMPLATE
+    prompt, prompt_tokens = build_prompt(
+        "perplexity",
+        prompt_template,
+        {
+            "place_name": place_name,
+            "city": city,
+            "place_context": labelled_lines(places_api_output, PLACE_CONTEXT_LABELS),
+        },
+        trimmable={"reviews_text": reviews or "None available"},
+        config=config,
+    )
 
-3. **Everything You Need to Know**: Research all important information including menu highlights, signature dishes, ambiance, service style, dietary options, reservation policies, operating hours, special features, etc.
-
-Based on your comprehensive research, provide information in JSON format:
-
-{{
-    "restaurant_name": "Extract the name of the restaurant from the place name if available, or 'To be filled' if unclear",
-    "cuisines": "List all types of cuisine served (e.g., 'Indian, Continental, Asian') or 'To be filled' if unclear",
-    "price": "Extract the price range or average cost if available, or 'To be filled' if unclear",
-    "crew_exclusive_price": "Should be marked as 'To be filled' for now",
-    "why_we_love_it": "Compelling 1-2 sentence recommendation focusing on what makes this restaurant special and why someone should dine here. Make it personal and engaging.",
-    "everything_you_need_to_know": "Comprehensive information including: menu highlights, signature dishes, ambiance, service style, dietary options (veg/non-veg/vegan), reservation requirements, operating hours, special features, location details, etc. Format as detailed description."
-}}
-
-IMPORTANT: 
-- Focus on factual, verified information from reputable sources
-- Make "why_we_love_it" compelling and personal
-- Be comprehensive in "everything_you_need_to_know" - include all relevant restaurant information
-- If information is not available or unclear, use "To be filled" for that field
-
-Please respond with ONLY the JSON object, no additional text or source citations.
-"""
+    # Identical prompts at temperature 0 give the same answer, so reuse a cached completion
+    completion_cache = get_completion_cache(config) if use_cache else None
+    cache_key = completion_cache_key("perplexity", PERPLEXITY_MODEL, prompt_template, prompt, PERPLEXITY_MAX_TOKENS)
+    if completion_cache is not None and not refresh:
+        cached_content = completion_cache.get(cache_key)
+        record_cache("perplexity", cached_content is not None)
+        if cached_content is not None:
+            print(f"Perplexity cache hit for '{place_name}'")
+            if on_token is not None:
+                on_token(cached_content)
+            return {
+                "raw_response": cached_content,
+                "status": "success"
+            }
 
     # Perplexity API endpoint
-    url = "https://api.perplexity.ai/chat/completions"
+    url = f"{config.base_url('perplexity')}/chat/completions"
     
     # Headers
     headers = {
@@ -98,30 +138,70 @@ Please respond with ONLY the JSON object, no additional text or source citations
         "Content-Type": "application/json"
     }
     
-    # Request payload
-    payload = {
-        "model": "sonar-pro",
-        "messages": [
-            {
-                "role": "user",
-                "content": prompt
-            }
-        ],
-        "temperature": 0,
-        "max_tokens": 4000
-    }
+    # Request payload, with the output budget earlier answers to this prompt needed
+    max_tokens = output_token_budget("perplexity", prompt_template, PERPLEXITY_MAX_TOKENS, config)
+    messages = [
+        {
+            "role": "user",
+            "content": prompt
+        }
+    ]
+
+    async def complete(messages, max_tokens, hedged=False):
+        payload = {
+            "model": PERPLEXITY_MODEL,
+            "messages": messages,
+            "temperature": 0,
+            "max_tokens": max_tokens
+        }
+        estimated_tokens = prompt_tokens + sum(count_tokens(message["content"]) for message in messages[1:]) + max_tokens
+
+        async def send_request():
+            response = await post(
+                "perplexity",
+                url,
+                estimated_tokens=estimated_tokens,
+                headers=headers,
+                json=payload,
+                config=config,
+            )
+            # Raise inside the request, so a fast error response loses a hedge instead of winning it
+            response.raise_for_status()
+            return response
+
+        if on_token is not None:
+            return await post_stream(
+                "perplexity",
+                url,
+                on_token,
+                estimated_tokens=estimated_tokens,
+                headers=headers,
+                json={**payload, "stream": True},
+                config=config,
+            )
+        if hedged:
+            response = await get_hedger("perplexity", config).run(send_request)
+        else:
+            response = await send_request()
+        return response.json()
     
     try:
         # Make the API request
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        
-        # Parse response
-        response_data = response.json()
+        response_data = await complete(messages, max_tokens, hedged=hedge)
         
         # Extract the content from the response
         if 'choices' in response_data and len(response_data['choices']) > 0:
             content = response_data['choices'][0]['message']['content']
+            complete_answer = True
+            if response_data['choices'][0].get('finish_reason') == 'length':
+                # Continue or repair a cut-off answer instead of failing the run
+                content, complete_answer = await finish_truncated("perplexity", complete, prompt, content, max_tokens, PERPLEXITY_MAX_TOKENS)
+
+            # Repaired answers are incomplete, so they are neither cached nor used as length samples
+            if complete_answer:
+                record_output_lengths("perplexity", prompt_template, content, config)
+                if completion_cache is not None:
+                    completion_cache.set(cache_key, content)
             
             # Return the raw content for Azure OpenAI to process
             return {
@@ -133,7 +213,7 @@ Please respond with ONLY the JSON object, no additional text or source citations
             print("No valid response from Perplexity API")
             return {"error": "No valid response from Perplexity API"}
             
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"Error calling Perplexity API: {e}")
         if hasattr(e, 'response') and e.response is not None:
             try:
@@ -146,6 +226,12 @@ Please respond with ONLY the JSON object, no additional text or source citations
         print(f"Unexpected error: {e}")
         return {"error": f"Unexpected error: {str(e)}"}
 
+
+def analyze_place_with_perplexity(place_name: str, city: str, places_api_output: Dict[str, Any], use_cache: bool = True, refresh: bool = False, hedge: bool = False, final_schema: bool = False, on_token: Optional[Callable[[str], None]] = None, config: Optional[Config] = None) -> Dict[str, Any]:
+    """Blocking wrapper around analyze_place_with_perplexity_async"""
+    return run_sync(analyze_place_with_perplexity_async(place_name, city, places_api_output, use_cache=use_cache, refresh=refresh, hedge=hedge, final_schema=final_schema, on_token=on_token, config=config))
+
+
 def get_dining_info(place_name: str, city: str, places_api_output: Dict[str, Any]) -> Dict[str, Any]:
     """
     Simplified function to get dining establishment information
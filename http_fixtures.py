@@ -0,0 +1,152 @@
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from common.config import get_config, set_config
+from common.fixtures import fixture_scope, get_fixture_store, scope_name
+
+POPULATOR_MODULES = {
+    "accommodation": "accommodation.accommodation_populator",
+    "dining": "dining.dining_populator",
+}
+
+# Stand-in settings for replaying without real credentials or an Azure deployment
+REPLAY_DEFAULTS = {
+    "api_keys": {"google_places": "replay", "perplexity": "pplx-replay", "azure_openai": "replay"},
+    "azure_openai": {"endpoint": "https://azure-openai.replay.invalid", "deployment_name": "replay", "api_version": "2024-06-01"},
+}
+# Replayed requests cost nothing, so the provider rate limits are lifted
+UNTHROTTLED_LIMITS = {provider: {"requests_per_minute": 1_000_000, "tokens_per_minute": None} for provider in ("google_places", "perplexity", "azure_openai")}
+
+
+def _populator(category: str) -> Any:
+    # Imported after the fixture config and cache directory are in place
+    return getattr(importlib.import_module(POPULATOR_MODULES[category]), f"populate_{category}_async")
+
+
+def _populate_options(args: argparse.Namespace) -> Dict[str, Any]:
+    options: Dict[str, Any] = {"use_cache": False, "speculative": args.speculative, "fast_path": args.fast_path}
+    if args.stream:
+        options["on_event"] = lambda stage, payload: None
+    return options
+
+
+async def _record(rows: List[Dict[str, Any]], category: str, concurrency: int, populate_options: Dict[str, Any]) -> int:
+    populate = _populator(category)
+    store = get_fixture_store(get_config().section("fixtures")["path"])
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def record_row(row: Dict[str, Any]) -> bool:
+        fixture = scope_name(category, row["name"], row["city"])
+        async with semaphore:
+            with fixture_scope(fixture):
+                result = await populate(row["name"], row["city"], **populate_options)
+        if not result or "error" in result:
+            print(f"[FIXTURES] {row['name']} ({row['city']}) failed while recording: {result.get('error') if result else 'No data returned'}", file=sys.stderr)
+            return False
+        store.places[fixture] = {"category": category, "name": row["name"], "city": row["city"]}
+        return True
+
+    return sum(await asyncio.gather(*(record_row(row) for row in rows)))
+
+
+async def _replay(places: List[Dict[str, str]], runs: int, concurrency: int, populate_options: Dict[str, Any], out: Any) -> Dict[str, int]:
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    counts = {"succeeded": 0, "failed": 0}
+
+    async def replay_run(index: int) -> None:
+        place = places[index % len(places)]
+        async with semaphore:
+            with fixture_scope(scope_name(place["category"], place["name"], place["city"])):
+                result = await _populator(place["category"])(place["name"], place["city"], **populate_options)
+        counts["failed" if not result or "error" in result else "succeeded"] += 1
+        if out is not None:
+            out.write(json.dumps({"run": index, **place, "result": result}, default=str) + "\n")
+
+    await asyncio.gather(*(replay_run(index) for index in range(runs)))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record provider responses into fixture files, or replay the pipeline from them offline")
+    parser.add_argument("--fixtures", default="fixtures", help="Directory of fixture files")
+    parser.add_argument("--stream", action="store_true", help="Use the streaming LLM requests, as the Streamlit app does")
+    parser.add_argument("--speculative", action="store_true", help="Start Perplexity in parallel with the Places lookup")
+    parser.add_argument("--fast-path", action="store_true", help="Ask Perplexity for the final fields and skip Azure when they validate")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record", help="Run the pipeline against the real APIs and save every response")
+    record_parser.add_argument("input", help="CSV (name,city columns) or JSONL file of places")
+    record_parser.add_argument("--category", choices=sorted(POPULATOR_MODULES), required=True)
+    record_parser.add_argument("--concurrency", type=int, default=4, help="Number of places recorded in parallel")
+
+    replay_parser = subparsers.add_parser("replay", help="Run the pipeline from the fixture files without network access")
+    replay_parser.add_argument("--runs", type=int, help="Number of populate calls, cycling through the fixtures (defaults to one per fixture)")
+    replay_parser.add_argument("--concurrency", type=int, default=1, help="Populate calls in flight; concurrent calls for the same place share one execution")
+    replay_parser.add_argument("--strict", action="store_true", help="Fail requests whose body differs from the recording instead of serving the recorded response")
+    replay_parser.add_argument("--metrics", action="store_true", help="Write run summaries and the Prometheus file as usual")
+    replay_parser.add_argument("--output", help="JSONL file to write results to")
+
+    subparsers.add_parser("list", help="Show the recorded places and their requests")
+
+    args = parser.parse_args()
+    if args.speculative and args.fast_path:
+        parser.error("--fast-path cannot be combined with --speculative: speculative answers lack the Places context only Azure adds")
+    fixtures_dir = os.path.abspath(args.fixtures)
+    # Keep the on-disk caches out of recordings and replays, so every request goes through the fixtures
+    os.environ["DATA_FORMATTER_CACHE_DIR"] = tempfile.mkdtemp(prefix="fixtures-cache-")
+
+    if args.command == "record":
+        from bulk_populate import read_rows
+        from common.aio import run_sync
+
+        set_config(get_config().with_overrides({"fixtures": {"mode": "record", "path": fixtures_dir}}))
+        rows = read_rows(args.input)
+        started = time.perf_counter()
+        recorded = run_sync(_record(rows, args.category, args.concurrency, _populate_options(args)))
+        paths = get_fixture_store(fixtures_dir).save(fixtures_dir)
+        print(f"[FIXTURES] Recorded {recorded}/{len(rows)} places in {time.perf_counter() - started:.1f}s; {len(paths)} fixture files in {fixtures_dir}", file=sys.stderr)
+
+    elif args.command == "replay":
+        from common.aio import run_sync
+
+        overrides = {"fixtures": {"mode": "replay", "path": fixtures_dir, "strict": args.strict}, "rate_limits": UNTHROTTLED_LIMITS}
+        if not args.metrics:
+            overrides["metrics"] = {"enabled": False}
+        config = get_config()
+        for section, defaults in REPLAY_DEFAULTS.items():
+            overrides[section] = {**defaults, **config.section(section)}
+        set_config(config.with_overrides(overrides))
+
+        places = [place for place in get_fixture_store(fixtures_dir).places.values() if place]
+        if not places:
+            print(f"[FIXTURES] No fixtures found in {fixtures_dir}", file=sys.stderr)
+            sys.exit(1)
+        runs = args.runs or len(places)
+        out = open(args.output, "w", encoding="utf-8") if args.output else None
+        started = time.perf_counter()
+        try:
+            counts = run_sync(_replay(places, runs, args.concurrency, _populate_options(args), out))
+        finally:
+            if out is not None:
+                out.close()
+        elapsed = time.perf_counter() - started
+        print(f"[FIXTURES] Replayed {runs} runs ({counts['succeeded']} succeeded, {counts['failed']} failed) in {elapsed:.2f}s, {runs / elapsed * 60:.0f} runs/min", file=sys.stderr)
+
+    elif args.command == "list":
+        store = get_fixture_store(fixtures_dir)
+        for fixture, interactions in sorted(store.fixtures.items()):
+            place = store.places.get(fixture, {})
+            print(f"{fixture}: {place.get('name', '?')} ({place.get('city', '?')}), {place.get('category', '?')}")
+            for interaction in interactions:
+                print(f"    {interaction['status']} {interaction['method']} {interaction['provider']} {interaction['route']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import time
+import uuid
+from typing import Any, Dict
+
+from bulk_populate import POPULATORS, read_rows, with_photo_urls
+from common.aio import run_sync
+from common.job_queue import DEFAULT_LEASE_SECONDS, DEFAULT_MAX_ATTEMPTS, JOB_QUEUE_PATH, JobQueue
+
+
+def _release_dead_local_workers(queue: JobQueue, job: str) -> None:
+    """Requeue rows leased by worker processes on this machine that are no longer running"""
+    host_prefix = f"{socket.gethostname()}-"
+    for owner in queue.lease_owners(job):
+        if not owner.startswith(host_prefix):
+            continue
+        try:
+            os.kill(int(owner[len(host_prefix):].split("-")[0]), 0)
+        except ProcessLookupError:
+            released = queue.release(job, owner)
+            print(f"[JOBS] Requeued {released} rows left running by {owner}", file=sys.stderr)
+        except (ValueError, PermissionError):
+            continue
+
+
+async def _keep_lease(queue: JobQueue, row_id: int, worker_id: str, lease_seconds: float) -> None:
+    """Renew a row's lease until it is cancelled; returns once the lease was lost"""
+    while True:
+        await asyncio.sleep(lease_seconds / 3)
+        if not queue.renew_lease(row_id, worker_id, lease_seconds):
+            print(f"[JOBS] Lost the lease on row {row_id}", file=sys.stderr)
+            return
+
+
+async def _process_row(queue: JobQueue, row: Dict[str, Any], worker_id: str, lease_seconds: float, max_attempts: int, populate_options: Dict[str, Any]) -> bool:
+    done_stages = ", ".join(row["checkpoint"]) or "none"
+    print(f"[JOBS] {worker_id} row {row['id']}: {row['name']} ({row['city']}), attempt {row['attempts']}, finished stages: {done_stages}", file=sys.stderr)
+
+    lease_keeper = asyncio.create_task(_keep_lease(queue, row["id"], worker_id, lease_seconds))
+    populate = asyncio.ensure_future(POPULATORS[row["category"]](row["name"], row["city"], checkpoint=queue.checkpoint(row, worker_id), **populate_options))
+    try:
+        await asyncio.wait({populate, lease_keeper}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        lease_keeper.cancel()
+        lease_lost = not populate.done()
+        if lease_lost:
+            # Another worker owns the row now (or this run is shutting down), so stop working on it
+            populate.cancel()
+    if lease_lost:
+        print(f"[JOBS] Dropped row {row['id']} after losing its lease", file=sys.stderr)
+        return False
+    try:
+        result = populate.result()
+    except Exception as e:
+        result = {"error": f"Unexpected error: {str(e)}"}
+
+    if not result or "error" in result:
+        recorded = queue.fail(row["id"], worker_id, result.get("error", "No data returned") if result else "No data returned", max_attempts)
+        if not recorded:
+            print(f"[JOBS] Dropped the error for row {row['id']} after losing its lease", file=sys.stderr)
+        return False
+    if not queue.complete(row["id"], worker_id, result):
+        print(f"[JOBS] Dropped the result for row {row['id']} after losing its lease", file=sys.stderr)
+        return False
+    return True
+
+
+async def run_workers(queue: JobQueue, job: str, workers: int = 4, lease_seconds: float = DEFAULT_LEASE_SECONDS, max_attempts: int = DEFAULT_MAX_ATTEMPTS, **populate_options: Any) -> int:
+    """
+    Process a job's queued rows until none are left, resuming each row from its checkpoint
+
+    Args:
+        queue: Job queue to pull rows from
+        job: Job name
+        workers: Number of rows processed concurrently by this process
+        lease_seconds: How long a claimed row stays reserved without a heartbeat
+        max_attempts: Attempts per row before it is marked failed
+        populate_options: Keyword arguments passed to the populator, e.g. use_cache or hedge
+
+    Returns:
+        Number of rows completed by this process
+    """
+    # A restart on the same machine resumes the rows its crashed predecessor held without waiting out their leases
+    _release_dead_local_workers(queue, job)
+    process_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    completed = 0
+
+    async def worker(worker_number: int) -> None:
+        nonlocal completed
+        worker_id = f"{process_id}-{worker_number}"
+        # Idle workers keep pulling rows, including rows whose worker died and let the lease run out
+        while True:
+            row = queue.claim(job, worker_id, lease_seconds)
+            if row is None:
+                return
+            if await _process_row(queue, row, worker_id, lease_seconds, max_attempts, populate_options):
+                completed += 1
+
+    await asyncio.gather(*(worker(worker_number) for worker_number in range(max(1, workers))))
+    return completed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resumable populate jobs backed by a local SQLite queue")
+    parser.add_argument("--db", default=JOB_QUEUE_PATH, help="Job queue database file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = subparsers.add_parser("enqueue", help="Add rows from a CSV or JSONL file to a job")
+    enqueue_parser.add_argument("job", help="Job name, e.g. goa-dining")
+    enqueue_parser.add_argument("input", help="CSV (name,city columns) or JSONL file of places")
+    enqueue_parser.add_argument("--category", choices=sorted(POPULATORS), required=True)
+
+    run_parser = subparsers.add_parser("run", help="Work through a job's queue; safe to restart and to run in several processes")
+    run_parser.add_argument("job")
+    run_parser.add_argument("--workers", type=int, default=4, help="Number of rows processed in parallel")
+    run_parser.add_argument("--lease", type=float, default=DEFAULT_LEASE_SECONDS, help="Seconds before an unattended row is handed to another worker")
+    run_parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS, help="Attempts per row before it is marked failed")
+    run_parser.add_argument("--no-cache", action="store_true", help="Bypass the on-disk provider caches")
+    run_parser.add_argument("--speculative", action="store_true", help="Start Perplexity in parallel with the Places lookup")
+    run_parser.add_argument("--hedge", action="store_true", help="Hedge slow Perplexity requests with a duplicate")
+    run_parser.add_argument("--fast-path", action="store_true", help="Ask Perplexity for the final fields and skip Azure when they validate")
+    run_parser.add_argument("--deadline", type=float, help="End-to-end time limit per place in seconds")
+
+    status_parser = subparsers.add_parser("status", help="Show how many rows of a job are in each state")
+    status_parser.add_argument("job")
+
+    retry_parser = subparsers.add_parser("retry", help="Requeue a job's failed rows")
+    retry_parser.add_argument("job")
+
+    export_parser = subparsers.add_parser("export", help="Write a job's finished rows as JSONL")
+    export_parser.add_argument("job")
+    export_parser.add_argument("--output", help="JSONL file to write results to (defaults to stdout)")
+    export_parser.add_argument("--no-photo-urls", action="store_true", help="Export photo names only, without resolving their media URLs")
+
+    args = parser.parse_args()
+    if args.command == "run" and args.speculative and args.fast_path:
+        parser.error("--fast-path cannot be combined with --speculative: speculative answers lack the Places context only Azure adds")
+    queue = JobQueue(args.db)
+
+    if args.command == "enqueue":
+        added = queue.enqueue(args.job, args.category, read_rows(args.input))
+        print(f"[JOBS] Added {added} rows to {args.job}", file=sys.stderr)
+    elif args.command == "run":
+        populate_options = {
+            "use_cache": not args.no_cache,
+            "speculative": args.speculative,
+            "hedge": args.hedge,
+            "fast_path": args.fast_path,
+            "deadline_seconds": args.deadline,
+        }
+        started = time.perf_counter()
+        completed = run_sync(run_workers(queue, args.job, args.workers, args.lease, args.max_attempts, **populate_options))
+        elapsed = time.perf_counter() - started
+        print(f"[JOBS] Completed {completed} rows in {elapsed:.1f}s; status: {queue.status(args.job)}", file=sys.stderr)
+    elif args.command == "status":
+        print(json.dumps(queue.status(args.job)))
+    elif args.command == "retry":
+        print(f"[JOBS] Requeued {queue.retry_failed(args.job)} failed rows", file=sys.stderr)
+    elif args.command == "export":
+        out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+        try:
+            for output in queue.results(args.job):
+                # Media URIs expire, so they are resolved when the rows are exported rather than stored
+                if "result" in output and not args.no_photo_urls:
+                    output["result"] = run_sync(with_photo_urls(output["result"]))
+                out.write(json.dumps(output, default=str) + "\n")
+        finally:
+            if args.output:
+                out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,10 @@
 import streamlit as st
-from accommodation.accommodation_populator import populate_accommodation
-from dining.dining_populator import populate_dining
+from common.aio import run_sync, submit
+from common.config import get_config
+import importlib
 import json
+import queue
+import time
 
 # Configure page
 st.set_page_config(
@@ -10,6 +13,222 @@ st.set_page_config(
     layout="wide"
 )
 
+# How long a populated result is reused across reruns and sessions, overridable via the [cache] config section
+RESULT_CACHE_TTL_SECONDS = get_config().section("cache").get("streamlit_ttl_seconds", 60 * 60)
+
+# Minimum time between re-renders of the in-progress view while results stream in
+PROGRESS_RENDER_INTERVAL_SECONDS = 0.25
+
+MAX_PHOTOS = 10
+PHOTO_GALLERY_COLUMNS = 5
+
+# Category pipelines are imported the first time their page needs one, so a session only loads
+# the category it uses (see benchmarks/import_time.py)
+POPULATOR_MODULES = {
+    "accommodation": "accommodation.accommodation_populator",
+    "dining": "dining.dining_populator",
+}
+
+
+def get_populator(category):
+    """Import a category's pipeline on first use and return its async populate function"""
+    module = importlib.import_module(POPULATOR_MODULES[category])
+    return getattr(module, f"populate_{category}_async")
+
+
+class CacheMiss(Exception):
+    """Raised inside cached_result when there is no cached result yet, so nothing is cached"""
+
+
+@st.cache_resource(show_spinner=False)
+def start_pipeline():
+    """Create the pipeline event loop, HTTP client and rate limiters once per server process"""
+    from common.http_client import warm_up
+
+    # The populate calls below use the process-wide config, so warm its client and limiters
+    run_sync(warm_up(config=get_config()))
+
+
+@st.cache_data(ttl=RESULT_CACHE_TTL_SECONDS, show_spinner=False)
+def cached_result(category, name, city, _data=None):
+    # _data is not part of the cache key: calling with it stores a finished result
+    if _data is None:
+        raise CacheMiss()
+    return _data
+
+
+def render_progress(container, places_output, streamed, thumbnails_future=None):
+    """Render the stage results received so far into a single placeholder"""
+    with container.container():
+        if places_output is None:
+            st.info("⏳ Looking up the place on Google...")
+        else:
+            st.subheader("📍 Google Places")
+            st.write(f"**Google Rating:** {places_output.get('google_rating', 'N/A')}")
+            if isinstance(places_output.get("opening_hours"), list):
+                st.write("**Timings:**")
+                st.code("\n".join(places_output["opening_hours"]), language="text")
+            if places_output.get("google_maps_url"):
+                st.write(f"**Location:** {places_output['google_maps_url']}")
+            if thumbnails_future is not None and thumbnails_future.done():
+                thumbnails = [thumbnail for thumbnail in thumbnails_future.result() if thumbnail]
+                if thumbnails:
+                    st.image(thumbnails[:PHOTO_GALLERY_COLUMNS])
+
+        if streamed["perplexity_token"]:
+            st.subheader("🔎 Researching...")
+            st.text(streamed["perplexity_token"])
+        if streamed["azure_token"]:
+            st.subheader("✍️ Formatting...")
+            st.text(streamed["azure_token"])
+
+
+def run_with_progress(category, name, city):
+    """
+    Run the populator on the pipeline loop, showing each stage's output as soon as it arrives
+
+    Returns:
+        Tuple of the populator output and the run's metrics summary (None if none was reported)
+    """
+    from common.photos import fetch_thumbnails_async
+
+    events = queue.Queue()
+    future = submit(get_populator(category)(name, city, on_event=lambda stage, payload: events.put((stage, payload))))
+
+    progress = st.empty()
+    render_progress(progress, None, {"perplexity_token": "", "azure_token": ""})
+    places_output = None
+    thumbnails_future = None
+    streamed = {"perplexity_token": "", "azure_token": ""}
+    last_render = time.monotonic()
+    pending = False
+    thumbnails_shown = False
+    run_metrics = None
+    while not future.done() or not events.empty():
+        try:
+            stage, payload = events.get(timeout=0.1)
+            if stage == "places":
+                places_output = payload
+                # Warm the thumbnail cache while the LLM stages run
+                thumbnails_future = submit(fetch_thumbnails_async(payload.get("photo_names", [])[:MAX_PHOTOS]))
+            elif stage == "metrics":
+                run_metrics = payload
+            else:
+                streamed[stage] += payload
+            pending = True
+        except queue.Empty:
+            pass
+        if thumbnails_future is not None and thumbnails_future.done() and not thumbnails_shown:
+            thumbnails_shown = pending = True
+        if pending and time.monotonic() - last_render >= PROGRESS_RENDER_INTERVAL_SECONDS:
+            render_progress(progress, places_output, streamed, thumbnails_future)
+            last_render = time.monotonic()
+            pending = False
+
+    progress.empty()
+    return future.result(), run_metrics
+
+
+def get_metadata(category, name, city):
+    """Return the cached or freshly populated result, and the run's metrics summary if it was populated now"""
+    try:
+        return cached_result(category, name, city), None
+    except CacheMiss:
+        pass
+    data, run_metrics = run_with_progress(category, name, city)
+    if data and "error" not in data:
+        cached_result(category, name, city, _data=data)
+    return data, run_metrics
+
+
+def render_metrics(run_metrics):
+    """Show where the time (and money) of the last lookup went, stage by stage"""
+    if not run_metrics:
+        return
+    totals = run_metrics["totals"]
+    with st.expander(f"⏱️ Latency breakdown: {run_metrics['duration_s']:.2f}s total"):
+        st.table([
+            {
+                "Stage": span["stage"],
+                "Started at (s)": span["offset_s"],
+                "Duration (s)": span["duration_s"],
+                "Status": span["status"],
+                "HTTP": ", ".join(str(request["status"]) for request in span["http"]) or "-",
+                "Retries": span["retries"],
+                "Cache": ", ".join(f"{cache} {result}" for cache, result in span["cache"].items()) or "-",
+                "Prompt tokens": span["prompt_tokens"],
+                "Completion tokens": span["completion_tokens"],
+                "Cost (USD)": f"{span['cost_usd']:.4f}",
+            }
+            for span in run_metrics["stages"]
+        ])
+        st.caption(
+            f"{totals['http_requests']} requests, {totals['retries']} retries, "
+            f"{totals['prompt_tokens']} prompt + {totals['completion_tokens']} completion tokens, "
+            f"estimated cost ${totals['cost_usd']:.4f}"
+        )
+
+
+def render_photos(photo_names):
+    """Show a gallery of cached thumbnails, loading a full resolution photo only when it is asked for"""
+    # Pillow and the photo cache are only needed once a result with photos is shown
+    from common.photos import fetch_photo, fetch_thumbnails, resolve_photo_uri
+
+    thumbnails = fetch_thumbnails(photo_names)
+    columns = st.columns(PHOTO_GALLERY_COLUMNS)
+    for i, (photo_name, thumbnail) in enumerate(zip(photo_names, thumbnails)):
+        with columns[i % PHOTO_GALLERY_COLUMNS]:
+            if thumbnail is None:
+                st.write(f"**Image {i+1}:** Could not load image")
+                continue
+            st.image(thumbnail, caption=f"Image {i+1}")
+            if st.toggle("Full resolution", key=f"full_photo_{photo_name}"):
+                full_photo = fetch_photo(photo_name)
+                if full_photo:
+                    st.image(full_photo, width=400)
+                # Media URIs are short-lived and each lookup is a billed Places call, so one is only resolved when asked for
+                photo_url = resolve_photo_uri(photo_name)
+                if photo_url:
+                    st.code(photo_url, language="text")
+
+
+def render_result(data, preferred_field_order):
+    if data and "error" not in data:
+        st.success("✅ Metadata retrieved successfully!")
+
+        st.subheader("📋 Metadata Fields")
+
+        # Filter to only show fields that actually exist in the data
+        available_fields = [(display_name, key) for display_name, key in preferred_field_order if key in data]
+
+        # Add any additional fields that might be in the data but not in our preferred list
+        for key, value in data.items():
+            if key not in [field[1] for field in available_fields] and key not in ['photo_names', 'website', 'google_maps_url', 'place_id', 'context_fingerprint']:
+                # Format the key for display (replace underscores with spaces and title case)
+                display_name = key.replace('_', ' ').title()
+                available_fields.append((display_name, key))
+
+        # Display each available field with copy functionality
+        for display_name, key in available_fields:
+            value = str(data[key])
+
+            st.write(f"**{display_name}:**")
+            st.code(value, language="text")
+            st.divider()
+
+        # Display images section
+        st.subheader("🖼️ Images")
+        if data.get("photo_names"):
+            render_photos(data["photo_names"][:MAX_PHOTOS])
+        else:
+            st.write("No images available")
+
+    else:
+        error_msg = data.get("error", "Unknown error occurred") if data else "No data returned"
+        st.error(f"❌ Error: {error_msg}")
+
+
+start_pipeline()
 
 pages = st.sidebar.selectbox("Select a page", ["Accommodation", "Dining", "Activities"])
 
@@ -28,80 +247,30 @@ if pages == "Accommodation":
 
     if st.button("Get Metadata", type="primary"):
         if accommodation_name and city:
-            with st.spinner("Fetching metadata..."):
-                data = populate_accommodation(accommodation_name, city)
-
-                if data and "error" not in data:
-                    st.success("✅ Metadata retrieved successfully!")
-                    
-                    st.subheader("📋 Metadata Fields")
-                    
-                    # Define the preferred order of fields to display (if they exist)
-                    preferred_field_order = [
-                        ("Heading", "Heading"),
-                        ("Destination", "Destination"),
-                        ("User Message", "User Message"),
-                        ("Name of Stay", "Name of Stay"),
-                        ("Hotel Brand", "Hotel Brand"),
-                        ("Price: In INR", "Price: In INR"),
-                        ("Crew Exclusive Price", "Crew Exclusive Price"),
-                        ("Why we love it", "Why we love it"),
-                        ("Everything you need to know", "Everything you need to know"),
-                        ("Product Details", "Product Details"),
-                        ("Google Rating", "Google Rating"),
-                        ("Location", "Location")
-                    ]
-                    
-                    # Filter to only show fields that actually exist in the data
-                    available_fields = [(display_name, key) for display_name, key in preferred_field_order if key in data]
-                    
-                    # Add any additional fields that might be in the data but not in our preferred list
-                    for key, value in data.items():
-                        if key not in [field[1] for field in available_fields] and key not in ['photo_urls', 'website', 'google_maps_url']:
-                            # Format the key for display (replace underscores with spaces and title case)
-                            display_name = key.replace('_', ' ').title()
-                            available_fields.append((display_name, key))
-                    
-                    # Display each available field with copy functionality
-                    for display_name, key in available_fields:
-                        value = str(data[key])
-                        
-                        st.write(f"**{display_name}:**")
-                        st.code(value, language="text")
-                        st.divider()
-                    
-                    # Display images section
-                    st.subheader("🖼️ Images")
-                    if "photo_urls" in data and data["photo_urls"]:
-                        photo_urls = data["photo_urls"]
-                        
-                        # Display up to 10 images
-                        for i, photo_url in enumerate(photo_urls[:10]):
-                            if photo_url and photo_url != "N/A":
-                                st.write(f"**Image {i+1}:**")
-                                
-                                # Display the image
-                                try:
-                                    st.image(photo_url, caption=f"Image {i+1}", width=400)
-                                except:
-                                    st.write(f"Could not load image: {photo_url}")
-                                
-                                # Display the URL
-                                st.write("**URL:**")
-                                st.code(photo_url, language="text")
-                                st.divider()
-                            else:
-                                st.write(f"**Image {i+1}:** Not available")
-                                st.divider()
-                    else:
-                        st.write("No images available")
-                    
-                else:
-                    error_msg = data.get("error", "Unknown error occurred") if data else "No data returned"
-                    st.error(f"❌ Error: {error_msg}")
+            # Kept in the session so later reruns re-render it without calling the APIs
+            st.session_state["accommodation_result"], st.session_state["accommodation_metrics"] = get_metadata("accommodation", accommodation_name, city)
         else:
             st.warning("⚠️ Please enter both accommodation name and city")
 
+    if "accommodation_result" in st.session_state:
+        render_metrics(st.session_state.get("accommodation_metrics"))
+
+        # Define the preferred order of fields to display (if they exist)
+        render_result(st.session_state["accommodation_result"], [
+            ("Heading", "Heading"),
+            ("Destination", "Destination"),
+            ("User Message", "User Message"),
+            ("Name of Stay", "Name of Stay"),
+            ("Hotel Brand", "Hotel Brand"),
+            ("Price: In INR", "Price: In INR"),
+            ("Crew Exclusive Price", "Crew Exclusive Price"),
+            ("Why we love it", "Why we love it"),
+            ("Everything you need to know", "Everything you need to know"),
+            ("Product Details", "Product Details"),
+            ("Google Rating", "Google Rating"),
+            ("Location", "Location")
+        ])
+
 elif pages == "Dining":
     st.title("🍽️ Dining Metadata Populator")
     st.write("Enter restaurant details to get comprehensive metadata")
@@ -117,76 +286,26 @@ elif pages == "Dining":
 
     if st.button("Get Metadata", type="primary"):
         if restaurant_name and city:
-            with st.spinner("Fetching metadata..."):
-                data = populate_dining(restaurant_name, city)
-
-                if data and "error" not in data:
-                    st.success("✅ Metadata retrieved successfully!")
-                    
-                    st.subheader("📋 Metadata Fields")
-                    
-                    # Define the preferred order of fields to display (if they exist)
-                    preferred_field_order = [
-                        ("Heading", "Heading"),
-                        ("Destination", "Destination"),
-                        ("User Message", "User Message"),
-                        ("Restaurant Name", "Restaurant Name"),
-                        ("Cuisines", "Cuisines"),
-                        ("Price", "Price"),
-                        ("Crew Exclusive Price", "Crew Exclusive Price"),
-                        ("Why we love it", "Why we love it"),
-                        ("Everything you need to know", "Everything you need to know"),
-                        ("Timings", "Timings"),
-                        ("Google Rating", "Google Rating"),
-                        ("Location", "Location")
-                    ]
-                    
-                    # Filter to only show fields that actually exist in the data
-                    available_fields = [(display_name, key) for display_name, key in preferred_field_order if key in data]
-                    
-                    # Add any additional fields that might be in the data but not in our preferred list
-                    for key, value in data.items():
-                        if key not in [field[1] for field in available_fields] and key not in ['photo_urls', 'website', 'google_maps_url']:
-                            # Format the key for display (replace underscores with spaces and title case)
-                            display_name = key.replace('_', ' ').title()
-                            available_fields.append((display_name, key))
-                    
-                    # Display each available field with copy functionality
-                    for display_name, key in available_fields:
-                        value = str(data[key])
-                        
-                        st.write(f"**{display_name}:**")
-                        st.code(value, language="text")
-                        st.divider()
-                    
-                    # Display images section
-                    st.subheader("🖼️ Images")
-                    if "photo_urls" in data and data["photo_urls"]:
-                        photo_urls = data["photo_urls"]
-                        
-                        # Display up to 10 images
-                        for i, photo_url in enumerate(photo_urls[:10]):
-                            if photo_url and photo_url != "N/A":
-                                st.write(f"**Image {i+1}:**")
-                                
-                                # Display the image
-                                try:
-                                    st.image(photo_url, caption=f"Image {i+1}", width=400)
-                                except:
-                                    st.write(f"Could not load image: {photo_url}")
-                                
-                                # Display the URL
-                                st.write("**URL:**")
-                                st.code(photo_url, language="text")
-                                st.divider()
-                            else:
-                                st.write(f"**Image {i+1}:** Not available")
-                                st.divider()
-                    else:
-                        st.write("No images available")
-                    
-                else:
-                    error_msg = data.get("error", "Unknown error occurred") if data else "No data returned"
-                    st.error(f"❌ Error: {error_msg}")
+            # Kept in the session so later reruns re-render it without calling the APIs
+            st.session_state["dining_result"], st.session_state["dining_metrics"] = get_metadata("dining", restaurant_name, city)
         else:
             st.warning("⚠️ Please enter both restaurant name and city")
+
+    if "dining_result" in st.session_state:
+        render_metrics(st.session_state.get("dining_metrics"))
+
+        # Define the preferred order of fields to display (if they exist)
+        render_result(st.session_state["dining_result"], [
+            ("Heading", "Heading"),
+            ("Destination", "Destination"),
+            ("User Message", "User Message"),
+            ("Restaurant Name", "Restaurant Name"),
+            ("Cuisines", "Cuisines"),
+            ("Price", "Price"),
+            ("Crew Exclusive Price", "Crew Exclusive Price"),
+            ("Why we love it", "Why we love it"),
+            ("Everything you need to know", "Everything you need to know"),
+            ("Timings", "Timings"),
+            ("Google Rating", "Google Rating"),
+            ("Location", "Location")
+        ])
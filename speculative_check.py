@@ -0,0 +1,92 @@
+import argparse
+import asyncio
+import json
+import sys
+from difflib import SequenceMatcher
+from typing import Any, Dict, List
+
+from bulk_populate import POPULATORS, read_rows
+from common.aio import run_sync
+
+# Fields copied verbatim from Places or fixed text, identical in both modes by construction
+FIXED_FIELDS = {"Heading", "Destination", "User Message", "Google Rating", "Location", "Timings", "photo_names"}
+
+
+def compare_outputs(sequential: Dict[str, Any], speculative: Dict[str, Any]) -> Dict[str, float]:
+    """
+    Score how closely the speculative output matches the sequential one, field by field
+
+    Args:
+        sequential: Output of the populator in the default sequential mode
+        speculative: Output of the populator with speculative=True
+
+    Returns:
+        Dictionary of field name to similarity ratio between 0 and 1
+    """
+    scores = {}
+    for field, value in sequential.items():
+        if field in FIXED_FIELDS:
+            continue
+        other = speculative.get(field, "")
+        scores[field] = SequenceMatcher(None, str(value).lower(), str(other).lower()).ratio()
+    return scores
+
+
+async def _check_row(category: str, row: Dict[str, str], use_cache: bool) -> Dict[str, Any]:
+    populate = POPULATORS[category]
+    sequential, speculative = await asyncio.gather(
+        populate(row["name"], row["city"], use_cache=use_cache),
+        populate(row["name"], row["city"], use_cache=use_cache, speculative=True),
+    )
+    if "error" in sequential or "error" in speculative:
+        return {
+            "name": row["name"],
+            "city": row["city"],
+            "error": sequential.get("error") or speculative.get("error"),
+        }
+    return {"name": row["name"], "city": row["city"], "scores": compare_outputs(sequential, speculative)}
+
+
+async def _check_rows(category: str, rows: List[Dict[str, str]], concurrency: int, use_cache: bool) -> List[Dict[str, Any]]:
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def check_with_limit(row: Dict[str, str]) -> Dict[str, Any]:
+        async with semaphore:
+            return await _check_row(category, row, use_cache)
+
+    return await asyncio.gather(*(check_with_limit(row) for row in rows))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare speculative populate output against the sequential path")
+    parser.add_argument("input", help="CSV (name,city columns) or JSONL file of places")
+    parser.add_argument("--category", choices=sorted(POPULATORS), required=True)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--min-similarity", type=float, default=0.6, help="Fail if the mean field similarity is lower")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the on-disk provider caches")
+    args = parser.parse_args()
+
+    results = run_sync(_check_rows(args.category, read_rows(args.input), args.concurrency, not args.no_cache))
+
+    field_scores: Dict[str, List[float]] = {}
+    for result in results:
+        print(json.dumps(result), file=sys.stderr)
+        for field, score in result.get("scores", {}).items():
+            field_scores.setdefault(field, []).append(score)
+
+    summary = {field: round(sum(scores) / len(scores), 3) for field, scores in field_scores.items()}
+    all_scores = [score for scores in field_scores.values() for score in scores]
+    mean_similarity = sum(all_scores) / len(all_scores) if all_scores else 0.0
+    print(json.dumps({
+        "rows_compared": sum(1 for result in results if "scores" in result),
+        "rows_failed": sum(1 for result in results if "error" in result),
+        "mean_similarity": round(mean_similarity, 3),
+        "field_similarity": summary,
+    }, indent=4))
+
+    if mean_similarity < args.min_similarity:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()